@@ -61,6 +61,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = (
+    'website.instrumentation.PerformanceMiddleware',
+    'website.pagecache.PageCacheMiddleware',
+    'website.dbrouting.ReplicaMiddleware',
+
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -107,6 +111,43 @@ WSGI_APPLICATION = 'cms.wsgi.application'
 #    }
 #}
 
+# Anonymous GETs read from the REPLICA_DATABASE, if there is one in DATABASES
+# (see website/dbrouting.py).  To try it out locally add a second SQLite
+# database, e.g. 'replica': {..., 'NAME': os.path.join(BASE_DIR,
+# 'replica.sqlite3')}, and copy db.sqlite3 over it to "replicate".
+DATABASE_ROUTERS = ['website.dbrouting.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+
+# Fall back to the primary when the replica is more than this many seconds
+# behind, and keep a visitor on the primary for this long after they write
+REPLICA_MAX_LAG = 10
+REPLICA_PIN_SECONDS = 15
+
+
+# Caches
+# A per-process memory cache in front of a shared one (see website/tieredcache.py)
+# Locally the shared cache is on disk, in production set it to Redis in local.py
+
+CACHES = {
+    'default': {
+        'BACKEND': 'website.tieredcache.TieredCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L2':           'shared',
+            'L1_TIMEOUT':   5,
+            'LOCK_TIMEOUT': 10,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -141,3 +182,35 @@ MEDIA_URL = '/media/'
 # Wagtail settings
 
 WAGTAIL_SITE_NAME = "Mt Albert Methodist"
+
+# Make the image renditions for a page in a background process when it is
+# published (see website/renditions.py)
+PREGENERATE_RENDITIONS_ON_PUBLISH = False
+
+# Background processes run manage.py with this Python (see
+# website/background.py).  Set it when the server isn't Python itself, e.g.
+# to the virtualenv's bin/python under uWSGI.
+BACKGROUND_PYTHON = None
+BACKGROUND_JOBS_DIR = os.path.join(BASE_DIR, 'var', 'jobs')
+
+# Keep whole pages for anonymous visitors for up to this many seconds
+# (see website/pagecache.py)
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# The fraction of requests to measure, with the results in a Server-Timing
+# header and logged to website.performance (see website/instrumentation.py)
+PERFORMANCE_SAMPLE_RATE = 0
+
+# Rewrite the static .ics files in MEDIA_ROOT (see events/icalfiles.py) when
+# an event is published, the months it is on straight away and the rest in a
+# background process, as well as with the write_ical_files command
+ICAL_FILES_ON_PUBLISH = False
+
+# The snapshot of the search autocomplete index which the workers share (see
+# search/autocomplete.py), rebuilt with the build_autocomplete command
+AUTOCOMPLETE_INDEX_PATH = os.path.join(BASE_DIR, 'var', 'autocomplete.idx')
+
+# Re-run the most popular searches in a background process when a page is
+# published (see search/popular.py), as well as with the
+# warm_popular_searches command
+WARM_POPULAR_SEARCHES_ON_PUBLISH = False
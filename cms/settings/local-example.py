@@ -22,6 +22,26 @@ DATABASES = {
     }
 }
 
+# Redis for the shared cache behind the per-process one
+# (needs django-redis-cache, see requirements.txt)
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'website.tieredcache.TieredCache',
+#         'TIMEOUT': 300,
+#         'OPTIONS': {
+#             'L2':           'shared',
+#             'L1_TIMEOUT':   5,
+#             'LOCK_TIMEOUT': 10,
+#         },
+#     },
+#     'shared': {
+#         'BACKEND':  'redis_cache.RedisCache',
+#         'LOCATION': 'localhost:6379',
+#         'TIMEOUT':  300,
+#         'OPTIONS':  {'DB': 1},
+#     },
+# }
+
 # When developing Wagtail templates, we recommend django-debug-toolbar
 # for keeping track of page rendering times. To use it:
 #     pip install django-debug-toolbar==1.0.1
@@ -4,6 +4,10 @@ from .base import *
 DEBUG = False
 TEMPLATE_DEBUG = False
 
+PREGENERATE_RENDITIONS_ON_PUBLISH = True
+ICAL_FILES_ON_PUBLISH = True
+WARM_POPULAR_SEARCHES_ON_PUBLISH = True
+
 
 try:
     from .local import *
@@ -0,0 +1,42 @@
+from .dev import *
+
+import atexit
+import shutil
+import tempfile
+
+# Settings for the tests, which manage.py uses for its test command.  Files
+# the tests write go in a directory of their own, not the site's.
+
+TEST_DIR = tempfile.mkdtemp(prefix="cms-test-")
+atexit.register(shutil.rmtree, TEST_DIR, ignore_errors=True)
+
+AUTOCOMPLETE_INDEX_PATH = os.path.join(TEST_DIR, 'autocomplete.idx')
+
+# A replica alongside whatever database local.py sets up, so the replica tests
+# run too (see website/dbrouting.py).  Nothing is migrated to it, and those
+# tests drive the middleware themselves, so the other requests stay on the
+# primary.
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME':   os.path.join(TEST_DIR, 'replica.sqlite3'),
+}
+MIDDLEWARE_CLASSES = tuple(name for name in MIDDLEWARE_CLASSES
+                           if name != 'website.dbrouting.ReplicaMiddleware')
+
+# The tests clear the cache, so they get one of their own
+CACHES = {
+    'default': {
+        'BACKEND': 'website.tieredcache.TieredCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L2':           'shared',
+            'L1_TIMEOUT':   5,
+            'LOCK_TIMEOUT': 10,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test',
+        'TIMEOUT': 300,
+    },
+}
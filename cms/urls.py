@@ -14,6 +14,11 @@ urlpatterns = [
     url(r'^documents/', include(wagtaildocs_urls)),
 
     url(r'^search/$', 'search.views.search', name='search'),
+    url(r'^search/autocomplete/$', 'search.views.autocomplete',
+        name='search_autocomplete'),
+    url(r'^sitemap\.xml$', 'website.sitemap.sitemapIndex', name='sitemap'),
+    url(r'^sitemap-(?P<chunk>\d+)\.xml$', 'website.sitemap.sitemapChunk',
+        name='sitemap_chunk'),
 
     url(r'', include(wagtail_urls)),
 ]
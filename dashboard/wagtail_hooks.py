@@ -0,0 +1,63 @@
+import datetime as dt
+import holidays
+from django.template.loader import render_to_string
+from django.utils import timezone
+from wagtail.wagtailcore import hooks
+from website import stats
+from website.instrumentation import routeStats
+from website.renditions import backlog
+
+# How many of the slowest routes to show
+NumRoutes = 8
+
+# The things that are worked out ahead of, or apart from, the requests
+Precomputations = [("precompute:calendar",    "Calendar events by day"),
+                   ("precompute:occurrences", "Recurrence occurrence bitmaps"),
+                   ("precompute:holidays",    "Holiday years"),
+                   ("precompute:ical",        "Static .ics files")]
+
+def _when(timestamp):
+    if not timestamp:
+        return None
+    return dt.datetime.fromtimestamp(timestamp, timezone.utc)
+
+class PerformancePanel(object):
+    """
+    Operational numbers, all from the counters in website.stats so that
+    showing them doesn't cost any queries
+    """
+    name = 'performance'
+    order = 500
+
+    def __init__(self, request):
+        self.request = request
+
+    def render(self):
+        precomputed = []
+        for area, title in Precomputations:
+            counts = stats.get_counts(area, ("builds", "ms", "last", "years"))
+            builds = counts["builds"] or counts["years"]
+            precomputed.append({'title':  title,
+                                'builds': builds,
+                                'avg_ms': counts["ms"] / builds if builds
+                                                               else None,
+                                'last':   _when(counts["last"])})
+        routes = routeStats()
+        renditions = backlog()
+        renditions['last'] = _when(renditions['last'])
+        return render_to_string('dashboard/performance_panel.html', {
+            'hit_rates':    stats.hit_rates(),
+            'precomputed':  precomputed,
+            'holidays_version': holidays.__version__,
+            'slow_routes':  sorted(routes, key=lambda route: route['avg_ms'],
+                                   reverse=True)[:NumRoutes],
+            'heavy_routes': sorted(routes,
+                                   key=lambda route: route['max_queries'],
+                                   reverse=True)[:NumRoutes],
+            'renditions':   renditions,
+        }, request=self.request)
+
+@hooks.register('construct_homepage_panels')
+def add_performance_panel(request, panels):
+    if request.user.is_superuser:
+        panels.append(PerformancePanel(request))
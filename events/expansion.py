@@ -0,0 +1,71 @@
+# ------------------------------------------------------------------------------
+# Bulk expansion
+# The days that many recurrence rules occur on, over a long window, worked out
+# across a pool of processes.  Only rule strings and arrays of day ordinals go
+# between the processes, so the workers need nothing more than dateutil.
+# ------------------------------------------------------------------------------
+
+import heapq
+import datetime as dt
+from array import array
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from dateutil.rrule import rrulestr
+
+# How many rules to send to a worker at a time
+ChunkSize = 100
+
+def expandRule(rule, ordFrom, ordTo):
+    """
+    The ordinals of the days from ordFrom to ordTo (inclusive) that rule, a
+    string as made by str(Recurrence), occurs on
+    """
+    after  = dt.datetime.fromordinal(ordFrom)
+    before = dt.datetime.fromordinal(ordTo + 1)
+    days = array('i')
+    for occurence in rrulestr(rule):
+        if occurence >= before:
+            break
+        if occurence >= after:
+            day = occurence.toordinal()
+            if not days or days[-1] != day:
+                days.append(day)
+    return days
+
+def _expandChunk(rules, ordFrom, ordTo):
+    return [expandRule(rule, ordFrom, ordTo) for rule in rules]
+
+def expandRules(rules, date_from, date_to, workers=None):
+    """
+    The days each of rules occurs on from date_from to date_to, as arrays of
+    ordinals in the same order as rules.  The rules are shared out across
+    workers processes (default one per CPU); with one worker, or only a few
+    rules, it is all done in this process.
+    """
+    rules = list(rules)
+    ordFrom = date_from.toordinal()
+    ordTo   = date_to.toordinal()
+    chunks = [rules[num:num + ChunkSize]
+              for num in range(0, len(rules), ChunkSize)]
+    if workers == 1 or len(chunks) <= 1:
+        results = [_expandChunk(chunk, ordFrom, ordTo) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map keeps the order of the chunks
+            results = list(pool.map(_expandChunk, chunks,
+                                    repeat(ordFrom), repeat(ordTo)))
+    expanded = []
+    for result in results:
+        expanded.extend(result)
+    return expanded
+
+def mergeDays(expanded, keys=None):
+    """
+    Merge the arrays from expandRules into one list of (ordinal, key) in date
+    order, where key is from keys (default the index of the rule)
+    """
+    keys = list(keys) if keys is not None else range(len(expanded))
+    # merged by index, as the keys might not be comparable
+    merged = heapq.merge(*[zip(days, repeat(num))
+                           for num, days in enumerate(expanded)])
+    return [(day, keys[num]) for day, num in merged]
@@ -0,0 +1,206 @@
+# ------------------------------------------------------------------------------
+# Static iCalendar files
+# An .ics file for each calendar and event index, and for each of their months,
+# written into MEDIA_ROOT so that the web server can hand them out itself
+# ------------------------------------------------------------------------------
+
+import os
+import hashlib
+import tempfile
+import calendar
+import datetime as dt
+from contextlib import suppress
+from django.conf import settings
+from django.core.cache import cache
+from wagtail.wagtailcore.models import Site
+from events.models import CalendarPage, EventIndexPage, SimpleEventPage, \
+        MultidayEventPage, RecurringEventPage, RecurringEventExceptionPage
+from events.utils import event_components, wrap_calendar
+from website import stats
+from website.background import runInBackground
+
+# Where the files go, under MEDIA_ROOT
+IcalDir = "ical"
+
+# Which months get files of their own, counting from this one
+MonthsBefore = 12
+MonthsAfter  = 24
+
+def getIcalPath(page, year=None, month=None):
+    """The path, under MEDIA_ROOT, of page's .ics file or one of its months"""
+    if year is None:
+        name = "all.ics"
+    else:
+        name = "{}-{:02}.ics".format(year, month)
+    return os.path.join(IcalDir, str(page.id), name)
+
+def getIcalUrl(page, year=None, month=None):
+    return settings.MEDIA_URL + getIcalPath(page, year, month).replace(os.sep,
+                                                                       "/")
+
+def getMonths(today=None):
+    """The (year, month)s that get files of their own"""
+    today = today or dt.date.today()
+    thisMonth = today.year * 12 + today.month - 1
+    return [(num // 12, num % 12 + 1)
+            for num in range(thisMonth - MonthsBefore,
+                             thisMonth + MonthsAfter + 1)]
+
+def writeIfChanged(path, content):
+    """
+    Write content to path under MEDIA_ROOT, unless it is already there.
+    The new file is moved into place, so it is never seen half written.
+    Returns True if the file was written.
+    """
+    fullPath = os.path.join(settings.MEDIA_ROOT, path)
+    data = content.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    hashKey = "ical:sha1:{}".format(path)
+    with suppress(FileNotFoundError):
+        stat = os.stat(fullPath)
+        if stat.st_size == len(data):
+            # the hash of what is there is remembered, while it isn't touched
+            known = (digest, stat.st_mtime)
+            if cache.get(hashKey) == known:
+                return False
+            with open(fullPath, 'rb') as f:
+                if hashlib.sha1(f.read()).hexdigest() == digest:
+                    cache.set(hashKey, known, None)
+                    return False
+    dirName = os.path.dirname(fullPath)
+    os.makedirs(dirName, exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=dirName, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp makes it private, but the web server has to read it
+        os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, fullPath)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+    cache.set(hashKey, (digest, os.stat(fullPath).st_mtime), None)
+    return True
+
+# ------------------------------------------------------------------------------
+def _getEvents(page):
+    # a calendar shows all of the events, an index its own
+    events = []
+    for model in (SimpleEventPage, MultidayEventPage, RecurringEventPage):
+        pages = model.objects.live().order_by('id')
+        if isinstance(page, EventIndexPage):
+            pages = pages.child_of(page)
+        events += list(pages)
+    return events
+
+def _getMonths(event, months):
+    # which of months event is on
+    if not months:
+        return set()
+    first, last = min(months), max(months)
+    firstDay = dt.date(first[0], first[1], 1)
+    lastDay  = dt.date(last[0], last[1], calendar.monthrange(*last)[1])
+    if isinstance(event, SimpleEventPage):
+        days = [event.date]
+    elif isinstance(event, MultidayEventPage):
+        days = [max(event.date_from, firstDay) + dt.timedelta(days=num)
+                for num in range((min(event.date_to, lastDay) -
+                                  max(event.date_from, firstDay)).days + 1)]
+    else:
+        # one pass over the rule rather than one for each month
+        days = [occurence.date() for occurence in
+                event.repeat.between(dt.datetime.combine(firstDay,
+                                                         dt.time.min),
+                                     dt.datetime.combine(lastDay,
+                                                         dt.time.max),
+                                     inc=True)]
+    return {(day.year, day.month) for day in days} & set(months)
+
+def writeIcalFiles(pages=None, months=None, wholeFiles=True, site=None):
+    """
+    Write the .ics files of pages (default all the live calendars and event
+    indexes) for months (default getMonths()), and the files of all their
+    events if wholeFiles.  Returns the paths written, and the paths that
+    were already up to date.
+    """
+    if site is None:
+        site = Site.objects.get(is_default_site=True)
+    if pages is None:
+        pages = list(CalendarPage.objects.live()) +                           \
+                list(EventIndexPage.objects.live())
+    if months is None:
+        months = getMonths()
+    exceptions = {eventId: list(byDate.values()) for eventId, byDate in
+                  RecurringEventExceptionPage.exceptions                      \
+                        .getExceptionMap(dt.date.min, dt.date.max).items()}
+    # every calendar has all the events, so each is only worked out once
+    eventInfo = {}
+    def getInfo(event):
+        info = eventInfo.get(event.id)
+        if info is None:
+            info = eventInfo[event.id] = (
+                    event_components(event, site, exceptions.get(event.id, ())),
+                    _getMonths(event, months))
+        return info
+
+    allEvents = None
+
+    written   = []
+    unchanged = []
+    for page in pages:
+        if isinstance(page, EventIndexPage):
+            events = _getEvents(page)
+        else:
+            if allEvents is None:
+                allEvents = _getEvents(page)
+            events = allEvents
+        infos = [getInfo(event) for event in events]
+        feeds = []
+        if wholeFiles:
+            feeds.append((getIcalPath(page), page.title,
+                          [components for components, onMonths in infos]))
+        for year, month in months:
+            feeds.append((getIcalPath(page, year, month),
+                          "{} {}-{:02}".format(page.title, year, month),
+                          [components for components, onMonths in infos
+                           if (year, month) in onMonths]))
+        for path, name, eventsComponents in feeds:
+            content = wrap_calendar(eventsComponents, name)
+            if writeIfChanged(path, content):
+                written.append(path)
+            else:
+                unchanged.append(path)
+    # counted for the performance panel on the dashboard
+    stats.incr("precompute:ical", "builds", len(written))
+    stats.mark("precompute:ical", "last")
+    return written, unchanged
+
+def removeStaleFiles(keep):
+    """Remove the .ics files which are not in keep, returning their paths"""
+    removed = []
+    top = os.path.join(settings.MEDIA_ROOT, IcalDir)
+    keep = {os.path.join(settings.MEDIA_ROOT, path) for path in keep}
+    for dirName, dirNames, fileNames in os.walk(top):
+        for fileName in fileNames:
+            fullPath = os.path.join(dirName, fileName)
+            if fileName.endswith(".ics") and fullPath not in keep:
+                os.unlink(fullPath)
+                removed.append(os.path.relpath(fullPath, settings.MEDIA_ROOT))
+    return removed
+
+def updateIcalFiles(event, days):
+    """
+    Rewrite the month files that event might be in, after it changed on days
+    (None for too many to list), and leave rewriting the rest, all.ics and
+    all, to a background job
+    """
+    if days is not None:
+        inWindow = set(getMonths())
+        months = sorted({(day.year, day.month) for day in days} & inWindow)
+        if months:
+            pages = list(CalendarPage.objects.live())
+            index = event.get_ancestors().type(EventIndexPage).live().last()
+            if index is not None:
+                pages.append(index.specific)
+            writeIcalFiles(pages, months, wholeFiles=False)
+    runInBackground("write_ical_files")
@@ -2,12 +2,18 @@
 # Events
 # ------------------------------------------------------------------------------
 import datetime as dt
+import time
 import calendar
 from contextlib import suppress
 from collections import namedtuple
-from itertools import groupby
+from itertools import groupby, chain
+from django.conf import settings
 from django.db import models
-from wagtail.wagtailcore.models import Page, Orderable
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.core.cache import cache
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+from wagtail.wagtailcore.models import Page, Orderable, PageManager
 from wagtail.wagtailcore.fields import RichTextField
 from wagtail.wagtailadmin.edit_handlers import FieldPanel, MultiFieldPanel, \
     InlinePanel, PageChooserPanel
@@ -18,11 +24,38 @@ from wagtail.wagtailcore.url_routing import RouteResult
 from django.shortcuts import render
 from django.http.response import Http404
 from django.dispatch import receiver
+from wagtail.wagtailcore.signals import page_published, page_unpublished
 from modelcluster.fields import ParentalKey
 import holidays
 from events.recurrence import RecurrenceField, RecurrencePanel
 from events.recurrence import ExceptionDatePanel
 from website.models import RelatedLink
+from website.utils import page_url
+from website.instrumentation import timed
+from website import stats
+from website.pagecache import addCacheTags, purgeCacheTags, \
+        expireCacheAtMidnight, tagVersion, tagVersions, MenuTag
+from website.conditional import makeETag, isNotModified, notModified, \
+        setValidators
+from website.tieredcache import get_or_set
+
+
+# Page cache entries which show events from all over the site
+EventsTag = "events"
+
+# When an event was last unpublished or deleted
+EventsRemovedKey = "events:removed_at"
+
+# How long to keep the events of a calendar month, week or day
+CalendarTimeout = 60 * 60 * 24
+
+# A change to an event which affects more days than this purges all of the
+# events, rather than each day and month
+ImpactLimit = 400
+
+# The calendar months around today listed in the sitemap
+SitemapMonthsBefore = 12
+SitemapMonthsAfter  = 12
 
 
 # ------------------------------------------------------------------------------
@@ -63,8 +96,13 @@ class EventsOnDay(namedtuple("EODBase", "date days_events continuing_events")):
         return calendar.day_abbr[self.date.weekday()].lower()
     @property
     def holiday(self):
+        if self.date.year not in self.aukHols.years:
+            # this process is about to work out the holidays of another year
+            stats.incr("precompute:holidays", "years")
+            stats.mark("precompute:holidays", "last")
         return self.aukHols.get(self.date)
 
+@timed("events")
 def getAllEventsByDay(date_from, date_to):
     allEvents       = []
     simpleEvents    = SimpleEventPage.getEventsByDay(date_from, date_to)
@@ -89,7 +127,7 @@ def getAllEventsByWeek(year, month):
     firstWday = (firstDay.weekday() + 1) % 7
     def calcWeekNum(evod):
         return (evod.date.day + firstWday - 1) // 7
-    events = getAllEventsByDay(firstDay, lastDay)
+    events = getCachedEventsByDay(firstDay, lastDay)
     for weekNum, group in groupby(events, calcWeekNum):
         week = list(group)
         if len(week) < 7:
@@ -101,6 +139,113 @@ def getAllEventsByWeek(year, month):
         weeks.append(week)
     return weeks
 
+def getCachedEventsByDay(date_from, date_to):
+    """
+    getAllEventsByDay kept in the cache, separately for each range asked for,
+    until an event on one of its days is published or unpublished
+    """
+    versions = tagVersions(EventsTag, *getRangeTags(date_from, date_to))
+    key = "calendar:events:{}:{}:{}".format(date_from, date_to,
+                                            makeETag(*sorted(versions.items())))
+    built = []
+    events = get_or_set(cache, key,
+                        lambda: _buildEventsByDay(date_from, date_to, built),
+                        CalendarTimeout)
+    if not built:
+        stats.hit("calendar_events")
+    return events
+
+def _buildEventsByDay(date_from, date_to, built):
+    # counted for the performance panel on the dashboard
+    stats.miss("calendar_events")
+    built.append(True)
+    start = time.perf_counter()
+    events = getAllEventsByDay(date_from, date_to)
+    stats.incr("precompute:calendar", "builds")
+    stats.incr("precompute:calendar", "ms",
+               int((time.perf_counter() - start) * 1000))
+    stats.mark("precompute:calendar", "last")
+    return events
+
+# ------------------------------------------------------------------------------
+# Cache tags for the days and months of events, so that a change to an event
+# only purges the days it was, or is now, on
+# ------------------------------------------------------------------------------
+def dayTag(day):
+    return "events:day:{}".format(day.isoformat())
+
+def monthTag(year, month):
+    return "events:month:{}-{:02}".format(year, month)
+
+def getRangeTags(date_from, date_to):
+    """
+    The tags to add for something showing the events from date_from to
+    date_to: each day for up to a week, otherwise each month
+    """
+    numDays = (date_to - date_from).days + 1
+    if numDays <= 7:
+        return [dayTag(date_from + dt.timedelta(days=num))
+                for num in range(numDays)]
+    tags = []
+    for num in range(date_from.year * 12 + date_from.month - 1,
+                     date_to.year * 12 + date_to.month):
+        year, month = divmod(num, 12)
+        tags.append(monthTag(year, month + 1))
+    return tags
+
+def getDayTags(days):
+    """The tags of days, and of the months they are in"""
+    tags = {dayTag(day) for day in days}
+    tags.update(monthTag(day.year, day.month) for day in days)
+    return tags
+
+def getChangeImpact(was, now):
+    """
+    The days affected by an event changing from being on the days was to the
+    days now.  Either can be None for too many days to list, and then so is
+    the impact.
+    """
+    if was is None or now is None:
+        return None
+    return was | now
+
+def purgeEventDays(days):
+    """Purge what shows the events of days, or all the events if None"""
+    if days is None:
+        purgeCacheTags(EventsTag)
+    elif days:
+        purgeCacheTags(*getDayTags(days))
+
+def getWeekStart(year, week):
+    """The Sunday that starts week number week of year"""
+    jan1 = dt.date(year, 1, 1)
+    return jan1 - dt.timedelta(days=(jan1.weekday() + 1) % 7 - 7 * (week - 1))
+
+def getWeekNum(day):
+    """The (year, week number) of the week that day is in"""
+    sunday = day - dt.timedelta(days=(day.weekday() + 1) % 7)
+    year = (sunday + dt.timedelta(days=6)).year
+    return year, (sunday - getWeekStart(year, 1)).days // 7 + 1
+
+def getEventsChanges(date_from, date_to):
+    """
+    A cheap summary of the events that show between date_from and date_to:
+    when the latest of them was changed, or any event was removed, moved or
+    moved off some days, and how many there are of each type.  If neither is
+    different then neither are the events.  Worked out from
+    getCachedEventsByDay, which the calendar is then shown from.
+    """
+    pages = {}
+    for evod in getCachedEventsByDay(date_from, date_to):
+        for page in chain(evod.days_events, evod.continuing_events):
+            pages[page.id] = page
+    latest = [cache.get(EventsRemovedKey)]
+    latest += [page.latest_revision_created_at for page in pages.values()]
+    counts = [sum(1 for page in pages.values() if type(page) is model)
+              for model in EventModels]
+    latest = [when for when in latest if when is not None]
+    return (max(latest) if latest else None), counts
+
 # ------------------------------------------------------------------------------
 class SimpleEventPage(Page, EventBase):
     parent_page_types = ["events.EventIndexPage"]
@@ -141,6 +286,10 @@ class SimpleEventPage(Page, EventBase):
     def occursOn(self, when):
         return self.date == when
 
+    def getEventDays(self):
+        """The days this event shows on"""
+        return frozenset([self.date])
+
 # ------------------------------------------------------------------------------
 class MultidayEventPage(Page, EventBase):
     parent_page_types = ["events.EventIndexPage"]
@@ -187,6 +336,14 @@ class MultidayEventPage(Page, EventBase):
     def occursOn(self, when):
         return self.date_from <= when <= self.date_to
 
+    def getEventDays(self):
+        """The days this event shows on, or None if too many"""
+        numDays = (self.date_to - self.date_from).days + 1
+        if numDays > ImpactLimit:
+            return None
+        return frozenset(self.date_from + dt.timedelta(days=num)
+                         for num in range(max(numDays, 0)))
+
 # ------------------------------------------------------------------------------
 class RecurringEventPage(Page, EventBase):
     parent_page_types = ["events.EventIndexPage"]
@@ -216,11 +373,10 @@ class RecurringEventPage(Page, EventBase):
         events = [EventsOnDay(dt.date.fromordinal(ord), [], [])
                   for ord in range(ord_from, ord_to+1)]
         pages = RecurringEventPage.objects.live()
+        exceptionMap = RecurringEventExceptionPage.exceptions                 \
+                                   .getExceptionMap(date_from, date_to)
         for page in pages:
-            exceptions = {exception.date: exception
-                          for exception in RecurringEventExceptionPage.objects\
-                                   .live().child_of(page)                     \
-                                   .filter(date__range=(date_from, date_to)) }
+            exceptions = exceptionMap.get(page.id, {})
             for occurence in page.repeat.between(dt_from, dt_to, True):
                 dayNum = occurence.toordinal() - ord_from
                 exception = exceptions.get(occurence.date())
@@ -234,12 +390,42 @@ class RecurringEventPage(Page, EventBase):
     def occursOn(self, when):
         return when in self.repeat
 
+    def getEventDays(self):
+        """The days this event shows on, or None if too many (or forever)"""
+        count = self.repeat.getCount(limit=ImpactLimit)
+        if count is None or count > ImpactLimit:
+            return None
+        return frozenset(occurence.date() for occurence in self.repeat)
+
 # ------------------------------------------------------------------------------
+class ExceptionPageManager(PageManager):
+    def getExceptionMap(self, date_from, date_to, pages=None):
+        """
+        The live exceptions from date_from to date_to, of pages (or of all
+        the recurring events), as a dict of the id of the recurring event to
+        a dict of date to exception.  In one query, using the (overrides,
+        date) index.
+        """
+        exceptions = self.live().order_by()                                  \
+                         .filter(overrides__isnull=False)                     \
+                         .filter(date__range=(date_from, date_to))
+        if pages is not None:
+            exceptions = exceptions.filter(overrides__in=pages)
+        exceptionMap = {}
+        for exception in exceptions:
+            exceptionMap.setdefault(exception.overrides_id, {})               \
+                        [exception.date] = exception
+        return exceptionMap
+
 class RecurringEventExceptionPage(Page, EventBase):
     parent_page_types = ["events.RecurringEventPage"]
     subpage_types = []
     class Meta:
         verbose_name = "Event Exception Page"
+        index_together = [('overrides', 'date')]
+
+    # Wagtail always (re)sets objects to a PageManager
+    exceptions = ExceptionPageManager()
 
     # overrides is also the parent, but parent is not set until the
     # child is saved and added.  (NB: is published version of parent)
@@ -257,6 +443,23 @@ class RecurringEventExceptionPage(Page, EventBase):
     def overrides_repeat(self):
         return getattr(self.overrides, 'repeat', None)
 
+    def getEventDays(self):
+        """The day this exception is for"""
+        return frozenset([self.date])
+
+    def clean(self):
+        super().clean()
+        # only one live exception for each date
+        if self.overrides_id is not None and self.date is not None:
+            others = RecurringEventExceptionPage.exceptions                   \
+                          .getExceptionMap(self.date, self.date,
+                                           [self.overrides_id])               \
+                          .get(self.overrides_id, {})
+            other = others.get(self.date)
+            if other is not None and other.pk != self.pk:
+                raise ValidationError({'date': "There is already an exception "
+                                               "for this date"})
+
     content_panels = Page.content_panels + [
         PageChooserPanel('overrides'),
         ExceptionDatePanel('date'),
@@ -285,6 +488,76 @@ def identifyExpectantParent(sender, **kwargs):
         not page.overrides):
         page.overrides = parent
 
+EventModels = (SimpleEventPage, MultidayEventPage, RecurringEventPage,
+               RecurringEventExceptionPage)
+
+@receiver(pre_save)
+def stashEventDays(sender, instance, update_fields=None, **kwargs):
+    # the days of the published version, before it is replaced, for
+    # purgeEventsCache.  (Saving a draft revision only updates a few fields.)
+    if not issubclass(sender, EventModels) or update_fields is not None:
+        return
+    was = frozenset()
+    if instance.pk is not None:
+        old = sender.objects.filter(pk=instance.pk, live=True).first()
+        if old is not None:
+            was = old.getEventDays()
+    instance._eventDaysWas = was
+
+@receiver(page_published)
+def purgeEventsCache(sender, instance, **kwargs):
+    if issubclass(sender, EventModels):
+        was = getattr(instance, '_eventDaysWas', None)
+        days = instance.getEventDays()
+        purgeEventDays(getChangeImpact(was, days))
+        if (was is None or days is None or was - days or
+            getattr(instance, 'hide', False)):
+            # for getEventsChanges, as it has left days (or hidden an
+            # occurrence) it no longer shows a change time on
+            cache.set(EventsRemovedKey, timezone.now(), None)
+
+@receiver(page_unpublished)
+def purgeUnpublishedEvent(sender, instance, **kwargs):
+    if issubclass(sender, EventModels):
+        purgeEventDays(instance.getEventDays())
+
+@receiver(post_delete)
+def purgeDeletedEvent(sender, instance, **kwargs):
+    # deleting a page does not unpublish it first
+    if issubclass(sender, EventModels) and instance.live:
+        purgeEventDays(instance.getEventDays())
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def writeIcalFiles(sender, instance, **kwargs):
+    # the static .ics files, if they are kept up to date on publish
+    if (issubclass(sender, EventModels) and
+        getattr(settings, 'ICAL_FILES_ON_PUBLISH', False)):
+        from events.icalfiles import updateIcalFiles
+        days = instance.getEventDays()
+        if 'revision' in kwargs:
+            # published, so it may have moved from other days
+            days = getChangeImpact(getattr(instance, '_eventDaysWas', None),
+                                   days)
+        updateIcalFiles(instance, days)
+
+@receiver(page_unpublished)
+@receiver(post_delete)
+def recordEventsRemoved(sender, **kwargs):
+    # for getEventsChanges, as a missing event has no change time
+    if issubclass(sender, EventModels):
+        cache.set(EventsRemovedKey, timezone.now(), None)
+
+@receiver(post_save, sender=Page)
+def recordEventsMoved(sender, instance, **kwargs):
+    # Page.move saves the page it moved as a plain Page, and if it has gone to
+    # a new parent the links to any events in or under it have changed.  (Its
+    # url_path from before is stashed by website.models.stashUrlPath.)
+    was = getattr(instance, '_urlPathWas', None)
+    if (kwargs.get('update_fields') is None and not kwargs.get('created') and
+        was is not None and was != instance.url_path):
+        cache.set(EventsRemovedKey, timezone.now(), None)
+
 # ------------------------------------------------------------------------------
 # Event index page
 # ------------------------------------------------------------------------------
@@ -349,6 +622,17 @@ class CalendarPage(Page):
     def events(self):
         return []
 
+    @classmethod
+    def getSitemapExtras(cls, url, today):
+        """
+        The urls of the months around today, rather than all the years that
+        route() will take
+        """
+        thisMonth = today.year * 12 + today.month - 1
+        return ["{}{}/{}/".format(url, num // 12, num % 12 + 1)
+                for num in range(thisMonth - SitemapMonthsBefore,
+                                 thisMonth + SitemapMonthsAfter + 1)]
+
     def route(self, request, components):
         # see http://docs.wagtail.io/en/latest/reference/pages/model_recipes.html
         if components:
@@ -367,6 +651,12 @@ class CalendarPage(Page):
             value = int(components[0])
             if 1900 <= value <= 2115:
                 kwargs['year'] = value
+        if len(components) > 2 and components[1] == "week":
+            with suppress(ValueError, TypeError):
+                value = int(components[2])
+                if 1 <= value <= 53:
+                    kwargs['week'] = value
+            return kwargs
         if len(components) > 1:
             try:
                 kwargs['month'] = MonthAbbrs.index(components[1])
@@ -382,14 +672,48 @@ class CalendarPage(Page):
                     kwargs['day'] = value
         return kwargs
 
-    def serve(self, request, year=None, month=None, day=None):
+    def serve(self, request, year=None, month=None, day=None, week=None):
         today = dt.date.today()
-        yesterday = today - dt.timedelta(1)
-        lastWeek  = today - dt.timedelta(7)
+        expireCacheAtMidnight(request)
         if year is None:
             year = today.year
-        if month is None:
-            month = today.month
+        if week is not None:
+            firstDay = getWeekStart(year, week)
+            lastDay  = firstDay + dt.timedelta(days=6)
+            if lastDay.year != year:
+                # it's week 1 of the next year
+                raise Http404
+            view = self._serveWeek
+        elif day is not None and month is not None:
+            try:
+                firstDay = lastDay = dt.date(year, month, day)
+            except ValueError:
+                raise Http404
+            view = self._serveDay
+        else:
+            if month is None:
+                month = today.month
+            firstDay = dt.date(year, month, 1)
+            lastDay  = dt.date(year, month, calendar.monthrange(year, month)[1])
+            view = self._serveMonth
+        addCacheTags(request, EventsTag, *getRangeTags(firstDay, lastDay))
+        public = not request.user.is_authenticated()
+        etag, lastModified = self._getValidators(firstDay, lastDay, today,
+                                                 public)
+        if isNotModified(request, etag, lastModified):
+            return setValidators(notModified(), etag, lastModified, public)
+        myUrl = page_url(self, request.site)
+        template, context = view(myUrl, firstDay, lastDay)
+        context.update({'self':         self,
+                        'calendarUrl':  myUrl,
+                        'today':        today,
+                        'yesterday':    today - dt.timedelta(1),
+                        'lastweek':     today - dt.timedelta(7)})
+        response = render(request, template, context)
+        return setValidators(response, etag, lastModified, public)
+
+    def _serveMonth(self, myUrl, firstDay, lastDay):
+        year, month = firstDay.year, firstDay.month
         eventsByWeek = getAllEventsByWeek(year, month)
         prevMonth = month - 1
         prevMonthYear = year
@@ -401,19 +725,61 @@ class CalendarPage(Page):
         if nextMonth == 13:
             nextMonth = 1
             nextMonthYear = year + 1
-        return render(request, self.template,
-                      {'self':         self,
-                       'year':         year,
-                       'month':        month,
-                       'today':        today,
-                       'yesterday':    yesterday,
-                       'lastweek':     lastWeek,
-                       'prevMonthUrl': "{}{}/{}/".format(self.url, prevMonthYear, prevMonth),
-                       'nextMonthUrl': "{}{}/{}/".format(self.url, nextMonthYear, nextMonth),
-                       'prevYearUrl':  "{}{}/{}/".format(self.url, year - 1, month),
-                       'nextYearUrl':  "{}{}/{}/".format(self.url, year + 1, month),
-                       'monthName':    calendar.month_name[month],
-                       'events':       eventsByWeek})
+        return self.template, {
+                 'year':         year,
+                 'month':        month,
+                 'prevMonthUrl': "{}{}/{}/".format(myUrl, prevMonthYear, prevMonth),
+                 'nextMonthUrl': "{}{}/{}/".format(myUrl, nextMonthYear, nextMonth),
+                 'prevYearUrl':  "{}{}/{}/".format(myUrl, year - 1, month),
+                 'nextYearUrl':  "{}{}/{}/".format(myUrl, year + 1, month),
+                 'monthName':    calendar.month_name[month],
+                 'events':       eventsByWeek}
+
+    def _serveWeek(self, myUrl, firstDay, lastDay):
+        # only the days of the week, not the whole month
+        week = getCachedEventsByDay(firstDay, lastDay)
+        prevYear, prevWeek = getWeekNum(firstDay - dt.timedelta(days=7))
+        nextYear, nextWeek = getWeekNum(firstDay + dt.timedelta(days=7))
+        return "events/calendar_page_week.html", {
+                 'firstDay':     firstDay,
+                 'lastDay':      lastDay,
+                 'prevWeekUrl':  "{}{}/week/{}/".format(myUrl, prevYear, prevWeek),
+                 'nextWeekUrl':  "{}{}/week/{}/".format(myUrl, nextYear, nextWeek),
+                 'monthUrl':     "{}{}/{}/".format(myUrl, firstDay.year,
+                                                   firstDay.month),
+                 'events':       [week]}
+
+    def _serveDay(self, myUrl, firstDay, lastDay):
+        evod = getCachedEventsByDay(firstDay, lastDay)[0]
+        prevDay = firstDay - dt.timedelta(days=1)
+        nextDay = firstDay + dt.timedelta(days=1)
+        year, week = getWeekNum(firstDay)
+        return "events/calendar_page_day.html", {
+                 'evod':         evod,
+                 'prevDayUrl':   "{}{}/{}/{}/".format(myUrl, prevDay.year,
+                                                      prevDay.month, prevDay.day),
+                 'nextDayUrl':   "{}{}/{}/{}/".format(myUrl, nextDay.year,
+                                                      nextDay.month, nextDay.day),
+                 'weekUrl':      "{}{}/week/{}/".format(myUrl, year, week),
+                 'monthUrl':     "{}{}/{}/".format(myUrl, firstDay.year,
+                                                   firstDay.month)}
+
+    def _getValidators(self, firstDay, lastDay, today, public):
+        # The ETag and Last-Modified of a month, week or day, worked out
+        # from its cached events without rendering it.  Last-Modified is at
+        # least today's midnight as the calendar marks out today, and the
+        # last time events were removed or moved (EventsRemovedKey, in
+        # getEventsChanges).
+        latest, counts = getEventsChanges(firstDay, lastDay)
+        midnight = timezone.make_aware(dt.datetime.combine(today, dt.time.min),
+                                       timezone.get_current_timezone())
+        lastModified = max(when for when in (latest, midnight,
+                                             self.latest_revision_created_at)
+                           if when is not None)
+        etag = makeETag(self.id, self.url_path, firstDay, lastDay, today,
+                        lastModified.isoformat(), counts, holidays.__version__,
+                        public, tagVersion(MenuTag))
+        return etag, lastModified
 
     content_panels = Page.content_panels + [
         FieldPanel('intro', classname="full"),
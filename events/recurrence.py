@@ -4,7 +4,11 @@
 # Somewhat based upon RFC5545 RRules, implemented using dateutil.rrule
 # Does not support timezones ... and probably never will
 import sys
+import time
+import weakref
+import threading
 from operator import attrgetter
+from functools import lru_cache
 import calendar
 import json
 import datetime as dt
@@ -18,9 +22,11 @@ from wagtail.utils.widgets import WidgetWithScript
 from wagtail.wagtailadmin.widgets import AdminDateInput
 from wagtail.wagtailadmin.edit_handlers import BaseFieldPanel
 from dateutil.rrule import rrule, rrulestr, rrulebase
-from dateutil.rrule import WEEKLY, MONTHLY, YEARLY
+from dateutil.rrule import DAILY, WEEKLY, MONTHLY, YEARLY
 from dateutil.rrule import weekday as rrweekday
 from dateutil.parser import parse as dt_parse
+from website.instrumentation import timed
+from website import stats
 
 # ------------------------------------------------------------------------------
 # Use Sunday as the first day of the week following Jewish tradition
@@ -42,6 +48,9 @@ class Weekday(rrweekday):
             return "{:+d}{}".format(self.n, s)
 
 # ------------------------------------------------------------------------------
+# The most occurrences to count one at a time
+CountLimit = 100000
+
 class Recurrence(rrulebase):
     def __init__(self, *args, **kwargs):
         super().__init__()
@@ -94,8 +103,104 @@ class Recurrence(rrulebase):
     def _iter(self):
         return self.rule._iter()
 
-    def getCount(self):
-        return self.rule.count()
+    @timed("recurrence")
+    def between(self, after, before, inc=False, count=1):
+        return super().between(after, before, inc, count)
+
+    def getCount(self, limit=CountLimit):
+        """
+        How many occurrences there are.  None if the rule goes on forever, or
+        if it has to be counted one by one and there are more than limit.
+        """
+        if not self.count and not self.until:
+            return None
+        if self._timeOfDay() is not None:
+            count = self.occurrences.countAll()
+            if count is not None:
+                return count
+        return self._countUpTo(self.rule, limit)
+
+    def countBetween(self, after, before, inc=False, limit=CountLimit):
+        """
+        How many occurrences there are between after and before (as for
+        between), without making them.  None if they have to be counted
+        one by one and there are more than limit.
+        """
+        timeOfDay = self._timeOfDay()
+        if timeOfDay is not None:
+            first = after.date()
+            if after.time() > timeOfDay or (after.time() == timeOfDay and
+                                            not inc):
+                first += dt.timedelta(days=1)
+            last = before.date()
+            if before.time() < timeOfDay or (before.time() == timeOfDay and
+                                             not inc):
+                last -= dt.timedelta(days=1)
+            count = self.occurrences.countDays(first.toordinal(),
+                                               last.toordinal())
+            if count is not None:
+                return count
+        def window():
+            for occurence in self.rule:
+                if occurence > before or (occurence == before and not inc):
+                    return
+                if occurence > after or (occurence == after and inc):
+                    yield occurence
+        return self._countUpTo(window(), limit)
+
+    @staticmethod
+    def _countUpTo(occurences, limit):
+        count = 0
+        for occurence in occurences:
+            count += 1
+            if limit is not None and count > limit:
+                return None
+        return count
+
+    def _timeOfDay(self):
+        # the time of the occurrences, or None if there is more than one a day
+        if (len(self.byhour) > 1 or len(self.byminute) > 1 or
+            len(self.bysecond) > 1):
+            return None
+        return dt.time(next(iter(self.byhour), 0),
+                       next(iter(self.byminute), 0),
+                       next(iter(self.bysecond), 0))
+
+    @property
+    def occurrences(self):
+        """
+        The OccurrenceBitmap of this rule, made when first wanted and shared
+        with any other Recurrence of the same rule
+        """
+        bitmap = _bitmaps.get(self.rule)
+        if bitmap is None:
+            start = time.perf_counter()
+            bitmap = _bitmaps[self.rule] = OccurrenceBitmap(self.rule)
+            # counted for the performance panel on the dashboard
+            stats.incr("precompute:occurrences", "builds")
+            stats.incr("precompute:occurrences", "ms",
+                       int((time.perf_counter() - start) * 1000))
+            stats.mark("precompute:occurrences", "last")
+        return bitmap
+
+    def occursOn(self, day):
+        """Does this rule have an occurrence on the date day?"""
+        found = self.occurrences.occursOn(day.toordinal())
+        if found is None:
+            # beyond what the bitmap covers, ask the rule
+            start = dt.datetime.combine(day, dt.time.min)
+            occurence = self.rule.after(start, inc=True)
+            found = (occurence is not None and
+                     occurence < start + dt.timedelta(days=1))
+        return found
+
+    def __contains__(self, item):
+        if isinstance(item, dt.datetime):
+            timeOfDay = self._timeOfDay()
+            if timeOfDay is None:
+                return super().__contains__(item)
+            return item.time() == timeOfDay and self.occursOn(item.date())
+        return self.occursOn(item)
 
     def __str__(self):
         freqChoices = ("YEARLY", "MONTHLY", "WEEKLY", "DAILY")
@@ -134,6 +239,197 @@ class Recurrence(rrulebase):
         retval = dtstart + rrule
         return retval
 
+# ------------------------------------------------------------------------------
+# Occurrence bitmaps
+# ------------------------------------------------------------------------------
+# A bit for each day from dtstart saying whether the rule occurs on that day.
+# A rule with no end repeats itself: after interval days or weeks if it is
+# just daily or weekly, or else after some number of 400 year Gregorian
+# cycles.  So only one period of the rule needs to be kept, and a rule that
+# ends on a date is the same but cut short.
+
+# Days in 400 years, which is also a whole number of weeks
+GregorianCycle = 146097
+
+# Longer periods than this aren't worth it (nor are longer horizons)
+MaxPeriod = 4 * GregorianCycle
+
+# How far ahead from dtstart to look for rules that don't repeat
+HorizonDays = GregorianCycle
+
+# A bitmap is first made out to this many days past today, and only made
+# further, up to its period or horizon, when later days are asked about
+AheadDays = 2 * 366
+
+def _lcm(a, b):
+    x, y = a, b
+    while y:
+        x, y = y, x % y
+    return a * b // x
+
+def _findPeriod(rule):
+    """The number of days after which rule repeats itself, or None"""
+    if rule._count or rule._until or rule._byeaster:
+        return None
+    interval = rule._interval
+    calendarBased = (rule._bymonth or rule._bymonthday or rule._bynmonthday or
+                     rule._byyearday or rule._byweekno or rule._bysetpos or
+                     rule._bynweekday)
+    if rule._freq == DAILY:
+        if not calendarBased:
+            return _lcm(interval, 7) if rule._byweekday else interval
+        period = _lcm(interval, GregorianCycle)
+    elif rule._freq == WEEKLY:
+        if not calendarBased:
+            return 7 * interval
+        period = _lcm(7 * interval, GregorianCycle)
+    elif rule._freq == MONTHLY:
+        period = _lcm(interval, 4800) // 4800 * GregorianCycle
+    elif rule._freq == YEARLY:
+        period = _lcm(interval, 400) // 400 * GregorianCycle
+    else:
+        return None
+    return period if period <= MaxPeriod else None
+
+def _popcount(data):
+    return bin(int.from_bytes(data, 'little')).count('1')
+
+class OccurrenceBitmap:
+    """
+    Which days a rule occurs on, for O(1) lookups and counting by arithmetic.
+    Covers either one period of the rule, all of a rule that ends, or else
+    up to HorizonDays; but only as far as it has been asked about, starting
+    with AheadDays past today.
+    """
+    def __init__(self, rule, today=None):
+        self.start = rule._dtstart.toordinal()
+        # the last day (from start) there can be an occurrence, if UNTIL
+        self.end = None
+        if rule._until:
+            earliest = dt.time(min(rule._byhour or [0]),
+                               min(rule._byminute or [0]),
+                               min(rule._bysecond or [0]))
+            self.end = rule._until.toordinal() - self.start
+            if rule._until.time() < earliest:
+                self.end -= 1
+            rule = rule.replace(until=None)
+        self.period = _findPeriod(rule)
+        self.size = self.period or HorizonDays
+        if self.period is None and self.end is not None:
+            self.size = max(0, min(self.size, self.end + 1))
+        self._occurences = iter(rule)
+        self._next = self._nextDay()
+        self._lock = threading.Lock()
+        self.length = 0
+        self.bits = b""
+        self.total = 0
+        self.complete = self._next is None
+        today = today or dt.date.today()
+        self._makeTo(today.toordinal() - self.start + AheadDays)
+
+    def _nextDay(self):
+        occurence = next(self._occurences, None)
+        if occurence is None:
+            return None
+        return occurence.toordinal() - self.start
+
+    def _makeTo(self, limit):
+        # make the bits for the days before limit, if they aren't yet
+        limit = min(limit, self.size)
+        if limit <= self.length:
+            return
+        with self._lock:
+            if limit <= self.length:
+                return
+            bits = bytearray(self.bits)
+            bits.extend(bytes((limit + 7) // 8 - len(bits)))
+            day = self._next
+            while day is not None and day < limit:
+                bits[day >> 3] |= 1 << (day & 7)
+                day = self._nextDay()
+            self._next = day
+            # readers only look at bits up to length, so set that last
+            self.bits = bytes(bits)
+            self.total = _popcount(self.bits)
+            self.length = limit
+            # if the rule has run out we know about every day after it
+            if day is None:
+                self.complete = True
+            elif limit == self.size:
+                self.complete = (self.period is not None or
+                                 (self.end is not None and
+                                  self.end < self.size))
+
+    def occursOn(self, ordinal):
+        """True or False for the day ordinal, or None if it isn't known"""
+        day = ordinal - self.start
+        if day < 0 or (self.end is not None and day > self.end):
+            return False
+        if day >= self.length:
+            if self.period:
+                day %= self.period
+            if day >= self.length:
+                self._makeTo(day + AheadDays)
+            if day >= self.length:
+                return False if self.complete else None
+        return bool(self.bits[day >> 3] & (1 << (day & 7)))
+
+    def countDays(self, firstOrdinal, lastOrdinal):
+        """
+        How many days from firstOrdinal to lastOrdinal inclusive have an
+        occurrence, or None if it isn't known
+        """
+        first = max(firstOrdinal - self.start, 0)
+        last = lastOrdinal - self.start
+        if self.end is not None:
+            last = min(last, self.end)
+        if last < first:
+            return 0
+        upto = self._countBefore(last + 1)
+        if upto is None:
+            return None
+        return upto - self._countBefore(first)
+
+    def countAll(self):
+        """How many occurrences there are, or None if unbounded or unknown"""
+        if self.end is not None:
+            return self.countDays(self.start, self.start + self.end)
+        if self.period is None:
+            self._makeTo(self.size)
+            if self.complete:
+                return self.total
+        return None
+
+    def _countBefore(self, day):
+        # the number of occurrences on the days before day
+        if day > self.length:
+            if self.period and day > self.period:
+                self._makeTo(self.period)
+                cycles, day = divmod(day, self.period)
+                return cycles * self.total + self._countBefore(day)
+            self._makeTo(day)
+            if day > self.length:
+                return self.total if self.complete else None
+        count = _popcount(self.bits[:day >> 3])
+        if day & 7:
+            count += _popcount(bytes([self.bits[day >> 3] &
+                                      ((1 << (day & 7)) - 1)]))
+        return count
+
+# The bitmaps of the rules that have been asked about
+_bitmaps = weakref.WeakKeyDictionary()
+
+# ------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def _parseRule(value):
+    # parsed rules are shared by all the pages with the same rule, and so is
+    # their bitmap once made (an rrule isn't changed once it is made)
+    return Recurrence(value).rule
+
+def _parseRecurrence(value):
+    # each gets a Recurrence of its own
+    return Recurrence(_parseRule(value))
+
 # ------------------------------------------------------------------------------
 class RecurrenceField(Field):
     description = "The rule for recurring events"
@@ -156,7 +452,7 @@ class RecurrenceField(Field):
         if isinstance(value, Recurrence):
             return value
         try:
-            return Recurrence(value)
+            return _parseRecurrence(value)
         except (TypeError, ValueError, UnboundLocalError) as err:
             #raise ValidationError("Invalid input for recurrence {}".format(err))
             return None
@@ -395,6 +691,7 @@ class ExceptionDateInput(AdminDateInput):
     def __init__(self, attrs=None, format='%Y-%m-%d'):
         super().__init__(attrs=attrs, format=format)
         self.overrides_repeat = None
+        self.exception_page = None
 
     def render_js_init(self, id_, name, value):
         return "initExceptionDateChooser({0}, {1});"\
@@ -405,10 +702,24 @@ class ExceptionDateInput(AdminDateInput):
         if self.overrides_repeat:
             now = dt.datetime.now()
             future = (now + dt.timedelta(days=157)).replace(day=1)
+            taken = self.taken_dates(now.date(), future.date())
             valid_dates = ["{:%Y%m%d}".format(occurence) for occurence in
-                           self.overrides_repeat.between(now, future)]
+                           self.overrides_repeat.between(now, future)
+                           if occurence.date() not in taken]
         return valid_dates
 
+    def taken_dates(self, date_from, date_to):
+        # the dates which already have some other exception
+        page = self.exception_page
+        if page is None or page.overrides_id is None:
+            return set()
+        exceptions = type(page).exceptions                                    \
+                               .getExceptionMap(date_from, date_to,
+                                                [page.overrides_id])          \
+                               .get(page.overrides_id, {})
+        return {date for date, exception in exceptions.items()
+                if exception.pk != page.pk}
+
 # TODO Should probably also do validation on the returned date?
 # that would require ExceptionDateField and ExceptionDateFormField :(
 # or else wait for custom form for page validation?
@@ -420,6 +731,7 @@ class BaseExceptionDatePanel(BaseFieldPanel):
         super().__init__(instance=instance, form=form)
         widget = self.bound_field.field.widget
         widget.overrides_repeat = self.instance.overrides_repeat
+        widget.exception_page = self.instance
 
     @classmethod
     def html_declarations(cls):
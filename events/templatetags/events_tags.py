@@ -1,10 +1,15 @@
+import calendar
+from collections import namedtuple
 from datetime import date, timedelta, time
 from django import template
 from django.conf import settings
+from django.template.defaultfilters import time as time_filter
 
 
 from events.models import SimpleEventPage
-from events.models import getAllEventsByDay
+from events.models import getAllEventsByDay, getRangeTags, EventsTag
+from website.pagecache import addCacheTags, expireCacheAtMidnight
+from website.utils import get_page_url_map
 
 register = template.Library()
 
@@ -24,6 +29,8 @@ def event_listing_homepage(context, count=2):
 @register.inclusion_tag('events/tags/events_this_week.html',
                         takes_context=True)
 def events_this_week(context):
+    request = context['request']
+    expireCacheAtMidnight(request)
     today = date.today()
     begin_ord = today.toordinal()
     if today.weekday() != 6:
@@ -32,9 +39,68 @@ def events_this_week(context):
     end_ord = begin_ord + 6
     date_from = date.fromordinal(begin_ord)
     date_to   = date.fromordinal(end_ord)
+    addCacheTags(request, EventsTag, *getRangeTags(date_from, date_to))
     events = getAllEventsByDay(date_from, date_to)
     #import pdb; pdb.set_trace()
-    return {'events': events, 'today':  today }
+    return {'events': events,
+            'today':  today,
+            # required by the pageurl tag that we want to use within this template
+            'request': request}
+
+# A day of the calendar grid, and an event on it, with everything the
+# template shows already worked out
+GridDay   = namedtuple("GridDay", "day classes url holiday events continuing")
+GridEvent = namedtuple("GridEvent", "url time title")
+
+# The month (or week) grid of the calendar page, in one pass over the weeks
+# in the one template.  The urls are all looked up in the one page url map,
+# and each distinct time is only formatted once.
+@register.inclusion_tag('events/includes/calendar_grid.html',
+                        takes_context=True)
+def calendar_grid(context, weeks):
+    request     = context['request']
+    urlMap      = get_page_url_map(request.site)
+    calendarUrl = context.get('calendarUrl', "")
+    marks = {context.get('today'):     " today",
+             context.get('yesterday'): " yesterday",
+             context.get('lastweek'):  " lastweek"}
+    weekdays = [calendar.day_abbr[num].lower() for num in range(7)]
+    times = {}
+
+    def eventUrl(page):
+        url = urlMap.get(page.path)
+        if url is None:
+            url = page.relative_url(request.site)
+        return url
+
+    def eventTime(value):
+        if value not in times:
+            times[value] = time_filter(value, "P")
+        return times[value]
+
+    grid = []
+    for week in weeks:
+        row = []
+        for evod in week:
+            if evod is None:
+                row.append(None)
+                continue
+            day = evod.date
+            row.append(GridDay(day.day,
+                               weekdays[day.weekday()] + " day" +
+                               marks.get(day, ""),
+                               "{}{}/{}/{}/".format(calendarUrl, day.year,
+                                                    day.month, day.day),
+                               evod.holiday,
+                               [GridEvent(eventUrl(event),
+                                          eventTime(event.time_from)
+                                          if event.time_from else "",
+                                          event.title)
+                                for event in evod.days_events],
+                               [GridEvent(eventUrl(event), "", event.title)
+                                for event in evod.continuing_events]))
+        grid.append(row)
+    return {'grid': grid}
 
 # Format times e.g. on event page
 @register.filter
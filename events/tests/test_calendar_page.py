@@ -0,0 +1,231 @@
+import re
+import datetime as dt
+from django.test import RequestFactory, override_settings
+from django.template import Template, Context
+from wagtail.wagtailcore.models import Page, Site
+from events.models import EventIndexPage, CalendarPage, SimpleEventPage, \
+        MultidayEventPage, RecurringEventPage, RecurringEventExceptionPage
+from events.models import getEventsChanges, getCachedEventsByDay, \
+        getWeekStart, getWeekNum, getAllEventsByWeek
+from events.recurrence import Recurrence
+from dateutil.rrule import WEEKLY
+from website.tests.utils import SiteTestCase
+
+class TestCalendarConditionalGet(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.calendar = self.events.add_child(instance=CalendarPage(
+                                              title="Calendar", slug="calendar"))
+        self.today = dt.date.today()
+        self.url = "/events/calendar/{}/{}/".format(self.today.year,
+                                                    self.today.month)
+
+    def get(self, **headers):
+        return self.client.get(self.url, **headers)
+
+    def addEvent(self, slug, date):
+        event = self.events.add_child(instance=SimpleEventPage(title=slug,
+                                                               slug=slug,
+                                                               date=date,
+                                                               live=False))
+        event.save_revision().publish()
+        return event
+
+    def test_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(response['Cache-Control'],
+                         "public, max-age=0, must-revalidate")
+
+    @override_settings(PAGE_CACHE_ENABLED=False)
+    def test_not_modified(self):
+        response = self.get()
+        response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(response.has_header('ETag'))
+
+    @override_settings(PAGE_CACHE_ENABLED=False)
+    def test_if_modified_since(self):
+        response = self.get()
+        lastModified = response['Last-Modified']
+        response = self.get(HTTP_IF_MODIFIED_SINCE=lastModified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_from_page_cache(self):
+        response = self.get()
+        response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Page-Cache'], "hit")
+
+    @override_settings(PAGE_CACHE_ENABLED=False)
+    def test_changed_by_event(self):
+        etag = self.get()['ETag']
+        event = self.addEvent("meeting", self.today)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "meeting")
+        etag = response['ETag']
+        SimpleEventPage.objects.get(id=event.id).unpublish()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_modified_by_moves(self):
+        firstDay = self.today.replace(day=1)
+        lastDay  = firstDay + dt.timedelta(days=27)
+        def lastModified():
+            return self.calendar._getValidators(firstDay, lastDay, self.today,
+                                                True)[1]
+        event = self.addEvent("meeting", firstDay)
+        before = lastModified()
+        # moved to another month
+        event = SimpleEventPage.objects.get(id=event.id)
+        event.date = lastDay + dt.timedelta(days=100)
+        event.save_revision().publish()
+        self.assertGreater(lastModified(), before)
+        before = lastModified()
+        # moved to another place in the tree
+        other = self.home.add_child(instance=EventIndexPage(title="Other",
+                                                            slug="other"))
+        event.move(other, pos='last-child')
+        self.assertGreater(lastModified(), before)
+
+    def test_last_modified_by_hidden_occurrence(self):
+        firstDay = self.today.replace(day=1)
+        lastDay  = firstDay + dt.timedelta(days=27)
+        def lastModified():
+            return self.calendar._getValidators(firstDay, lastDay, self.today,
+                                                True)[1]
+        weekly = self.events.add_child(instance=RecurringEventPage(
+                                        title="Weekly", slug="weekly",
+                                        repeat=Recurrence(
+                                            dtstart=dt.datetime.combine(
+                                                firstDay, dt.time.min),
+                                            freq=WEEKLY)))
+        before = lastModified()
+        hidden = weekly.add_child(instance=RecurringEventExceptionPage(
+                                        title="No meeting", slug="no-meeting",
+                                        overrides=weekly, date=firstDay,
+                                        hide=True, live=False))
+        hidden.save_revision().publish()
+        self.assertGreater(lastModified(), before)
+
+    def test_not_changed_by_plain_save(self):
+        firstDay = self.today.replace(day=1)
+        lastDay  = firstDay + dt.timedelta(days=27)
+        self.addEvent("meeting", firstDay)
+        changes = getEventsChanges(firstDay, lastDay)
+        Page.objects.get(id=self.home.id).save()
+        self.assertEqual(getEventsChanges(firstDay, lastDay), changes)
+
+    def test_not_changed_by_other_months(self):
+        firstDay = self.today.replace(day=1)
+        lastDay  = firstDay + dt.timedelta(days=27)
+        changes = getEventsChanges(firstDay, lastDay)
+        self.addEvent("later", lastDay + dt.timedelta(days=100))
+        self.assertEqual(getEventsChanges(firstDay, lastDay), changes)
+        self.addEvent("sooner", firstDay)
+        self.assertNotEqual(getEventsChanges(firstDay, lastDay), changes)
+
+class TestCalendarViews(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.events.add_child(instance=CalendarPage(title="Calendar",
+                                                    slug="calendar"))
+        self.events.add_child(instance=SimpleEventPage(title="Picnic",
+                                                       slug="picnic",
+                                                       date=dt.date(2016, 1, 6)))
+        self.events.add_child(instance=SimpleEventPage(title="Concert",
+                                                       slug="concert",
+                                                       date=dt.date(2016, 1, 20)))
+
+    def test_week_numbers(self):
+        self.assertEqual(getWeekStart(2016, 1), dt.date(2015, 12, 27))
+        self.assertEqual(getWeekNum(dt.date(2016, 1, 6)), (2016, 2))
+        self.assertEqual(getWeekNum(dt.date(2015, 12, 31)), (2016, 1))
+        self.assertEqual(getWeekNum(dt.date(2015, 12, 26)), (2015, 52))
+
+    def test_day(self):
+        response = self.client.get("/events/calendar/2016/1/6/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Picnic")
+        self.assertNotContains(response, "Concert")
+        self.assertContains(response, 'href="/events/calendar/2016/1/7/"')
+        self.assertContains(response, 'href="/events/calendar/2016/week/2/"')
+
+    def test_bad_day(self):
+        response = self.client.get("/events/calendar/2016/2/30/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_week(self):
+        response = self.client.get("/events/calendar/2016/week/2/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Picnic")
+        self.assertNotContains(response, "Concert")
+        self.assertContains(response, 'href="/events/calendar/2016/week/3/"')
+        self.assertContains(response, 'href="/events/calendar/2016/week/1/"')
+
+    def test_month(self):
+        response = self.client.get("/events/calendar/2016/1/")
+        self.assertContains(response, "Picnic")
+        self.assertContains(response, "Concert")
+        self.assertContains(response, 'href="/events/calendar/2016/1/20/"')
+
+    def test_cached_separately(self):
+        self.client.get("/events/calendar/2016/1/")
+        with self.assertNumQueries(0):
+            getCachedEventsByDay(dt.date(2016, 1, 1), dt.date(2016, 1, 31))
+        weekStart = getWeekStart(2016, 2)
+        weekEnd = weekStart + dt.timedelta(days=6)
+        events = getCachedEventsByDay(weekStart, weekEnd)
+        self.assertEqual([evod.date for evod in events][0], weekStart)
+        with self.assertNumQueries(0):
+            getCachedEventsByDay(weekStart, weekEnd)
+
+class TestCalendarGrid(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.calendar = self.events.add_child(instance=CalendarPage(
+                                                           title="Calendar",
+                                                           slug="calendar"))
+        self.events.add_child(instance=SimpleEventPage(title="Tea & Talk",
+                                                       slug="tea",
+                                                       date=dt.date(2016, 2, 6),
+                                                       time_from=dt.time(19)))
+        self.events.add_child(instance=MultidayEventPage(
+                                        title="Camp", slug="camp",
+                                        date_from=dt.date(2016, 1, 30),
+                                        date_to=dt.date(2016, 2, 2)))
+
+    def test_grid(self):
+        request = RequestFactory().get("/")
+        request.site = Site.objects.get(is_default_site=True)
+        context = {'request':     request,
+                   'calendarUrl': "/events/calendar/",
+                   'today':       dt.date(2016, 2, 2),
+                   'yesterday':   dt.date(2016, 2, 1),
+                   'lastweek':    dt.date(2016, 1, 26),
+                   'events':      getAllEventsByWeek(2016, 2)}
+        template = Template("{% load events_tags %}{% calendar_grid events %}")
+        html = re.sub(r"\s*([<>])\s*", r"\1", template.render(Context(context)))
+        self.assertEqual(html.count("<tr>"), 5)
+        self.assertEqual(html.count('<td class="noday">'), 6)
+        self.assertIn('<a href="/events/tea/" class="event"><span '
+                      'class="event-time">7 p.m.</span><span '
+                      'class="event-title">Tea &amp; Talk</span></a>', html)
+        self.assertIn('<a href="/events/camp/" class="event event-continues">'
+                      'Camp</a>', html)
+        self.assertIn('<td class="tue day today">', html)
+        self.assertIn('<td class="mon day yesterday">', html)
+        self.assertIn('<h4><a href="/events/calendar/2016/2/6/">6</a></h4>',
+                      html)
+        self.assertIn('<div class="day-title holiday"><h4><a '
+                      'href="/events/calendar/2016/2/8/">8</a></h4><div '
+                      'class="holiday-name">Waitangi Day', html)
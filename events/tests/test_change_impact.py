@@ -0,0 +1,112 @@
+import datetime as dt
+from django.test import TestCase
+from django.db.models.signals import pre_delete
+from wagtail.wagtailcore.models import Page, unpublish_page_before_delete
+from dateutil.rrule import WEEKLY
+from events.models import EventIndexPage, SimpleEventPage, MultidayEventPage, \
+        RecurringEventPage, EventsTag
+from events.models import getCachedEventsByDay, getChangeImpact, \
+        getRangeTags, dayTag, monthTag
+from events.recurrence import Recurrence
+from website.pagecache import tagVersion
+from website.tests.utils import SiteTestCase
+
+class TestEventDays(TestCase):
+    def test_multiday(self):
+        event = MultidayEventPage(date_from=dt.date(2016, 1, 30),
+                                  date_to=dt.date(2016, 2, 2))
+        self.assertEqual(event.getEventDays(),
+                         {dt.date(2016, 1, 30), dt.date(2016, 1, 31),
+                          dt.date(2016, 2, 1), dt.date(2016, 2, 2)})
+
+    def test_recurring(self):
+        event = RecurringEventPage(repeat=Recurrence(
+                                            dtstart=dt.datetime(2016, 1, 1),
+                                            freq=WEEKLY, count=3))
+        self.assertEqual(event.getEventDays(),
+                         {dt.date(2016, 1, 1), dt.date(2016, 1, 8),
+                          dt.date(2016, 1, 15)})
+        event.repeat = Recurrence(dtstart=dt.datetime(2016, 1, 1), freq=WEEKLY)
+        self.assertIsNone(event.getEventDays())
+
+    def test_impact(self):
+        was = frozenset([dt.date(2016, 1, 1)])
+        now = frozenset([dt.date(2016, 3, 1)])
+        self.assertEqual(getChangeImpact(was, now), was | now)
+        self.assertIsNone(getChangeImpact(was, None))
+
+    def test_range_tags(self):
+        self.assertEqual(len(getRangeTags(dt.date(2016, 1, 31),
+                                          dt.date(2016, 2, 6))), 7)
+        self.assertEqual(getRangeTags(dt.date(2015, 12, 1),
+                                      dt.date(2016, 1, 31)),
+                         [monthTag(2015, 12), monthTag(2016, 1)])
+
+class TestPartialPurge(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.event = self.events.add_child(instance=SimpleEventPage(
+                                                    title="Meeting",
+                                                    slug="meeting",
+                                                    date=dt.date(2016, 1, 10)))
+
+    def versions(self, *tags):
+        return [tagVersion(tag) for tag in tags]
+
+    def test_moved(self):
+        tags = [dayTag(dt.date(2016, 1, 10)), monthTag(2016, 1),
+                monthTag(2016, 3)]
+        before = self.versions(*tags)
+        untouched = self.versions(EventsTag, monthTag(2016, 2))
+        event = SimpleEventPage.objects.get(id=self.event.id)
+        event.date = dt.date(2016, 3, 5)
+        event.save_revision().publish()
+        after = self.versions(*tags)
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+        self.assertEqual(self.versions(EventsTag, monthTag(2016, 2)), untouched)
+
+    def test_draft(self):
+        before = self.versions(monthTag(2016, 1))
+        event = SimpleEventPage.objects.get(id=self.event.id)
+        event.date = dt.date(2016, 3, 5)
+        event.save_revision()
+        self.assertEqual(self.versions(monthTag(2016, 1)), before)
+
+    def test_other_months_kept(self):
+        getCachedEventsByDay(dt.date(2016, 2, 1), dt.date(2016, 2, 29))
+        getCachedEventsByDay(dt.date(2016, 1, 1), dt.date(2016, 1, 31))
+        SimpleEventPage.objects.get(id=self.event.id).unpublish()
+        with self.assertNumQueries(0):
+            getCachedEventsByDay(dt.date(2016, 2, 1), dt.date(2016, 2, 29))
+        january = getCachedEventsByDay(dt.date(2016, 1, 1),
+                                       dt.date(2016, 1, 31))
+        self.assertEqual(january[9].days_events, [])
+
+    def test_deleted(self):
+        # purged by the deletion itself, not just by the unpublish before it
+        pre_delete.disconnect(unpublish_page_before_delete, sender=Page)
+        self.addCleanup(pre_delete.connect, unpublish_page_before_delete,
+                        sender=Page)
+        getCachedEventsByDay(dt.date(2016, 1, 1), dt.date(2016, 1, 31))
+        SimpleEventPage.objects.get(id=self.event.id).delete()
+        january = getCachedEventsByDay(dt.date(2016, 1, 1),
+                                       dt.date(2016, 1, 31))
+        self.assertEqual(january[9].days_events, [])
+
+    def test_deleted_with_parent(self):
+        before = self.versions(dayTag(dt.date(2016, 1, 10)))
+        self.events.delete()
+        self.assertNotEqual(self.versions(dayTag(dt.date(2016, 1, 10))),
+                            before)
+
+    def test_forever_purges_all(self):
+        before = self.versions(EventsTag)
+        weekly = self.events.add_child(instance=RecurringEventPage(
+                                        title="Weekly", slug="weekly",
+                                        repeat=Recurrence(
+                                            dtstart=dt.datetime(2016, 1, 1),
+                                            freq=WEEKLY)))
+        weekly.save_revision().publish()
+        self.assertNotEqual(self.versions(EventsTag), before)
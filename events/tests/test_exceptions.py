@@ -0,0 +1,78 @@
+import datetime as dt
+from django.core.exceptions import ValidationError
+from dateutil.rrule import WEEKLY
+from events.models import EventIndexPage, RecurringEventPage, \
+        RecurringEventExceptionPage, getAllEventsByDay
+from events.recurrence import Recurrence, ExceptionDateInput
+from website.tests.utils import SiteTestCase
+
+class TestExceptionLookup(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.weekly = self.addWeekly("weekly")
+        self.other  = self.addWeekly("other")
+        self.special = self.addException(self.weekly, "special",
+                                         dt.date(2016, 1, 4))
+        self.hidden = self.addException(self.other, "hidden",
+                                        dt.date(2016, 1, 7), hide=True)
+        self.addException(self.other, "later", dt.date(2016, 3, 3))
+
+    def addWeekly(self, slug):
+        return self.events.add_child(instance=RecurringEventPage(
+                                        title=slug, slug=slug,
+                                        repeat=Recurrence(
+                                            dtstart=dt.datetime(2016, 1, 1),
+                                            freq=WEEKLY,
+                                            byweekday=[0, 3])))
+
+    def addException(self, page, slug, date, **kwargs):
+        return page.add_child(instance=RecurringEventExceptionPage(
+                                        title=slug, slug=slug,
+                                        overrides=page, date=date, **kwargs))
+
+    def test_map(self):
+        with self.assertNumQueries(1):
+            exceptionMap = RecurringEventExceptionPage.exceptions             \
+                                .getExceptionMap(dt.date(2016, 1, 1),
+                                                 dt.date(2016, 1, 31))
+        self.assertEqual(exceptionMap,
+                         {self.weekly.id: {dt.date(2016, 1, 4): self.special},
+                          self.other.id:  {dt.date(2016, 1, 7): self.hidden}})
+
+    def test_map_of_pages(self):
+        exceptionMap = RecurringEventExceptionPage.exceptions                 \
+                            .getExceptionMap(dt.date(2016, 1, 1),
+                                             dt.date(2016, 12, 31),
+                                             [self.other])
+        self.assertEqual(list(exceptionMap), [self.other.id])
+        self.assertEqual(len(exceptionMap[self.other.id]), 2)
+
+    def test_events_by_day(self):
+        events = getAllEventsByDay(dt.date(2016, 1, 4), dt.date(2016, 1, 7))
+        self.assertEqual([page.title for page in events[0].days_events],
+                         ["special", "other"])
+        self.assertEqual([page.title for page in events[3].days_events],
+                         ["weekly"])
+
+    def test_unique_date(self):
+        duplicate = RecurringEventExceptionPage(title="again", slug="again",
+                                                overrides=self.weekly,
+                                                date=dt.date(2016, 1, 4))
+        with self.assertRaises(ValidationError):
+            duplicate.clean()
+        duplicate.date = dt.date(2016, 1, 7)
+        duplicate.clean()
+        self.special.clean()
+
+    def test_chooser_skips_taken_dates(self):
+        widget = ExceptionDateInput()
+        widget.exception_page = RecurringEventExceptionPage(
+                                                    overrides=self.weekly)
+        self.assertEqual(widget.taken_dates(dt.date(2016, 1, 1),
+                                            dt.date(2016, 1, 31)),
+                         {dt.date(2016, 1, 4)})
+        widget.exception_page = self.special
+        self.assertEqual(widget.taken_dates(dt.date(2016, 1, 1),
+                                            dt.date(2016, 1, 31)), set())
@@ -0,0 +1,54 @@
+from datetime import datetime, date
+from unittest import mock
+from dateutil.rrule import MONTHLY, WEEKLY, DAILY
+from dateutil.rrule import MO, TH
+
+from django.test import TestCase
+from events.recurrence import Recurrence, Weekday
+from events import expansion
+from events.expansion import expandRules, mergeDays
+
+class TestExpansion(TestCase):
+    def setUp(self):
+        self.rules = [Recurrence(dtstart=datetime(2009, 1, 1), freq=WEEKLY,
+                                 byweekday=[MO, TH]),
+                      Recurrence(dtstart=datetime(2014, 3, 1), freq=MONTHLY,
+                                 byweekday=[Weekday(6, -1)]),
+                      Recurrence(dtstart=datetime(2016, 1, 1), freq=DAILY,
+                                 interval=3, count=10),
+                      Recurrence(dtstart=datetime(2016, 2, 1, 9), freq=DAILY,
+                                 byhour=[9, 17], until=datetime(2016, 2, 5))]
+
+    def expected(self, rule, dateFrom, dateTo):
+        occurences = rule.between(datetime.combine(dateFrom, datetime.min.time()),
+                                  datetime.combine(dateTo, datetime.max.time()),
+                                  inc=True)
+        return sorted({occurence.toordinal() for occurence in occurences})
+
+    def test_in_process(self):
+        dateFrom, dateTo = date(2016, 1, 1), date(2016, 12, 31)
+        expanded = expandRules([str(rule) for rule in self.rules],
+                               dateFrom, dateTo, workers=1)
+        self.assertEqual([list(days) for days in expanded],
+                         [self.expected(rule, dateFrom, dateTo)
+                          for rule in self.rules])
+        self.assertEqual(len(expanded[3]), 4)
+
+    def test_pool(self):
+        dateFrom, dateTo = date(2010, 6, 1), date(2017, 5, 31)
+        rules = [str(rule) for rule in self.rules] * 3
+        with mock.patch.object(expansion, 'ChunkSize', 2):
+            expanded = expandRules(rules, dateFrom, dateTo, workers=2)
+        self.assertEqual(expanded, expandRules(rules, dateFrom, dateTo,
+                                               workers=1))
+
+    def test_merge(self):
+        expanded = expandRules([str(rule) for rule in self.rules[2:]],
+                               date(2016, 1, 1), date(2016, 2, 28), workers=1)
+        merged = mergeDays(expanded, ["every3", "twice"])
+        self.assertEqual([day for day, key in merged],
+                         sorted(day for day, key in merged))
+        self.assertEqual(merged[:2], [(date(2016, 1, 1).toordinal(), "every3"),
+                                      (date(2016, 1, 4).toordinal(), "every3")])
+        self.assertEqual(merged.count((date(2016, 2, 3).toordinal(), "twice")),
+                         1)
@@ -0,0 +1,137 @@
+import os
+import stat
+import shutil
+import tempfile
+import datetime as dt
+from io import StringIO
+from unittest import mock
+from django.test import override_settings
+from django.core.management import call_command
+from dateutil.rrule import WEEKLY
+from events.models import EventIndexPage, CalendarPage, SimpleEventPage, \
+        RecurringEventPage, RecurringEventExceptionPage
+from events.recurrence import Recurrence
+from events.utils import export_event, ical_fold
+from events.icalfiles import writeIcalFiles, removeStaleFiles, getIcalPath
+from website.tests.utils import SiteTestCase
+
+class IcalTestCase(SiteTestCase):
+    def setUp(self):
+        self.mediaRoot = tempfile.mkdtemp()
+        self.mediaSettings = override_settings(MEDIA_ROOT=self.mediaRoot,
+                                               BACKGROUND_JOBS_DIR=
+                                    os.path.join(self.mediaRoot, "jobs"))
+        self.mediaSettings.enable()
+        super().setUp()
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.calendar = self.events.add_child(instance=CalendarPage(
+                                                           title="Calendar",
+                                                           slug="calendar"))
+        self.meeting = self.events.add_child(instance=SimpleEventPage(
+                                                    title="Meeting, Hall",
+                                                    slug="meeting",
+                                                    date=dt.date(2016, 2, 3),
+                                                    time_from=dt.time(19)))
+        self.weekly = self.events.add_child(instance=RecurringEventPage(
+                                        title="Weekly", slug="weekly",
+                                        time_from=dt.time(10),
+                                        repeat=Recurrence(
+                                            dtstart=dt.datetime(2016, 1, 1),
+                                            freq=WEEKLY,
+                                            byweekday=[0, 3])))
+        for slug, date, hide in [("cancelled", dt.date(2016, 1, 4), True),
+                                 ("special",   dt.date(2016, 1, 7), False)]:
+            self.weekly.add_child(instance=RecurringEventExceptionPage(
+                                        title=slug, slug=slug,
+                                        overrides=self.weekly,
+                                        date=date, hide=hide,
+                                        time_from=dt.time(11)))
+
+    def tearDown(self):
+        self.mediaSettings.disable()
+        shutil.rmtree(self.mediaRoot, ignore_errors=True)
+
+    def read(self, path):
+        with open(os.path.join(self.mediaRoot, path)) as f:
+            return f.read()
+
+class TestExport(IcalTestCase):
+    def test_simple(self):
+        ical = export_event(self.meeting)
+        self.assertIn("SUMMARY:Meeting\\, Hall\r\n", ical)
+        self.assertIn("DTSTART;TZID=Pacific/Auckland:20160203T190000\r\n", ical)
+
+    def test_recurring(self):
+        ical = export_event(self.weekly)
+        # the first Monday or Thursday, rather than dtstart
+        self.assertIn("DTSTART;TZID=Pacific/Auckland:20160104T100000\r\n", ical)
+        self.assertIn("RRULE:FREQ=WEEKLY;WKST=SU;BYDAY=MO,TH\r\n", ical)
+        self.assertIn("EXDATE;TZID=Pacific/Auckland:20160104T100000\r\n", ical)
+        self.assertIn("RECURRENCE-ID;TZID=Pacific/Auckland:20160107T100000\r\n",
+                      ical)
+        self.assertIn("DTSTART;TZID=Pacific/Auckland:20160107T110000\r\n", ical)
+        self.assertEqual(ical.count("BEGIN:VEVENT"), 2)
+
+    def test_timezone(self):
+        ical = export_event(self.weekly)
+        self.assertEqual(ical.count("BEGIN:VTIMEZONE"), 1)
+        self.assertLess(ical.index("END:VTIMEZONE"), ical.index("BEGIN:VEVENT"))
+        self.assertIn("TZID:Pacific/Auckland\r\n", ical)
+        unfolded = ical.replace("\r\n ", "")
+        # daylight saving ended at 3am on the 3rd of April 2016
+        self.assertIn(",20160403T030000,", unfolded)
+        self.assertIn("TZOFFSETFROM:+1300\r\nTZOFFSETTO:+1200\r\n"
+                      "TZNAME:NZST\r\n", ical)
+
+    def test_fold(self):
+        line = "DESCRIPTION:" + "é" * 50
+        folded = ical_fold(line)
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75
+                            for part in folded.split("\r\n")))
+        self.assertEqual(folded.replace("\r\n ", ""), line)
+
+class TestIcalFiles(IcalTestCase):
+    def test_write(self):
+        months = [(2016, 1), (2016, 2)]
+        written, unchanged = writeIcalFiles(months=months)
+        self.assertEqual(len(written), 6)
+        self.assertEqual(unchanged, [])
+        path = getIcalPath(self.calendar, 2016, 2)
+        self.assertIn("Meeting", self.read(path))
+        self.assertIn("Weekly", self.read(path))
+        self.assertNotIn("Meeting",
+                         self.read(getIcalPath(self.calendar, 2016, 1)))
+        mode = os.stat(os.path.join(self.mediaRoot, path)).st_mode
+        self.assertTrue(mode & stat.S_IROTH)
+
+        written, unchanged = writeIcalFiles(months=months)
+        self.assertEqual(written, [])
+        self.assertEqual(len(unchanged), 6)
+
+    def test_remove_stale(self):
+        written, unchanged = writeIcalFiles(months=[(2016, 1)])
+        removed = removeStaleFiles(written[:1])
+        self.assertEqual(sorted(removed), sorted(written[1:]))
+
+    @override_settings(ICAL_FILES_ON_PUBLISH=True)
+    def test_publish(self):
+        today = dt.date.today()
+        event = SimpleEventPage.objects.get(id=self.meeting.id)
+        event.title = "Meeting moved"
+        event.date = today
+        with mock.patch('website.background.subprocess.Popen') as popen:
+            event.save_revision().publish()
+        # just the month it moved to, straight away
+        path = getIcalPath(self.calendar, today.year, today.month)
+        self.assertIn("Meeting moved", self.read(path))
+        path = getIcalPath(self.events, today.year, today.month)
+        self.assertIn("Meeting moved", self.read(path))
+        self.assertFalse(os.path.exists(os.path.join(self.mediaRoot,
+                                                     getIcalPath(self.events))))
+        # and the rest in the background
+        argv = popen.call_args[0][0]
+        self.assertEqual(argv[2:], ["run_job", "write_ical_files"])
+        call_command(*argv[2:], stdout=StringIO())
+        self.assertIn("Meeting moved", self.read(getIcalPath(self.calendar)))
+        self.assertIn("Meeting moved", self.read(getIcalPath(self.events)))
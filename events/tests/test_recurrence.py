@@ -1,10 +1,11 @@
 import sys
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from dateutil.rrule import YEARLY, MONTHLY, WEEKLY, DAILY
 from dateutil.rrule import MO, TU, WE, TH, FR, SA, SU
 
 from django.test import TestCase
-from events.recurrence import Recurrence
+from events.recurrence import Recurrence, RecurrenceField, OccurrenceBitmap, \
+        AheadDays
 
 class TestRecurrence(TestCase):
     def test_str(self):
@@ -55,3 +56,170 @@ class TestRecurrence(TestCase):
                 "RRULE:FREQ=MONTHLY;WKST=SU;UNTIL=20141001;BYMONTHDAY=1,-1"   # first&last
         self.assertEqual(str(Recurrence(rrStr)), rrStr)
 
+
+class TestOccurrenceBitmap(TestCase):
+    def assertMatchesRule(self, rr, start, numDays):
+        occurences = {occurence.date() for occurence in
+                      rr.rule.between(start, start + timedelta(days=numDays),
+                                      inc=True)}
+        for num in range(numDays):
+            day = (start + timedelta(days=num)).date()
+            self.assertEqual(rr.occursOn(day), day in occurences,
+                             "{} {}".format(rr, day))
+
+    def test_weekly(self):
+        rr = Recurrence(dtstart=datetime(2009, 1, 7),
+                        freq=WEEKLY,
+                        interval=2,
+                        byweekday=[MO,WE])
+        self.assertEqual(rr.occurrences.period, 14)
+        self.assertMatchesRule(rr, datetime(2009, 1, 1), 60)
+        self.assertMatchesRule(rr, datetime(2400, 1, 1), 60)
+
+    def test_monthly(self):
+        rr = Recurrence(dtstart=datetime(2015, 10, 1),
+                        freq=MONTHLY,
+                        byweekday=[(SU(-1))])
+        self.assertEqual(rr.occurrences.period, 146097)
+        self.assertMatchesRule(rr, datetime(2015, 9, 1), 400)
+        # a couple of Gregorian cycles later
+        self.assertMatchesRule(rr, datetime(2839, 1, 1), 400)
+
+    def test_daily(self):
+        rr = Recurrence(dtstart=datetime(2012, 2, 27),
+                        freq=DAILY,
+                        interval=3,
+                        bymonth=[2,3])
+        self.assertMatchesRule(rr, datetime(2012, 1, 1), 400)
+        self.assertMatchesRule(rr, datetime(2412, 1, 1), 400)
+
+    def test_yearly(self):
+        rr = Recurrence(dtstart=datetime(2012, 2, 29),
+                        freq=YEARLY,
+                        bymonth=[2],
+                        bymonthday=[29])
+        self.assertTrue(rr.occursOn(date(2016, 2, 29)))
+        self.assertFalse(rr.occursOn(date(2100, 2, 28)))
+        self.assertFalse(rr.occursOn(date(2100, 3, 1)))
+        self.assertTrue(rr.occursOn(date(2400, 2, 29)))
+
+    def test_ends(self):
+        rr = Recurrence(dtstart=datetime(2009, 1, 1),
+                        freq=WEEKLY,
+                        count=9,
+                        byweekday=[MO,TU,WE,TH,FR])
+        self.assertIsNone(rr.occurrences.period)
+        self.assertMatchesRule(rr, datetime(2008, 12, 25), 30)
+        self.assertFalse(rr.occursOn(date(2020, 1, 1)))
+        rr = Recurrence(dtstart=datetime(2011, 1, 1),
+                        freq=DAILY,
+                        interval=2,
+                        until=datetime(2011,1,11))
+        self.assertMatchesRule(rr, datetime(2010, 12, 25), 30)
+
+    def test_contains(self):
+        rr = Recurrence(dtstart=datetime(2009, 1, 5),
+                        freq=WEEKLY,
+                        byweekday=[MO])
+        self.assertIn(date(2016, 1, 4), rr)
+        self.assertIn(datetime(2016, 1, 4), rr)
+        self.assertNotIn(datetime(2016, 1, 4, 10), rr)
+        self.assertNotIn(date(2016, 1, 5), rr)
+        self.assertNotIn(date(2008, 12, 29), rr)
+
+    def test_shared(self):
+        field = RecurrenceField()
+        rrStr = "DTSTART:20151001\n" \
+                "RRULE:FREQ=MONTHLY;WKST=SU;BYDAY=-1SU"
+        rr1, rr2 = field.to_python(rrStr), field.to_python(rrStr)
+        # not the same Recurrence, but the same rule and bitmap
+        self.assertIsNot(rr1, rr2)
+        self.assertIs(rr1.rule, rr2.rule)
+        self.assertIs(rr1.occurrences, rr2.occurrences)
+
+    def test_made_as_needed(self):
+        rr = Recurrence(dtstart=datetime(2015, 10, 1),
+                        freq=MONTHLY,
+                        byweekday=[(SU(-1))])
+        today = date(2016, 1, 1)
+        bitmap = OccurrenceBitmap(rr.rule, today)
+        self.assertEqual(bitmap.length, (today - date(2015, 10, 1)).days +
+                                        AheadDays)
+        self.assertTrue(bitmap.occursOn(date(2016, 1, 31).toordinal()))
+        self.assertEqual(bitmap.countDays(date(2016, 1, 1).toordinal(),
+                                          date(2016, 12, 31).toordinal()), 12)
+        self.assertFalse(bitmap.occursOn(date(2030, 3, 30).toordinal()))
+        self.assertTrue(bitmap.occursOn(date(2030, 3, 31).toordinal()))
+        self.assertLess(bitmap.length, bitmap.period)
+        self.assertEqual(bitmap.countDays(date(2016, 1, 1).toordinal(),
+                                          date(3015, 12, 31).toordinal()),
+                         1000 * 12)
+        self.assertEqual(bitmap.length, bitmap.period)
+
+class TestCounting(TestCase):
+    def test_unbounded(self):
+        rr = Recurrence(dtstart=datetime(2009, 1, 5),
+                        freq=WEEKLY,
+                        byweekday=[MO,FR])
+        self.assertIsNone(rr.getCount())
+
+    def test_until(self):
+        rr = Recurrence(dtstart=datetime(2011, 1, 1),
+                        freq=DAILY,
+                        interval=2,
+                        until=datetime(2011,1,11))
+        self.assertEqual(rr.getCount(), 6)
+        rr = Recurrence(dtstart=datetime(1900, 1, 1),
+                        freq=MONTHLY,
+                        byweekday=[SU(-1)],
+                        until=datetime(2999, 12, 31))
+        self.assertEqual(rr.getCount(), 1100 * 12)
+        self.assertEqual(rr.getCount(), rr.rule.count())
+
+    def test_count(self):
+        rr = Recurrence(dtstart=datetime(2009, 1, 1),
+                        freq=WEEKLY,
+                        count=9,
+                        byweekday=[MO,TU,WE,TH,FR])
+        self.assertEqual(rr.getCount(), 9)
+        rr = Recurrence(dtstart=datetime(2009, 1, 1),
+                        freq=DAILY,
+                        count=200000)
+        self.assertIsNone(rr.getCount(limit=1000))
+        self.assertEqual(rr.getCount(limit=None), 200000)
+
+    def test_between(self):
+        rules = [Recurrence(dtstart=datetime(2009, 1, 7),
+                            freq=WEEKLY,
+                            interval=2,
+                            byweekday=[MO,WE]),
+                 Recurrence(dtstart=datetime(2015, 10, 1),
+                            freq=MONTHLY,
+                            byweekday=[SU(-1)],
+                            until=datetime(2030, 6, 30)),
+                 Recurrence(dtstart=datetime(2012, 2, 27),
+                            freq=DAILY,
+                            interval=3,
+                            bymonth=[2,3]),
+                 Recurrence(dtstart=datetime(2016, 1, 1),
+                            freq=DAILY,
+                            byhour=[9,17])]
+        windows = [(datetime(2008, 1, 1), datetime(2009, 3, 1)),
+                   (datetime(2016, 2, 3), datetime(2016, 2, 29)),
+                   (datetime(2020, 1, 1), datetime(2031, 1, 1)),
+                   (datetime(2016, 3, 7, 9), datetime(2016, 3, 16, 9))]
+        for rr in rules:
+            for after, before in windows:
+                for inc in (False, True):
+                    self.assertEqual(rr.countBetween(after, before, inc),
+                                     len(rr.rule.between(after, before, inc)),
+                                     "{} {} {} {}".format(rr, after, before, inc))
+        rr = rules[0]
+        self.assertEqual(rr.countBetween(datetime(2009, 1, 19),
+                                         datetime(2009, 1, 21), inc=True), 2)
+        self.assertEqual(rr.countBetween(datetime(2009, 1, 19),
+                                         datetime(2009, 1, 21)), 0)
+        self.assertEqual(rr.countBetween(datetime(2009, 1, 1),
+                                         datetime(4009, 1, 1)),
+                         2 * (datetime(4009, 1, 1) - datetime(2009, 1, 7)).days
+                         // 14 + 1)
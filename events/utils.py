@@ -1,78 +1,267 @@
 from datetime import datetime, time, timedelta
-import hashlib
+import re
+from django.conf import settings
+from django.utils import timezone
+from django.utils.html import strip_tags
+from wagtail.wagtailcore.models import Site
+from website.utils import page_url
+from events.models import RecurringEventExceptionPage
 
 
-def export_event(event, format='ical'):
-    # Only ical format supported at the moment
-    if format != 'ical':
-        return
+NoStamp = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def ical_escape(string):
+    # TEXT values, see RFC 5545 3.3.11
+    string = string.replace('\\', '\\\\')
+    string = string.replace(';', '\\;')
+    string = string.replace(',', '\\,')
+    string = string.replace('\r\n', '\\n').replace('\n', '\\n')
+    return string
+
+
+def ical_fold(line):
+    # Lines longer than 75 octets are folded, see RFC 5545 3.1
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        # don't split a utf-8 sequence
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode('utf-8'))
+    return '\r\n '.join(parts)
+
+
+def _tzid():
+    return settings.TIME_ZONE
+
+
+# The VTIMEZONE for each TZID, as working it out takes a while
+_vtimezones = {}
+
+
+def _offset(delta):
+    # a UTC offset as +HHMM, see RFC 5545 3.3.14
+    seconds = int(delta.total_seconds())
+    sign = '-' if seconds < 0 else '+'
+    hours, rest = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    offset = '{}{:02d}{:02d}'.format(sign, hours, minutes)
+    if seconds:
+        offset += '{:02d}'.format(seconds)
+    return offset
+
+
+def _observance(tz, when):
+    local = when.astimezone(tz)
+    return local.utcoffset(), local.tzname(), bool(local.dst())
+
+
+def _transitions(tz, start, stop):
+    # (utc time, observance before, observance after) of each change from
+    # start to stop, found a week at a time and then narrowed to the second
+    changes = []
+    week = timedelta(days=7)
+    when, was = start, _observance(tz, start)
+    while when < stop:
+        now = _observance(tz, when + week)
+        if now != was:
+            low, high = when, when + week
+            while high - low > timedelta(seconds=1):
+                middle = low + timedelta(seconds=(high - low).total_seconds()
+                                                 // 2)
+                if _observance(tz, middle) == was:
+                    low = middle
+                else:
+                    high = middle
+            changes.append((high, was, now))
+        when, was = when + week, now
+    return changes
+
+
+def _vtimezone():
+    # The VTIMEZONE that the TZID of DTSTART, DTEND, RECURRENCE-ID and
+    # EXDATE refer to, see RFC 5545 3.6.5.  Each observance is given by the
+    # onsets (in local time from before them) it had from 1970 to 2037.
+    tzid = _tzid()
+    if tzid not in _vtimezones:
+        tz = timezone.get_default_timezone()
+        start = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        stop = datetime(2038, 1, 1, tzinfo=timezone.utc)
+        first = _observance(tz, start)
+        onsets = {(first, first): [start.replace(tzinfo=None) + first[0]]}
+        for when, was, now in _transitions(tz, start, stop):
+            onsets.setdefault((was, now), []).append(when.replace(tzinfo=None)
+                                                     + was[0])
+        lines = ['BEGIN:VTIMEZONE', 'TZID:' + tzid]
+        for (was, now), times in sorted(onsets.items(),
+                                        key=lambda item: item[1][0]):
+            kind = 'DAYLIGHT' if now[2] else 'STANDARD'
+            lines += ['BEGIN:' + kind,
+                      'DTSTART:{:%Y%m%dT%H%M%S}'.format(times[0])]
+            if len(times) > 1:
+                lines.append('RDATE:' +
+                             ','.join('{:%Y%m%dT%H%M%S}'.format(onset)
+                                      for onset in times[1:]))
+            lines += ['TZOFFSETFROM:' + _offset(was[0]),
+                      'TZOFFSETTO:' + _offset(now[0]),
+                      'TZNAME:' + now[1],
+                      'END:' + kind]
+        lines.append('END:VTIMEZONE')
+        _vtimezones[tzid] = [ical_fold(line) for line in lines]
+    return _vtimezones[tzid]
+
+
+def _utc(when):
+    # a naive local datetime in UTC
+    local = timezone.make_aware(when, timezone.get_current_timezone())
+    return local.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
 
-    # Begin event
-    # VEVENT format: http://www.kanzaki.com/docs/ical/vevent.html
+def _start_end(date_from, date_to, time_from, time_to):
+    # DTSTART and DTEND for an event from date_from to date_to
+    if time_from is None:
+        return ['DTSTART;VALUE=DATE:' + date_from.strftime('%Y%m%d'),
+                'DTEND;VALUE=DATE:' +
+                (date_to + timedelta(days=1)).strftime('%Y%m%d')]
+    start = datetime.combine(date_from, time_from)
+    if time_to is not None:
+        end = datetime.combine(date_to, time_to)
+    elif date_to != date_from:
+        end = datetime.combine(date_to, time.max.replace(microsecond=0))
+    else:
+        end = start
+    return ['DTSTART;TZID={}:{:%Y%m%dT%H%M%S}'.format(_tzid(), start),
+            'DTEND;TZID={}:{:%Y%m%dT%H%M%S}'.format(_tzid(), end)]
+
+
+def _occurrence_id(event, date):
+    # how a RECURRENCE-ID or EXDATE names the occurrence of event on date
+    if event.time_from is None:
+        return ';VALUE=DATE:' + date.strftime('%Y%m%d')
+    return ';TZID={}:{:%Y%m%dT%H%M%S}'.format(_tzid(),
+                                              datetime.combine(date,
+                                                               event.time_from))
+
+
+def _recurrence_rule(event):
+    rule = str(event.repeat).splitlines()[-1]
+    if event.repeat.until and event.time_from is not None:
+        # UNTIL must be a UTC time when DTSTART has a time
+        until = datetime.combine(event.repeat.until.date(),
+                                 time.max.replace(microsecond=0))
+        rule = re.sub(r'UNTIL=\d+', 'UNTIL=' + _utc(until), rule)
+    return rule
+
+
+def absolute_url(site, url):
+    # page_url is relative, unless the page is on another site
+    if url is None:
+        return ""
+    if url.startswith('/'):
+        return site.root_url + url
+    return url
+
+
+def _details(event, uid, site):
+    url = page_url(event, site)
+    # DTSTAMP is required, and has to stay the same until the event changes
+    stamp = (event.latest_revision_created_at or event.first_published_at or
+             NoStamp)
+    components = ['UID:' + uid]
+    if url is not None:
+        components.append('URL:' + absolute_url(site, url))
+    components += ['SUMMARY:' + ical_escape(event.title),
+                   'DESCRIPTION:' + ical_escape(strip_tags(event.details)
+                                                .strip()),
+                   'LOCATION:' + ical_escape(event.location),
+                   'DTSTAMP:' + stamp.astimezone(timezone.utc)
+                                     .strftime('%Y%m%dT%H%M%SZ')]
+    return components
+
+
+def event_components(event, site, exceptions=()):
+    """
+    The (folded) VEVENT lines for event.  A recurring event is one VEVENT
+    with an RRULE, and its exceptions either EXDATEs (if hidden) or VEVENTs
+    of their own with a RECURRENCE-ID.
+    """
+    uid = 'event-{}@{}'.format(event.id, site.hostname)
+    components = ['BEGIN:VEVENT'] + _details(event, uid, site)
+    if hasattr(event, 'repeat'):
+        # DTSTART has to be the first occurrence, not just where the rule
+        # starts counting from
+        first = event.repeat.after(event.repeat.dtstart, inc=True)
+        first = (first or event.repeat.dtstart).date()
+        components += _start_end(first, first, event.time_from, event.time_to)
+        components.append(_recurrence_rule(event))
+        for exception in exceptions:
+            if exception.hide:
+                components.append('EXDATE' +
+                                  _occurrence_id(event, exception.date))
+    elif hasattr(event, 'date_from'):
+        components += _start_end(event.date_from, event.date_to,
+                                 event.time_from, event.time_to)
+    else:
+        components += _start_end(event.date, event.date,
+                                 event.time_from, event.time_to)
+    components.append('END:VEVENT')
+
+    for exception in exceptions:
+        if not exception.hide:
+            components.append('BEGIN:VEVENT')
+            components += _details(exception, uid, site)
+            components.append('RECURRENCE-ID' +
+                              _occurrence_id(event, exception.date))
+            components += _start_end(exception.date, exception.date,
+                                     exception.time_from, exception.time_to)
+            components.append('END:VEVENT')
+    return [ical_fold(line) for line in components]
+
+
+def export_calendar(events, site=None, name=None, exceptions=None):
+    """
+    A whole iCalendar of events.  exceptions is a dict of recurring event id
+    to its exceptions.
+    """
+    if site is None:
+        site = Site.objects.get(is_default_site=True)
+    if exceptions is None:
+        exceptions = {}
+    return wrap_calendar([event_components(event, site,
+                                           exceptions.get(event.id, ()))
+                          for event in events], name)
+
+
+def wrap_calendar(events_components, name=None):
+    """An iCalendar of the lists of event_components"""
     ical_components = [
         'BEGIN:VCALENDAR',
         'VERSION:2.0',
-        'PRODID:-//Torchbox//wagtail//EN',
+        'PRODID:-//linuxsoftware//mamc-wagtail-site//EN',
     ]
+    if name:
+        ical_components.append('X-WR-CALNAME:' + ical_escape(name))
+    ical_components.append('X-WR-TIMEZONE:' + _tzid())
+    ical_components = [ical_fold(line) for line in ical_components]
+    ical_components += _vtimezone()
+    for components in events_components:
+        ical_components += components
+    ical_components.append('END:VCALENDAR')
+    return '\r\n'.join(ical_components) + '\r\n'
 
-    # Work out number of days the event lasts
-    if event.date_to is not None:
-        days = (event.date_to - event.date_from).days + 1
-    else:
-        days = 1
-
-    for day in range(days):
-        # Get date
-        date = event.date_from + timedelta(days=day)
-
-        # Get times
-        if event.time_from is not None:
-            start_time = event.time_from
-        else:
-            start_time = time.min
-        if event.time_to is not None:
-            end_time = event.time_to
-        else:
-            end_time = time.max
-
-        # Combine dates and times
-        start_datetime = datetime.combine(
-            date,
-            start_time
-        )
-        end_datetime = datetime.combine(date, end_time)
-
-        def add_slashes(string):
-            string.replace('"', '\\"')
-            string.replace('\\', '\\\\')
-            string.replace(',', '\\,')
-            string.replace(':', '\\:')
-            string.replace(';', '\\;')
-            string.replace('\n', '\\n')
-            return string
-
-        # Make a uid
-        uid = hashlib.sha1(event.url + str(start_datetime)).hexdigest() + '@wagtaildemo'
-
-        # Make event
-        ical_components.extend([
-            'BEGIN:VEVENT',
-            'UID:' + add_slashes(uid),
-            'URL:' + add_slashes(event.url),
-            'DTSTAMP:' + start_time.strftime('%Y%m%dT%H%M%S'),
-            'SUMMARY:' + add_slashes(event.title),
-            'DESCRIPTION:' + add_slashes(event.search_description),
-            'LOCATION:' + add_slashes(event.location),
-            'DTSTART;TZID=Europe/London:' + start_datetime.strftime('%Y%m%dT%H%M%S'),
-            'DTEND;TZID=Europe/London:' + end_datetime.strftime('%Y%m%dT%H%M%S'),
-            'END:VEVENT',
-        ])
-
-    # Finish event
-    ical_components.extend([
-        'END:VCALENDAR',
-    ])
-
-    # Join components
-    return '\r'.join(ical_components)
 
+def export_event(event, format='ical', site=None):
+    # Only ical format supported at the moment
+    if format != 'ical':
+        return
+    exceptions = {}
+    if hasattr(event, 'repeat'):
+        exceptions[event.id] = list(RecurringEventExceptionPage.objects
+                                    .live().filter(overrides=event))
+    return export_calendar([event], site, event.title, exceptions)
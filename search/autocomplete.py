@@ -0,0 +1,297 @@
+# ------------------------------------------------------------------------------
+# Autocomplete
+# A sorted index of the words that start live page titles and event locations,
+# looked up with bisect.  The index is kept in a snapshot file which each
+# worker maps into memory, so a lookup needs neither the database nor a copy
+# of the index per process.  Publishing a page rewrites the snapshot with just
+# that page's entries changed.  Entries are by page id, so that they still
+# find their page's url after it has been moved.
+# ------------------------------------------------------------------------------
+
+import os
+import re
+import mmap
+import fcntl
+import struct
+import tempfile
+import unicodedata
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+from wagtail.wagtailcore.models import Page
+from events.models import EventModels
+from website.utils import get_page_id_url_map
+
+# magic, number of keys, number of entries
+Header = struct.Struct("8sII")
+Magic = b"MAMCAC02"
+
+# Keys are the words of a title from each word on, cut short at this length
+MaxKeyLength = 60
+
+MaxResults = 10
+
+def getIndexPath():
+    return getattr(settings, 'AUTOCOMPLETE_INDEX_PATH',
+                   os.path.join(settings.BASE_DIR, 'var', 'autocomplete.idx'))
+
+def normalize(text):
+    """The words of text, lower case and without accents"""
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"\w+", text.casefold())
+
+def makeKeys(text):
+    """The keys that text can be found under, as bytes"""
+    words = normalize(text)
+    return {" ".join(words[num:])[:MaxKeyLength].encode('utf-8')
+            for num in range(len(words))}
+
+# ------------------------------------------------------------------------------
+# The snapshot file
+# After the header come the key offsets, the entry number of each key, the
+# entry offsets, then the keys and the entries themselves.  Each entry is
+# "id\ttitle\tlocation".
+# ------------------------------------------------------------------------------
+class _Strings(object):
+    """A sequence of the strings in a blob, good enough for bisect"""
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, num):
+        return bytes(self.blob[self.offsets[num]:self.offsets[num + 1]])
+
+class Snapshot(object):
+    def __init__(self, path):
+        with open(path, 'rb') as indexFile:
+            stat = os.fstat(indexFile.fileno())
+            self.ident = (stat.st_ino, stat.st_mtime_ns)
+            self.mmap = mmap.mmap(indexFile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        magic, numKeys, numEntries = Header.unpack_from(view)
+        if magic != Magic:
+            raise ValueError("{} is not an autocomplete index".format(path))
+        pos = Header.size
+        keyOffsets = view[pos:pos + (numKeys + 1) * 4].cast('I')
+        pos += (numKeys + 1) * 4
+        self.keyEntries = view[pos:pos + numKeys * 4].cast('I')
+        pos += numKeys * 4
+        entryOffsets = view[pos:pos + (numEntries + 1) * 4].cast('I')
+        pos += (numEntries + 1) * 4
+        self.keys = _Strings(keyOffsets, view[pos:])
+        pos += keyOffsets[-1]
+        self.entries = _Strings(entryOffsets, view[pos:])
+
+    def getEntry(self, num):
+        id, title, location = self.entries[num].decode('utf-8').split('\t')
+        return int(id), title, location
+
+    def find(self, prefix, limit):
+        """The entry numbers with keys that start with prefix"""
+        found = []
+        num = bisect_left(self.keys, prefix)
+        while num < len(self.keys) and len(found) < limit:
+            if not self.keys[num].startswith(prefix):
+                break
+            entry = self.keyEntries[num]
+            if entry not in found:
+                found.append(entry)
+            num += 1
+        return found
+
+    def readAll(self):
+        """
+        The entries as a dict of id to (title, location), and the keys as a
+        list of (key, id)
+        """
+        entries = {}
+        ids = []
+        for num in range(len(self.entries)):
+            id, title, location = self.getEntry(num)
+            entries[id] = (title, location)
+            ids.append(id)
+        keys = [(self.keys[num], ids[self.keyEntries[num]])
+                for num in range(len(self.keys))]
+        return entries, keys
+
+def _clean(text):
+    return " ".join(text.split())
+
+def _makeAllKeys(entries):
+    return [(key, id) for id, (title, location) in entries.items()
+            for key in makeKeys(title) | makeKeys(location)]
+
+def writeSnapshot(path, entries, keys=None):
+    """
+    Write the snapshot of entries, a dict of page id to (title, location),
+    and keys, a list of (key, page id) which is made from the entries if not
+    given.  The new file is moved into place, so a worker
+    never sees it half written.
+    """
+    if keys is None:
+        keys = _makeAllKeys(entries)
+    keys.sort()
+    ids = sorted(entries)
+    entryNums = {id: num for num, id in enumerate(ids)}
+
+    keyOffsets, keyEntries, entryOffsets = array('I', [0]), array('I'), \
+                                           array('I', [0])
+    keyBlob = bytearray()
+    for key, id in keys:
+        keyBlob += key
+        keyOffsets.append(len(keyBlob))
+        keyEntries.append(entryNums[id])
+    entryBlob = bytearray()
+    for id in ids:
+        title, location = entries[id]
+        entryBlob += "\t".join([str(id), title, location]).encode('utf-8')
+        entryOffsets.append(len(entryBlob))
+
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=folder, prefix=".autocomplete")
+    try:
+        with os.fdopen(fd, 'wb') as tmpFile:
+            tmpFile.write(Header.pack(Magic, len(keys), len(ids)))
+            for part in (keyOffsets, keyEntries, entryOffsets):
+                tmpFile.write(part.tobytes())
+            tmpFile.write(keyBlob)
+            tmpFile.write(entryBlob)
+        os.replace(tmpPath, path)
+    except Exception:
+        os.unlink(tmpPath)
+        raise
+
+@contextmanager
+def _locked(path):
+    # only one process at a time rewrites the snapshot
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", 'w') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+# ------------------------------------------------------------------------------
+# Building and updating
+# ------------------------------------------------------------------------------
+def _getEntries(within=None, tree=False):
+    """
+    The entries of the live, public pages, as a dict of page id to (title,
+    location); or only that of the page within, or of it and its
+    descendants if tree
+    """
+    pages = Page.objects.live().public().exclude(depth=1)
+    events = [model.objects.live().exclude(location="")
+              for model in EventModels]
+    if within is not None:
+        if tree:
+            pages = pages.filter(path__startswith=within.path)
+            events = [query.filter(path__startswith=within.path)
+                      for query in events]
+        else:
+            pages = pages.filter(id=within.id)
+            events = [query.filter(id=within.id) for query in events]
+    entries = {id: (_clean(title), "")
+               for id, title in pages.values_list('id', 'title').iterator()}
+    for query in events:
+        for id, location in query.values_list('id', 'location'):
+            if id in entries:
+                entries[id] = (entries[id][0], _clean(location))
+    return entries
+
+def buildIndex():
+    """Write the snapshot of all the live pages, from scratch"""
+    entries = _getEntries()
+    path = getIndexPath()
+    with _locked(path):
+        writeSnapshot(path, entries)
+    return len(entries)
+
+def updateIndex(page, remove=False, tree=False):
+    """
+    Rewrite the snapshot with the entries of page, and of its descendants if
+    tree, as they are now; or without page if remove.  Does nothing if there
+    is no snapshot yet, or nothing has changed.
+    """
+    path = getIndexPath()
+    if not os.path.exists(path):
+        return
+    ids = {page.id}
+    if remove:
+        found = {}
+    else:
+        found = _getEntries(page, tree)
+        if tree:
+            ids.update(Page.objects.filter(path__startswith=page.path)
+                                   .values_list('id', flat=True))
+    with _locked(path):
+        try:
+            entries, keys = Snapshot(path).readAll()
+        except ValueError:
+            # from an older version
+            writeSnapshot(path, _getEntries())
+            return
+        if all(entries.get(id) == found.get(id) for id in ids):
+            return
+        entries = {id: entry for id, entry in entries.items()
+                   if id not in ids}
+        entries.update(found)
+        keys = [(key, id) for key, id in keys if id not in ids]
+        keys += _makeAllKeys(found)
+        writeSnapshot(path, entries, keys)
+
+# ------------------------------------------------------------------------------
+# Lookups
+# ------------------------------------------------------------------------------
+_snapshot = None
+
+def getSnapshot():
+    """The current snapshot, building it if there isn't one"""
+    global _snapshot
+    path = getIndexPath()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        buildIndex()
+        stat = os.stat(path)
+    if _snapshot is None or _snapshot.ident != (stat.st_ino,
+                                                stat.st_mtime_ns):
+        # the old map stays good for anyone still using it
+        try:
+            _snapshot = Snapshot(path)
+        except ValueError:
+            # from an older version
+            buildIndex()
+            _snapshot = Snapshot(path)
+    return _snapshot
+
+def autocomplete(query, site, limit=MaxResults):
+    """
+    A list of dicts of the title, url and location of up to limit pages of
+    site that have a title or location with words starting with query
+    """
+    prefix = " ".join(normalize(query)).encode('utf-8')
+    if not prefix:
+        return []
+    snapshot = getSnapshot()
+    urlMap = get_page_id_url_map(site)
+    results = []
+    # some of what's found may be on other sites
+    for num in snapshot.find(prefix[:MaxKeyLength], limit * 2):
+        id, title, location = snapshot.getEntry(num)
+        url = urlMap.get(id)
+        if url is not None and url.startswith('/'):
+            results.append({'title':    title,
+                            'url':      url,
+                            'location': location})
+            if len(results) >= limit:
+                break
+    return results
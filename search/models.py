@@ -0,0 +1,46 @@
+# ------------------------------------------------------------------------------
+# Search models
+# There are none, but the autocomplete index and the popular search results
+# follow the pages
+# ------------------------------------------------------------------------------
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from wagtail.wagtailcore.models import Page, PageViewRestriction
+from wagtail.wagtailcore.signals import page_published, page_unpublished
+from search.autocomplete import updateIndex
+from search.popular import purgeResults, warmInBackground
+
+# ------------------------------------------------------------------------------
+# Recieve Signals
+# ------------------------------------------------------------------------------
+@receiver(page_published)
+@receiver(page_unpublished)
+def updateAutocomplete(sender, **kwargs):
+    updateIndex(kwargs['instance'])
+
+@receiver(post_delete)
+def removeFromAutocomplete(sender, **kwargs):
+    if issubclass(sender, Page):
+        updateIndex(kwargs['instance'], remove=True)
+
+@receiver(post_save, sender=Page)
+def moveInAutocomplete(sender, **kwargs):
+    # Page.move saves the page it moved as a plain Page.  It and what is under
+    # it may have gone into or out of a private section.
+    if kwargs.get('update_fields') is None and not kwargs.get('created'):
+        updateIndex(kwargs['instance'], tree=True)
+
+@receiver(post_save, sender=PageViewRestriction)
+@receiver(post_delete, sender=PageViewRestriction)
+def restrictInAutocomplete(sender, **kwargs):
+    # Restrictions apply to all the descendants too
+    updateIndex(kwargs['instance'].page, tree=True)
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def rewarmPopularSearches(sender, **kwargs):
+    purgeResults()
+    if getattr(settings, 'WARM_POPULAR_SEARCHES_ON_PUBLISH', False):
+        warmInBackground()
@@ -0,0 +1,113 @@
+# ------------------------------------------------------------------------------
+# Popular searches
+# The first page of results for the queries people search for most, worked
+# out ahead of time and kept in the cache, so that the search view doesn't
+# need to ask the search backend for them
+# ------------------------------------------------------------------------------
+
+import hashlib
+import datetime as dt
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailsearch.models import Query
+from wagtail.wagtailsearch.utils import normalise_query_string
+from website.pagecache import purgeCacheTags, tagVersion
+from website.background import runInBackground, locked
+
+# Purged whenever a page is published or unpublished
+SearchTag = "search:results"
+
+ResultsPerPage = 10
+
+# How many queries to keep warm, from the hits of how many days
+PopularCount = 50
+PopularDays  = 7
+
+# Held while warming, see website/background.py
+WarmingLock = "search-warming"
+
+# Go round again if pages are published while warming, but not forever
+MaxRuns = 3
+
+ResultsTimeout = 60 * 60 * 24
+
+def _resultsKey(queryString):
+    digest = hashlib.sha1(queryString.encode('utf-8')).hexdigest()
+    return "search:results:{}".format(digest)
+
+def getPopularQueries(num=PopularCount, days=PopularDays):
+    """The query strings with the most hits over the last days"""
+    # (Query.get_most_popular doesn't do date_since yet)
+    since = timezone.now().date() - dt.timedelta(days=days)
+    return list(Query.objects.filter(daily_hits__date__gte=since)
+                             .annotate(recent_hits=Sum('daily_hits__hits'))
+                             .order_by('-recent_hits', 'query_string')
+                             .values_list('query_string', flat=True)[:num])
+
+def getCachedResults(queryString):
+    """
+    The (page ids, number of results) of the first page of results for
+    queryString, if they are in the cache and still good; otherwise None
+    """
+    entry = cache.get(_resultsKey(normalise_query_string(queryString)))
+    if entry is not None:
+        version, ids, count = entry
+        if version == tagVersion(SearchTag):
+            return ids, count
+    return None
+
+class CachedResults(object):
+    """
+    Stands in for the search results in a Paginator, as long as only the
+    first page is wanted
+    """
+    def __init__(self, ids, count):
+        self.ids = ids
+        self._count = count
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        # anything unpublished since is left out
+        pages = Page.objects.live().in_bulk(self.ids)
+        return [pages[id] for id in self.ids if id in pages][key]
+
+def warmQuery(queryString, version):
+    """Run the search for queryString and keep its first page of results"""
+    results = Page.objects.live().search(queryString)
+    count = results.count()
+    ids = [page.id for page in results[:ResultsPerPage]]
+    cache.set(_resultsKey(queryString), (version, ids, count), ResultsTimeout)
+
+def warmPopularSearches(num=PopularCount, days=PopularDays):
+    """
+    Keep the results of the num most popular queries warm.  Returns the
+    queries, or None if someone else was already doing it.
+    """
+    with locked(WarmingLock, wait=False) as gotLock:
+        if not gotLock:
+            return None
+        queries = getPopularQueries(num, days)
+        for run in range(MaxRuns):
+            version = tagVersion(SearchTag)
+            for queryString in queries:
+                warmQuery(queryString, version)
+            if tagVersion(SearchTag) == version:
+                break
+        return queries
+
+def purgeResults():
+    purgeCacheTags(SearchTag)
+
+def warmInBackground():
+    """
+    Kick off warming the popular searches in a separate process, so as not
+    to hold up the publisher
+    """
+    runInBackground("warm_popular_searches")
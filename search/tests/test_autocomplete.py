@@ -0,0 +1,96 @@
+import os
+import json
+import shutil
+import tempfile
+import datetime as dt
+from django.test import override_settings
+from wagtail.wagtailcore.models import Site, PageViewRestriction
+from events.models import SimpleEventPage
+from website.models import PlainPage
+from search import autocomplete
+from search.autocomplete import buildIndex, normalize
+from website.tests.utils import SiteTestCase
+
+class TestAutocomplete(SiteTestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        indexSettings = override_settings(AUTOCOMPLETE_INDEX_PATH=
+                                 os.path.join(self.folder, "autocomplete.idx"))
+        indexSettings.enable()
+        self.addCleanup(indexSettings.disable)
+        super().setUp()
+        self.choir = self.home.add_child(instance=PlainPage(title="Choir",
+                                                            slug="choir"))
+        self.cafe = self.home.add_child(instance=PlainPage(title="Café Church",
+                                                           slug="cafe-church"))
+        self.market = self.home.add_child(instance=SimpleEventPage(
+                                          title="Night Market", slug="market",
+                                          date=dt.date(2016, 3, 4),
+                                          location="Church Hall"))
+        buildIndex()
+
+    def suggestUrls(self, query):
+        response = self.client.get("/search/autocomplete/", {'query': query})
+        return [result['url'] for result in
+                json.loads(response.content.decode())['results']]
+
+    def suggest(self, query):
+        response = self.client.get("/search/autocomplete/", {'query': query})
+        self.assertEqual(response.status_code, 200)
+        return [result['title'] for result in
+                json.loads(response.content.decode())['results']]
+
+    def test_normalize(self):
+        self.assertEqual(normalize("Café  CHURCH!"), ["cafe", "church"])
+
+    def test_prefixes(self):
+        self.assertEqual(self.suggest("ch"), ["Choir", "Café Church",
+                                              "Night Market"])
+        self.assertEqual(self.suggest("CAFE"), ["Café Church"])
+        self.assertEqual(self.suggest("market"), ["Night Market"])
+        self.assertEqual(self.suggest("church h"), ["Night Market"])
+        self.assertEqual(self.suggest("x"), [])
+        response = self.client.get("/search/autocomplete/",
+                                   {'query': "hall"})
+        self.assertEqual(json.loads(response.content.decode())['results'],
+                         [{'title': "Night Market", 'url': "/market/",
+                           'location': "Church Hall"}])
+
+    def test_no_queries(self):
+        site = Site.objects.get()
+        autocomplete.autocomplete("choir", site)
+        with self.assertNumQueries(0):
+            autocomplete.autocomplete("choir", site)
+
+    def test_publish(self):
+        self.choir.title = "Youth Choir"
+        self.choir.save_revision().publish()
+        self.assertEqual(self.suggest("you"), ["Youth Choir"])
+        self.assertEqual(self.suggest("choir"), ["Youth Choir"])
+        self.market.unpublish()
+        self.assertEqual(self.suggest("market"), [])
+        self.choir.delete()
+        self.assertEqual(self.suggest("choir"), [])
+        self.assertEqual(self.suggest("caf"), ["Café Church"])
+
+    def test_move(self):
+        self.choir.move(self.cafe, pos='last-child')
+        self.assertEqual(self.suggestUrls("choir"), ["/cafe-church/choir/"])
+        # moving along its siblings changes its treebeard path
+        self.cafe.refresh_from_db()
+        self.cafe.move(self.home, pos='first-child')
+        self.assertEqual(self.suggestUrls("cafe"), ["/cafe-church/"])
+        self.assertEqual(self.suggestUrls("choir"), ["/cafe-church/choir/"])
+        self.assertEqual(self.suggestUrls("market"), ["/market/"])
+
+    def test_restriction(self):
+        self.choir.move(self.cafe, pos='last-child')
+        restriction = PageViewRestriction.objects.create(page=self.cafe,
+                                                         password="secret")
+        self.assertEqual(self.suggest("ch"), ["Night Market"])
+        self.market.move(self.cafe, pos='last-child')
+        self.assertEqual(self.suggest("market"), [])
+        restriction.delete()
+        self.assertEqual(self.suggest("ch"), ["Choir", "Café Church",
+                                             "Night Market"])
@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+import datetime as dt
+from unittest import mock
+from django.test import override_settings
+from django.utils import timezone
+from wagtail.wagtailcore.query import PageQuerySet
+from wagtail.wagtailsearch.models import Query
+from website.models import PlainPage
+from website.background import locked
+from search.popular import getPopularQueries, warmPopularSearches, \
+        getCachedResults, WarmingLock
+from website.tests.utils import SiteTestCase
+
+class TestPopularSearches(SiteTestCase):
+    def setUp(self):
+        jobsDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, jobsDir)
+        jobSettings = override_settings(BACKGROUND_JOBS_DIR=jobsDir)
+        jobSettings.enable()
+        self.addCleanup(jobSettings.disable)
+        super().setUp()
+        self.pages = [self.home.add_child(instance=PlainPage(
+                                          title="Choir {}".format(num),
+                                          slug="choir-{}".format(num)))
+                      for num in range(12)]
+        today = timezone.now().date()
+        for queryString, hits, daysAgo in [("choir", 5, 0), ("organ", 2, 1),
+                                           ("bazaar", 9, 30)]:
+            query = Query.get(queryString)
+            for hit in range(hits):
+                query.add_hit(today - dt.timedelta(days=daysAgo))
+
+    def test_popular(self):
+        self.assertEqual(getPopularQueries(), ["choir", "organ"])
+        self.assertEqual(getPopularQueries(1), ["choir"])
+        self.assertEqual(getPopularQueries(days=60),
+                         ["bazaar", "choir", "organ"])
+
+    def test_served_from_cache(self):
+        self.assertEqual(warmPopularSearches(), ["choir", "organ"])
+        ids, count = getCachedResults("Choir ")
+        self.assertEqual((len(ids), count), (10, 12))
+        with mock.patch.object(PageQuerySet, 'search',
+                               side_effect=AssertionError("searched")):
+            response = self.client.get("/search/", {'query': "choir"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['search_results']), 10)
+        self.assertTrue(response.context['search_results'].has_next())
+        # the second page isn't cached
+        response = self.client.get("/search/", {'query': "choir",
+                                                'page': 2})
+        self.assertEqual(len(response.context['search_results']), 2)
+
+    def test_purged_on_publish(self):
+        warmPopularSearches()
+        self.pages[0].title = "Organ"
+        self.pages[0].save_revision().publish()
+        self.assertIsNone(getCachedResults("choir"))
+        warmPopularSearches()
+        self.assertEqual(getCachedResults("organ")[1], 1)
+
+    def test_one_at_a_time(self):
+        with locked(WarmingLock):
+            self.assertIsNone(warmPopularSearches())
+        self.assertEqual(warmPopularSearches(), ["choir", "organ"])
+
+    @override_settings(WARM_POPULAR_SEARCHES_ON_PUBLISH=True)
+    def test_warmed_once_on_publish(self):
+        with mock.patch('website.background.subprocess.Popen') as popen:
+            self.pages[0].save_revision().publish()
+            self.pages[1].save_revision().publish()
+        self.assertEqual(popen.call_count, 1)
+        self.assertEqual(popen.call_args[0][0][2:],
+                         ["run_job", "warm_popular_searches"])
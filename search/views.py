@@ -1,9 +1,18 @@
+from django.http import JsonResponse
 from django.shortcuts import render
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
 from wagtail.wagtailcore.models import Page
 from wagtail.wagtailsearch.models import Query
 
+from website import stats
+from website.utils import specific_pages
+from search.autocomplete import autocomplete as autocomplete_titles
+from search.popular import getCachedResults, CachedResults, ResultsPerPage
+
+# Don't suggest anything until there's at least this much to go on
+MinQueryLength = 2
+
 
 def search(request):
     search_query = request.GET.get('query', None)
@@ -11,7 +20,16 @@ def search(request):
 
     # Search
     if search_query:
-        search_results = Page.objects.live().search(search_query)
+        # the first page of the popular searches is kept in the cache
+        cached = None
+        if str(page) == "1":
+            cached = getCachedResults(search_query)
+        if cached is not None:
+            stats.hit("search_results")
+            search_results = CachedResults(*cached)
+        else:
+            stats.miss("search_results")
+            search_results = Page.objects.live().search(search_query)
         query = Query.get(search_query)
 
         # Record hit
@@ -20,7 +38,7 @@ def search(request):
         search_results = Page.objects.none()
 
     # Pagination
-    paginator = Paginator(search_results, 10)
+    paginator = Paginator(search_results, ResultsPerPage)
     try:
         search_results = paginator.page(page)
     except PageNotAnInteger:
@@ -28,7 +46,18 @@ def search(request):
     except EmptyPage:
         search_results = paginator.page(paginator.num_pages)
 
+    # The template wants the specific pages, load them a type at a time
+    search_results.object_list = specific_pages(search_results.object_list)
+
     return render(request, 'search/search.html', {
         'search_query': search_query,
         'search_results': search_results,
     })
+
+
+def autocomplete(request):
+    query = request.GET.get('query', "")
+    results = []
+    if len(query) >= MinQueryLength and request.site is not None:
+        results = autocomplete_titles(query, request.site)
+    return JsonResponse({'query': query, 'results': results})
@@ -0,0 +1,122 @@
+# ------------------------------------------------------------------------------
+# Background jobs
+# Work that follows on from publishing a page, but needn't hold up the
+# publisher, is done by a manage.py command run in a separate process.  A job
+# that is asked for again while it is still waiting to start is not started
+# twice, and only one run of each job goes at a time.
+# ------------------------------------------------------------------------------
+#
+# The jobs are kept track of with files in BACKGROUND_JOBS_DIR.  A job's
+# .pending file says it is wanted; it is made with O_EXCL, so only whoever
+# makes it starts a process.  That process waits on the job's .lock until
+# any run already going has finished, then removes .pending and runs the
+# command, so anything asked for meanwhile gets a run of its own.
+
+import os
+import re
+import sys
+import time
+import fcntl
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger("website.background")
+
+# A .pending file this old belongs to a process that never got going
+StaleSeconds = 60 * 10
+
+def getJobsDir():
+    return getattr(settings, 'BACKGROUND_JOBS_DIR',
+                   os.path.join(settings.BASE_DIR, 'var', 'jobs'))
+
+def getPython():
+    """
+    The Python to run manage.py with.  Under uWSGI and the like
+    sys.executable is the server, not Python, so then BACKGROUND_PYTHON
+    should be set.
+    """
+    python = getattr(settings, 'BACKGROUND_PYTHON', None)
+    if python:
+        return python
+    if os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    return os.path.join(sys.exec_prefix, "bin", "python3")
+
+def _jobPath(command, args):
+    name = "-".join((command,) + tuple(str(arg) for arg in args))
+    return os.path.join(getJobsDir(), re.sub(r"[^\w.-]", "_", name))
+
+def _markPending(path):
+    """True if the job wasn't already waiting to start"""
+    pending = path + ".pending"
+    try:
+        os.close(os.open(pending, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        try:
+            if time.time() - os.stat(pending).st_mtime < StaleSeconds:
+                return False
+        except FileNotFoundError:
+            # it has just started, so it may have missed our change
+            return _markPending(path)
+        os.utime(pending)
+        return True
+
+def runInBackground(command, *args):
+    """
+    Run manage.py command with args in a separate process, unless it is
+    already waiting to.  Returns True if a process was started.
+    """
+    path = _jobPath(command, args)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not _markPending(path):
+        return False
+    manage = os.path.join(settings.BASE_DIR, "manage.py")
+    try:
+        process = subprocess.Popen([getPython(), manage, "run_job", command]
+                                   + [str(arg) for arg in args],
+                                   stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL,
+                                   close_fds=True)
+    except OSError:
+        logger.exception("Couldn't start %s", command)
+        os.unlink(path + ".pending")
+        return False
+    # wait for it, so it doesn't hang about as a zombie when it is done
+    threading.Thread(target=process.wait, daemon=True).start()
+    return True
+
+@contextmanager
+def locked(name, wait=True):
+    """
+    Hold the lock file called name, over all processes; yields False if it
+    is held elsewhere and not wait
+    """
+    path = os.path.join(getJobsDir(), name + ".lock")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as lockFile:
+        try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX | (0 if wait else
+                                                   fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+@contextmanager
+def startJob(command, *args):
+    """Used by run_job around running command, see above"""
+    path = _jobPath(command, args)
+    with locked(os.path.basename(path)):
+        try:
+            os.unlink(path + ".pending")
+        except FileNotFoundError:
+            pass
+        yield
@@ -0,0 +1,83 @@
+# ------------------------------------------------------------------------------
+# Conditional GET
+# Answer If-None-Match and If-Modified-Since with 304 Not Modified, so that
+# browsers and proxies can check their copy is still good cheaply
+# ------------------------------------------------------------------------------
+
+import hashlib
+import calendar
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag, http_date, \
+        parse_http_date_safe
+
+# Headers that go along with a 304
+ValidatorHeaders = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+def makeETag(*parts):
+    """An ETag made from the string value of each of parts"""
+    text = "\n".join(str(part) for part in parts)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def _epoch(when):
+    return calendar.timegm(when.utctimetuple())
+
+def isNotModified(request, etag=None, lastModified=None):
+    """
+    True if the copy the client already has, according to the request's
+    If-None-Match or If-Modified-Since, is still good.  lastModified is an
+    aware datetime.
+    """
+    if lastModified is not None:
+        lastModified = _epoch(lastModified)
+    return _isNotModified(request, etag, lastModified)
+
+def isStillGood(request, headers):
+    """isNotModified for a response's validator headers, see getValidators"""
+    etag = None
+    if 'ETag' in headers:
+        etag = next(iter(parse_etags(headers['ETag'])), None)
+    lastModified = None
+    if 'Last-Modified' in headers:
+        lastModified = parse_http_date_safe(headers['Last-Modified'])
+    return _isNotModified(request, etag, lastModified)
+
+def _isNotModified(request, etag, lastModified):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    ifNoneMatch = request.META.get('HTTP_IF_NONE_MATCH')
+    if ifNoneMatch:
+        # If-Modified-Since is ignored when there is an If-None-Match
+        if etag is None:
+            return False
+        etags = parse_etags(ifNoneMatch)
+        return etag in etags or '*' in etags
+    ifModifiedSince = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if ifModifiedSince and lastModified is not None:
+        since = parse_http_date_safe(ifModifiedSince)
+        return since is not None and lastModified <= since
+    return False
+
+def getValidators(response):
+    """The validator headers of response, as a dict"""
+    return {name: response[name] for name in ValidatorHeaders
+            if response.has_header(name)}
+
+def notModified(headers=None):
+    """A 304 response, with the given validator headers"""
+    response = HttpResponseNotModified()
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+def setValidators(response, etag=None, lastModified=None, public=True):
+    """
+    Add the ETag and Last-Modified headers, and a Cache-Control that says
+    the response must be checked each time it is used
+    """
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
+    if lastModified is not None:
+        response['Last-Modified'] = http_date(_epoch(lastModified))
+    response['Cache-Control'] = "{}, max-age=0, must-revalidate".format(
+                                        "public" if public else "private")
+    return response
@@ -0,0 +1,163 @@
+# ------------------------------------------------------------------------------
+# Database routing
+# Anonymous GET and HEAD requests read from the replica database, everything
+# else uses the primary.  A visitor who has just written something, e.g.
+# submitted a form, stays on the primary for a while so they see it, and if
+# the replica is down or too far behind everyone goes back to the primary.
+# ------------------------------------------------------------------------------
+#
+# Only in use when settings.DATABASES has REPLICA_DATABASE (default "replica"),
+# otherwise the middleware removes itself and the router has no opinion.
+
+import time
+import logging
+import datetime as dt
+import threading
+from contextlib import suppress
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+
+logger = logging.getLogger("website.dbrouting")
+
+_local = threading.local()
+
+SafeMethods = ('GET', 'HEAD')
+
+# The cookie that keeps a visitor on the primary after they write
+PinCookie = "dbpin"
+
+# How often each process checks on the replica, in seconds
+CheckInterval = 5
+
+# How often the heartbeat is written to the primary, in seconds
+BeatInterval = 5
+
+# The times of the recent heartbeats, oldest first
+BeatKey = "dbrouting:beats"
+BeatLockKey = "dbrouting:beat:lock"
+
+def getReplicaAlias():
+    alias = getattr(settings, 'REPLICA_DATABASE', "replica")
+    return alias if alias in settings.DATABASES else None
+
+# ------------------------------------------------------------------------------
+# Replica health
+# ------------------------------------------------------------------------------
+_health = {'checkedAt': None, 'ok': False}
+
+def _beatPrimary(now, keepSeconds):
+    """
+    The times of the recent heartbeats written to the primary, oldest first,
+    writing one if due.  Those from more than keepSeconds ago are dropped,
+    all but the last of them.
+    """
+    from website.models import ReplicaHeartbeat
+    beats = cache.get(BeatKey)
+    if not beats:
+        beat = ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS)               \
+                               .values_list('beat', flat=True).first()
+        beats = [beat] if beat is not None else []
+    if not beats or (now - beats[-1]).total_seconds() >= BeatInterval:
+        # one process at a time writes it
+        if cache.add(BeatLockKey, True, BeatInterval):
+            ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS)                  \
+                            .update_or_create(id=1, defaults={'beat': now})
+            cutoff = now - dt.timedelta(seconds=keepSeconds)
+            older = [beat for beat in beats if beat < cutoff]
+            beats = older[-1:] + [beat for beat in beats if beat >= cutoff]
+            beats.append(now)
+            cache.set(BeatKey, beats, None)
+    return beats
+
+def _replicaBeat(alias):
+    from website.models import ReplicaHeartbeat
+    return ReplicaHeartbeat.objects.using(alias)                              \
+                           .values_list('beat', flat=True).first()
+
+def checkReplica(alias):
+    """
+    True if the replica is up, and has the heartbeats written to the primary
+    up to REPLICA_MAX_LAG seconds ago
+    """
+    maxLag = getattr(settings, 'REPLICA_MAX_LAG', 10)
+    try:
+        replicaBeat = _replicaBeat(alias)
+    except DatabaseError as err:
+        logger.warning("Replica %s is down: %s", alias, err)
+        with suppress(DatabaseError):
+            connections[alias].close()
+        return False
+    now = timezone.now()
+    beats = _beatPrimary(now, maxLag * 2)
+    if replicaBeat is None or not beats:
+        return False
+    missing = [beat for beat in beats if beat > replicaBeat]
+    if not missing:
+        return True
+    # it is behind by as long ago as the first beat it hasn't got
+    lag = (now - missing[0]).total_seconds()
+    if lag > maxLag:
+        logger.warning("Replica %s is %.1fs behind", alias, lag)
+        return False
+    return True
+
+def isReplicaHealthy(alias):
+    """checkReplica, but only every CheckInterval seconds per process"""
+    now = time.monotonic()
+    checkedAt = _health['checkedAt']
+    if checkedAt is None or now - checkedAt >= CheckInterval:
+        _health['ok'] = checkReplica(alias)
+        _health['checkedAt'] = now
+    return _health['ok']
+
+# ------------------------------------------------------------------------------
+# Routing
+# ------------------------------------------------------------------------------
+class ReplicaRouter(object):
+    """Reads go to the replica while the middleware says so"""
+    def db_for_read(self, model, **hints):
+        return getattr(_local, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        # even for objects that were read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica is a copy of the primary
+        aliases = {DEFAULT_DB_ALIAS, getReplicaAlias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the replica gets its tables, like everything else, from the primary
+        if db == getReplicaAlias():
+            return False
+        return None
+
+class ReplicaMiddleware(object):
+    def __init__(self):
+        self.alias = getReplicaAlias()
+        if self.alias is None:
+            raise MiddlewareNotUsed
+        self.pinSeconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+
+    def process_request(self, request):
+        # no session cookie means anonymous, without a query to find out
+        _local.replica = None
+        if (request.method in SafeMethods and
+            settings.SESSION_COOKIE_NAME not in request.COOKIES and
+            PinCookie not in request.COOKIES and
+            isReplicaHealthy(self.alias)):
+            _local.replica = self.alias
+        return None
+
+    def process_response(self, request, response):
+        _local.replica = None
+        if request.method not in SafeMethods:
+            response.set_cookie(PinCookie, "1", max_age=self.pinSeconds,
+                                httponly=True)
+        return response
@@ -0,0 +1,191 @@
+# ------------------------------------------------------------------------------
+# Instrumentation
+# Where the time goes for a (sampled) request: SQL, templates, caches and the
+# event calculations.  Reported in a Server-Timing header, a log line, and
+# aggregated per route in website.stats.
+# ------------------------------------------------------------------------------
+#
+# Turn it on with PERFORMANCE_SAMPLE_RATE, the fraction of requests to measure.
+# When it is 0 the middleware removes itself and timed() costs an attribute
+# lookup.
+
+import json
+import time
+import random
+import logging
+import threading
+from functools import wraps
+from collections import defaultdict
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger("website.performance")
+
+_local = threading.local()
+
+class Recorder(object):
+    """Collects the measurements for one request"""
+    def __init__(self):
+        self.start    = time.perf_counter()
+        self.timings  = defaultdict(float)
+        self.counts   = defaultdict(int)
+        self.tplDepth = 0
+
+    def add(self, name, seconds):
+        self.timings[name] += seconds
+        self.counts[name] += 1
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+def count(name, n=1):
+    """Count something happening during the current request, if measuring"""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None:
+        recorder.counts[name] += n
+
+def timed(name):
+    """Decorator to add the time spent in a function to the current request"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = getattr(_local, 'recorder', None)
+            if recorder is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# ------------------------------------------------------------------------------
+_templateRender = None
+
+def _timedTemplateRender(self, context):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None or recorder.tplDepth:
+        # only time the outermost template, includes are inside it
+        return _templateRender(self, context)
+    recorder.tplDepth += 1
+    start = time.perf_counter()
+    try:
+        return _templateRender(self, context)
+    finally:
+        recorder.tplDepth -= 1
+        recorder.add("template", time.perf_counter() - start)
+
+def _patchTemplates():
+    global _templateRender
+    if _templateRender is None:
+        _templateRender = Template.render
+        Template.render = _timedTemplateRender
+
+# ------------------------------------------------------------------------------
+class PerformanceMiddleware(object):
+    """
+    Measures a sample of requests.  Should go first in MIDDLEWARE_CLASSES so
+    that it sees all of the time taken.
+    """
+    def __init__(self):
+        self.sampleRate = getattr(settings, 'PERFORMANCE_SAMPLE_RATE', 0)
+        if not self.sampleRate:
+            raise MiddlewareNotUsed
+        _patchTemplates()
+
+    def process_request(self, request):
+        _local.recorder = None
+        if random.random() >= self.sampleRate:
+            return None
+        recorder = _local.recorder = Recorder()
+        recorder.queryStarts = {}
+        for conn in connections.all():
+            recorder.queryStarts[conn.alias] = (conn.force_debug_cursor,
+                                                len(conn.queries_log))
+            conn.force_debug_cursor = True
+        return None
+
+    def process_response(self, request, response):
+        recorder = getattr(_local, 'recorder', None)
+        if recorder is None:
+            return response
+        _local.recorder = None
+        total = time.perf_counter() - recorder.start
+
+        numQueries = 0
+        sqlTime = 0.0
+        for conn in connections.all():
+            forced, start = recorder.queryStarts.get(conn.alias, (False, 0))
+            conn.force_debug_cursor = forced
+            queries = list(conn.queries_log)[start:]
+            numQueries += len(queries)
+            sqlTime += sum(float(query['time']) for query in queries)
+
+        route = getattr(request, 'perf_route', None)
+        if route is None:
+            match = getattr(request, 'resolver_match', None)
+            route = getattr(match, 'url_name', None) or request.path
+
+        measures = [("sql",   sqlTime,          "{} queries".format(numQueries)),
+                    ("tpl",   recorder.timings.get("template", 0.0), "templates")]
+        for name in sorted(recorder.timings):
+            if name != "template":
+                measures.append((name, recorder.timings[name],
+                                 "{} calls".format(recorder.counts[name])))
+        measures.append(("total", total, route))
+        hits   = recorder.counts.get("cache_hits", 0)
+        misses = recorder.counts.get("cache_misses", 0)
+        response['Server-Timing'] = ", ".join(
+            ['{};dur={:.1f};desc="{}"'.format(name, secs * 1000, desc)
+             for name, secs, desc in measures] +
+            ['cache;desc="{} hits {} misses"'.format(hits, misses)])
+
+        logger.info(json.dumps({'path':     request.path,
+                                'route':    route,
+                                'status':   response.status_code,
+                                'ms':       round(total * 1000, 1),
+                                'queries':  numQueries,
+                                'sql_ms':   round(sqlTime * 1000, 1),
+                                'timings':  {name: round(secs * 1000, 1)
+                                             for name, secs in
+                                             recorder.timings.items()},
+                                'cache_hits':   hits,
+                                'cache_misses': misses}))
+        recordRoute(route, total, numQueries)
+        return response
+
+# ------------------------------------------------------------------------------
+# Aggregated per route
+# ------------------------------------------------------------------------------
+def recordRoute(route, seconds, numQueries):
+    from website import stats
+    area = "route:{}".format(route)
+    ms = int(seconds * 1000)
+    stats.incr(area, "requests")
+    stats.incr(area, "ms", ms)
+    stats.incr(area, "queries", numQueries)
+    stats.maximum(area, "max_ms", ms)
+    stats.maximum(area, "max_queries", numQueries)
+
+def routeStats():
+    """
+    A list of dicts of requests, avg_ms, max_ms, avg_queries, max_queries for
+    each route that has been measured
+    """
+    from website import stats
+    names = ("requests", "ms", "queries", "max_ms", "max_queries")
+    retval = []
+    for area in stats.areas():
+        if area.startswith("route:"):
+            counts = stats.get_counts(area, names)
+            if counts["requests"]:
+                retval.append({'route':       area[len("route:"):],
+                               'requests':    counts["requests"],
+                               'avg_ms':      counts["ms"] / counts["requests"],
+                               'max_ms':      counts["max_ms"],
+                               'avg_queries': counts["queries"] / counts["requests"],
+                               'max_queries': counts["max_queries"]})
+    return retval
@@ -0,0 +1,125 @@
+import re
+import datetime as dt
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.template import Template, Context
+from django.template.engine import Engine
+from django.test import RequestFactory
+from wagtail.wagtailcore.models import Site
+from events.models import CalendarPage, getAllEventsByWeek
+from website.utils import page_url
+
+# The month grid as it used to be rendered, an include of this for each day
+# (the include loads and compiles it every time)
+OldDay = """{% load website_tags %}
+{% if evod %}
+<td class="{{ evod.weekday }} day{% if evod.date == today %} today{% elif evod.date == yesterday %} yesterday{% elif evod.date == lastweek %} lastweek{% endif %}">
+  {% if evod.holiday %}
+  <div class="day-title holiday">
+      <h4><a href="{{ calendarUrl }}{{ evod.date|date:"Y/n/j" }}/">{{ evod.date.day }}</a></h4>
+      <div class="holiday-name">
+      {{ evod.holiday }}
+      </div>
+  </div>
+  {% else %}
+  <div class="day-title">
+      <h4><a href="{{ calendarUrl }}{{ evod.date|date:"Y/n/j" }}/">{{ evod.date.day }}</a></h4>
+  </div>
+  {% endif %}
+
+  <div class="days-events">
+    {% for event in evod.days_events %}
+      <a href="{% pageurl event %}" class="event">
+        {% if event.time_from %}<span class="event-time">{{event.time_from|time:"P"}} </span>{% endif %}<span class="event-title">{{event.title}}</span>
+      </a>
+    {% endfor %}
+    {% for event in evod.continuing_events %}
+      <a href="{% pageurl event %}" class="event event-continues">
+        {{event.title}}
+      </a>
+    {% endfor %}
+  </div>
+</td>
+{% else %}
+<td class="noday">&nbsp;</td>
+{% endif %}"""
+
+IncludeGrid = """{% for week in events %}<tr>{% for evod in week %}
+{% include "calendar_day.html" %}{% endfor %}</tr>{% endfor %}"""
+
+# And as it is now
+TagGrid = """{% load events_tags %}{% calendar_grid events %}"""
+
+def _normalize(html):
+    return re.sub(r"\s*([<>])\s*", r"\1", html)
+
+class Command(BaseCommand):
+    help = "Time rendering the calendar's month grid, per include and by tag"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calendar', type=int, default=None,
+                            help="Id of the calendar page (default is the "
+                                 "first one)")
+        parser.add_argument('--months', type=int, default=12,
+                            help="Number of months, from this one on")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Render each month this many times and "
+                                 "take the best")
+
+    def handle(self, *args, **options):
+        site = Site.objects.filter(is_default_site=True).first()
+        if site is None:
+            raise CommandError("No default site")
+        calendars = CalendarPage.objects.live()
+        if options['calendar']:
+            calendars = calendars.filter(id=options['calendar'])
+        calendarPage = calendars.first()
+        if calendarPage is None:
+            raise CommandError("No calendar page")
+        request = RequestFactory().get("/")
+        request.site = site
+        today = dt.date.today()
+        context = {'request':     request,
+                   'calendarUrl': page_url(calendarPage, site),
+                   'today':       today,
+                   'yesterday':   today - dt.timedelta(1),
+                   'lastweek':    today - dt.timedelta(7)}
+        oldEngine = Engine(loaders=[('django.template.loaders.locmem.Loader',
+                                     {"calendar_day.html": OldDay})])
+        templates = [oldEngine.from_string(IncludeGrid), Template(TagGrid)]
+
+        self.stdout.write("{:<8} {:>7} {:>11} {:>11}".format("month", "events",
+                                                           "include ms",
+                                                           "tag ms"))
+        totals = [0.0, 0.0]
+        for offset in range(options['months']):
+            year, month = divmod(today.year * 12 + today.month - 1 + offset, 12)
+            month += 1
+            # the events are looked up (and cached) before timing starts
+            weeks = getAllEventsByWeek(year, month)
+            numEvents = sum(len(evod.days_events) + len(evod.continuing_events)
+                            for week in weeks for evod in week if evod)
+            context['events'] = weeks
+            times = []
+            outputs = []
+            for template in templates:
+                best = None
+                for _ in range(max(1, options['repeat'])):
+                    start = perf_counter()
+                    html = template.render(Context(context))
+                    taken = perf_counter() - start
+                    best = taken if best is None else min(best, taken)
+                times.append(best)
+                outputs.append(_normalize(html))
+            totals[0] += times[0]
+            totals[1] += times[1]
+            self.stdout.write("{:<8} {:>7} {:>11.1f} {:>11.1f}{}".format(
+                              "{}-{:02}".format(year, month), numEvents,
+                              times[0] * 1000, times[1] * 1000,
+                              "" if outputs[0] == outputs[1] else
+                              "  (output differs)"))
+        if totals[1]:
+            self.stdout.write("Total {:.1f}ms by include, {:.1f}ms by tag, "
+                              "{:.1f}x faster".format(totals[0] * 1000,
+                                                      totals[1] * 1000,
+                                                      totals[0] / totals[1]))
@@ -0,0 +1,12 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from search.autocomplete import buildIndex, getIndexPath
+
+class Command(BaseCommand):
+    help = "Build the search autocomplete index of all the live pages"
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        numPages = buildIndex()
+        self.stdout.write("Indexed {} pages in {} in {:.1f}s".format(
+                          numPages, getIndexPath(), perf_counter() - start))
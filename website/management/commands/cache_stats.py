@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from website import stats
+
+
+class Command(BaseCommand):
+    help = "Show the hit rates of our caches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help="Zero the counters after showing them")
+
+    def handle(self, *args, **options):
+        rates = stats.hit_rates()
+        if not rates:
+            self.stdout.write("No cache stats yet")
+        for area, hits, misses, rate in rates:
+            self.stdout.write("{:<20} {:>9} hits {:>9} misses {:>6.1%}"
+                              .format(area, hits, misses, rate))
+            if options['reset']:
+                stats.reset(area)
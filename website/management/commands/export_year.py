@@ -0,0 +1,101 @@
+import sys
+import csv
+import datetime as dt
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from wagtail.wagtailcore.models import Site
+from events.models import SimpleEventPage, MultidayEventPage, \
+        RecurringEventPage, RecurringEventExceptionPage
+from events.expansion import expandRules, mergeDays
+from events.utils import export_calendar, absolute_url
+from website.utils import page_url
+
+class Command(BaseCommand):
+    help = "Export all the events of a year, e.g. for a printed programme"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=dt.date.today().year)
+        parser.add_argument('--format', choices=('csv', 'ical'), default='csv')
+        parser.add_argument('--output', default=None,
+                            help="File to write to (default is stdout)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Processes to expand the recurring events "
+                                 "with (default one per CPU)")
+
+    def handle(self, *args, **options):
+        site = Site.objects.filter(is_default_site=True).first()
+        if site is None:
+            raise CommandError("No default site")
+        year = options['year']
+        self.dateFrom = dt.date(year, 1, 1)
+        self.dateTo   = dt.date(year, 12, 31)
+        start = perf_counter()
+        simpleEvents = list(SimpleEventPage.objects.live()                    \
+                           .filter(date__range=(self.dateFrom, self.dateTo)))
+        multidayEvents = list(MultidayEventPage.objects.live()                \
+                           .filter(date_to__gte   = self.dateFrom)            \
+                           .filter(date_from__lte = self.dateTo))
+        recurringEvents = list(RecurringEventPage.objects.live())
+        expanded = expandRules([str(page.repeat) for page in recurringEvents],
+                               self.dateFrom, self.dateTo, options['workers'])
+        exceptionMap = RecurringEventExceptionPage.exceptions                 \
+                           .getExceptionMap(self.dateFrom, self.dateTo)
+        self.stderr.write("Expanded {} recurring events in {:.1f}s".format(
+                          len(recurringEvents), perf_counter() - start))
+
+        if options['output']:
+            out = open(options['output'], 'w', newline='')
+        else:
+            out = sys.stdout
+        try:
+            if options['format'] == 'csv':
+                self._writeCsv(out, site, simpleEvents, multidayEvents,
+                               recurringEvents, expanded, exceptionMap)
+            else:
+                # only the recurring events that happen this year
+                recurringEvents = [page for page, days in
+                                   zip(recurringEvents, expanded) if days]
+                exceptions = {eventId: list(byDate.values())
+                              for eventId, byDate in exceptionMap.items()}
+                out.write(export_calendar(simpleEvents + multidayEvents +
+                                          recurringEvents, site,
+                                          "Events {}".format(year),
+                                          exceptions))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+    def _writeCsv(self, out, site, simpleEvents, multidayEvents,
+                  recurringEvents, expanded, exceptionMap):
+        rows = []
+        def addRow(day, page):
+            url = page_url(page, site)
+            rows.append((day, page.time_from or dt.time.min,
+                         [day.isoformat(),
+                          page.time_from.strftime("%H:%M") if page.time_from
+                                                           else "",
+                          page.time_to.strftime("%H:%M") if page.time_to
+                                                         else "",
+                          page.title,
+                          page.location,
+                          absolute_url(site, url)]))
+        for page in simpleEvents:
+            addRow(page.date, page)
+        for page in multidayEvents:
+            day = max(page.date_from, self.dateFrom)
+            while day <= min(page.date_to, self.dateTo):
+                addRow(day, page)
+                day += dt.timedelta(days=1)
+        for ordinal, page in mergeDays(expanded, recurringEvents):
+            day = dt.date.fromordinal(ordinal)
+            exception = exceptionMap.get(page.id, {}).get(day)
+            if exception is None:
+                addRow(day, page)
+            elif not exception.hide:
+                addRow(day, exception)
+        rows.sort(key=lambda row: row[:2])
+        writer = csv.writer(out)
+        writer.writerow(["date", "time_from", "time_to", "title", "location",
+                         "url"])
+        for day, timeFrom, row in rows:
+            writer.writerow(row)
@@ -0,0 +1,224 @@
+import io
+import random
+import datetime as dt
+from time import perf_counter
+from PIL import Image as PILImage
+from django.core.files.images import ImageFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from dateutil.rrule import DAILY, WEEKLY, MONTHLY, YEARLY
+from wagtail.wagtailcore.models import Page, Site
+from wagtail.wagtailcore.blocks import StreamValue
+from wagtail.wagtailcore.rich_text import RichText
+from wagtail.wagtailimages.models import Image
+from website.models import StreamPage
+from website.utils import bulk_add_children, clear_page_urls
+from website.pagecache import purgeCacheTags, AllTag
+from events.models import EventIndexPage, CalendarPage, SimpleEventPage, \
+        MultidayEventPage, RecurringEventPage, RecurringEventExceptionPage
+from events.recurrence import Recurrence, Weekday
+
+Words = ("prayer praise youth choir garden harvest music study family "
+         "fellowship bible supper quiz market working bee mission craft "
+         "morning evening community picnic concert service lunch").split()
+
+# How many events go under each event index
+EventsPerIndex = 500
+
+# How many stream pages go under each section
+PagesPerSection = 100
+
+class Command(BaseCommand):
+    help = "Build a large made up site, to try things out at scale"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000,
+                            help="About how many pages to make")
+        parser.add_argument('--parent', type=int, default=None,
+                            help="Id of the page to put them under "
+                                 "(default is the site's home page)")
+        parser.add_argument('--images', type=int, default=20,
+                            help="How many images to make")
+        parser.add_argument('--seed', type=int, default=None,
+                            help="Seed for the random numbers")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        if options['parent']:
+            parent = Page.objects.get(id=options['parent'])
+        else:
+            site = Site.objects.filter(is_default_site=True).first()
+            if site is None:
+                raise CommandError("No default site, give a --parent")
+            parent = site.root_page
+        numPages = options['pages']
+        start = perf_counter()
+        self.made = 0
+        with transaction.atomic():
+            self.images = self._makeImages(options['images'])
+            numEvents = int(numPages * 0.7)
+            numStream = numPages - numEvents
+            self._makeEvents(parent, numEvents)
+            self._makeStreamPages(parent, numStream)
+        clear_page_urls()
+        purgeCacheTags(AllTag)
+        self.stdout.write("Made {} pages and {} images in {:.1f}s"
+                          .format(self.made, len(self.images),
+                                  perf_counter() - start))
+        self.stdout.write("Run update_index if not using the database "
+                          "search backend")
+
+    def _addChildren(self, parent, children):
+        children = bulk_add_children(parent, children)
+        self.made += len(children)
+        return children
+
+    def _title(self, num=2):
+        return " ".join(self.random.choice(Words)
+                        for _ in range(num)).title()
+
+    def _image(self):
+        if self.images and self.random.random() < 0.5:
+            return self.random.choice(self.images)
+        return None
+
+    def _makeImages(self, num):
+        images = []
+        for n in range(num):
+            colour = tuple(self.random.randrange(256) for _ in range(3))
+            f = io.BytesIO()
+            PILImage.new('RGB', (1600, 1000), colour).save(f, 'PNG')
+            name = "generated-{}".format(n)
+            images.append(Image.objects.create(title=name,
+                                               file=ImageFile(f, name+".png")))
+        return images
+
+    # --------------------------------------------------------------------------
+    def _makeEvents(self, parent, numEvents):
+        numIndexes = max(1, -(-numEvents // EventsPerIndex))
+        indexes = self._addChildren(parent,
+                                    [EventIndexPage(title="Events {}".format(n),
+                                                    slug="events-{}".format(n),
+                                                    show_in_menus=True)
+                                     for n in range(numIndexes)])
+        recurring = []
+        for n, index in enumerate(indexes):
+            todo = min(EventsPerIndex, numEvents - n * EventsPerIndex)
+            pages = [CalendarPage(title="Calendar", slug="calendar",
+                                  show_in_menus=True)]
+            for num in range(todo - 1):
+                pages.append(self._makeEvent(num))
+            pages = self._addChildren(index, pages)
+            recurring += [page for page in pages
+                          if isinstance(page, RecurringEventPage)]
+        for page in recurring:
+            self._makeExceptions(page)
+
+    def _makeEvent(self, num):
+        rand = self.random
+        kwargs = {'slug':      "event-{}".format(num),
+                  'title':     self._title(3),
+                  'location':  rand.choice(["Hall", "Church", "Lounge", ""]),
+                  'details':   "<p>{}</p>".format(self._title(12)),
+                  'image':     self._image()}
+        if rand.random() < 0.7:
+            kwargs['time_from'] = dt.time(rand.randrange(7, 21),
+                                          rand.choice((0, 15, 30, 45)))
+        today = dt.date.today()
+        choice = rand.random()
+        if choice < 0.6:
+            day = today + dt.timedelta(days=rand.randrange(-730, 730))
+            return SimpleEventPage(date=day, **kwargs)
+        elif choice < 0.8:
+            day = today + dt.timedelta(days=rand.randrange(-730, 730))
+            return MultidayEventPage(date_from=day,
+                                     date_to=day + dt.timedelta(
+                                                 days=rand.randrange(1, 14)),
+                                     **kwargs)
+        else:
+            return RecurringEventPage(repeat=self._makeRecurrence(), **kwargs)
+
+    def _makeRecurrence(self):
+        rand = self.random
+        dtstart = dt.datetime.combine(dt.date.today(), dt.time.min) -      \
+                  dt.timedelta(days=rand.randrange(0, 1500))
+        kwargs = {'dtstart': dtstart}
+        ending = rand.random()
+        if ending < 0.15:
+            kwargs['count'] = rand.randrange(2, 50)
+        elif ending < 0.3:
+            kwargs['until'] = dtstart + dt.timedelta(days=rand.randrange(30, 2000))
+        freq = rand.choice((DAILY, WEEKLY, WEEKLY, WEEKLY, MONTHLY, MONTHLY,
+                            YEARLY))
+        if freq == DAILY:
+            kwargs['interval'] = rand.choice((1, 2, 3, 7))
+        elif freq == WEEKLY:
+            kwargs['interval'] = rand.choice((1, 1, 1, 2, 4))
+            kwargs['byweekday'] = sorted(rand.sample(range(7),
+                                                     rand.randrange(1, 4)))
+        elif freq == MONTHLY:
+            if rand.random() < 0.5:
+                kwargs['bymonthday'] = [rand.randrange(1, 29)]
+            else:
+                kwargs['byweekday'] = [Weekday(rand.randrange(7),
+                                               rand.choice((1, 2, 3, 4, -1)))]
+        else:
+            kwargs['bymonth'] = [dtstart.month]
+            kwargs['bymonthday'] = [min(dtstart.day, 28)]
+        return Recurrence(freq=freq, **kwargs)
+
+    def _makeExceptions(self, page):
+        rand = self.random
+        numExceptions = rand.choice((0, 0, 1, 1, 2, 3))
+        dates = set()
+        after = page.repeat.dtstart
+        for num in range(numExceptions):
+            occurence = page.repeat.after(after)
+            if occurence is None:
+                break
+            dates.add(occurence.date())
+            after = occurence + dt.timedelta(days=rand.randrange(1, 60))
+        exceptions = [RecurringEventExceptionPage(
+                            title=page.title,
+                            slug="{}-{:%Y%m%d}".format(page.slug, date),
+                            overrides_id=page.id,
+                            date=date,
+                            hide=rand.random() < 0.3,
+                            time_from=page.time_from,
+                            location=page.location,
+                            details=page.details)
+                      for date in sorted(dates)]
+        self._addChildren(page, exceptions)
+
+    # --------------------------------------------------------------------------
+    def _makeStreamPages(self, parent, numPages):
+        numSections = max(1, -(-numPages // (PagesPerSection + 1)))
+        sections = self._addChildren(parent,
+                                     [StreamPage(title=self._title(),
+                                                 slug="section-{}".format(n),
+                                                 show_in_menus=True,
+                                                 content=self._makeStream())
+                                      for n in range(numSections)])
+        todo = numPages - numSections
+        for section in sections:
+            num = min(PagesPerSection, todo)
+            todo -= num
+            self._addChildren(section,
+                              [StreamPage(title=self._title(),
+                                          slug="page-{}".format(n),
+                                          show_in_menus=n < 8,
+                                          content=self._makeStream())
+                               for n in range(num)])
+
+    def _makeStream(self):
+        # native values, so nothing needs to be looked up
+        rand = self.random
+        blocks = [('heading', self._title(4))]
+        for n in range(rand.randrange(1, 6)):
+            image = self._image()
+            if image is not None and rand.random() < 0.3:
+                blocks.append(('image', image))
+            blocks.append(('paragraph',
+                           RichText("<p>{}</p>".format(self._title(40)))))
+        streamBlock = StreamPage._meta.get_field('content').stream_block
+        return StreamValue(streamBlock, blocks)
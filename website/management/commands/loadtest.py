@@ -0,0 +1,224 @@
+import os
+import random
+import threading
+import http.client
+import datetime as dt
+from time import perf_counter
+from urllib.parse import urlsplit
+from collections import defaultdict
+from socketserver import ThreadingMixIn
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import WSGIServer, WSGIRequestHandler
+from wagtail.wagtailcore.models import Site
+from events.models import CalendarPage, EventIndexPage, SimpleEventPage, \
+        MultidayEventPage, RecurringEventPage
+from events.icalfiles import getIcalPath, getIcalUrl, getMonths
+from website.utils import page_url
+
+SearchWords = ("prayer youth choir harvest music study family bible "
+               "supper market service concert picnic lunch").split()
+
+DefaultMix = "home=20,calendar=20,event=35,search=15,ical=10"
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def percentile(ordered, fraction):
+    """Nearest rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[rank]
+
+class Command(BaseCommand):
+    help = "Throw a mix of requests at the site and report how it copes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default=None,
+                            help="Base url of a server that is already "
+                                 "running (default is to serve cms.wsgi "
+                                 "from a server in this process)")
+        parser.add_argument('--host', default=None,
+                            help="Host header to send (default is the "
+                                 "default site's hostname)")
+        parser.add_argument('--mix', default=DefaultMix,
+                            help="Weights of each route "
+                                 "(default {})".format(DefaultMix))
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Number of clients at once")
+        parser.add_argument('--duration', type=float, default=30,
+                            help="Seconds to run for")
+        parser.add_argument('--requests', type=int, default=None,
+                            help="Stop after this many requests")
+        parser.add_argument('--warmup', type=int, default=0,
+                            help="Requests to make, and ignore, first")
+        parser.add_argument('--seed', type=int, default=None,
+                            help="Seed for the random numbers")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        mix = self._parseMix(options['mix'])
+        site = Site.objects.filter(is_default_site=True).first()
+        if site is None:
+            raise CommandError("No default site")
+        urls = self._findUrls(site)
+        if urls['ical'] and not options['target'] and not settings.DEBUG:
+            # cms/urls.py only serves media files when DEBUG is on
+            self.stderr.write("Skipping the ical route, as the .ics files "
+                              "are not served without DEBUG (use --target "
+                              "for a server that serves MEDIA_URL)")
+            urls['ical'] = []
+        mix = [(route, weight) for route, weight in mix if urls.get(route)]
+        if not mix:
+            raise CommandError("Nothing to request")
+        host = options['host'] or site.hostname
+
+        server = None
+        if options['target']:
+            target = urlsplit(options['target'])
+            address = (target.hostname, target.port or 80)
+        else:
+            from cms.wsgi import application
+            server = ThreadingWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+            server.set_app(application)
+            address = server.server_address
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.stdout.write("Requesting from http://{}:{}/ as {}".format(
+                                                         address[0],
+                                                         address[1], host))
+        try:
+            if options['warmup']:
+                self._run(address, host, mix, urls, 1, None,
+                          options['warmup'])
+            start = perf_counter()
+            results = self._run(address, host, mix, urls,
+                                options['concurrency'], options['duration'],
+                                options['requests'])
+            elapsed = perf_counter() - start
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        self._report(results, elapsed)
+
+    def _parseMix(self, value):
+        mix = []
+        for part in value.split(","):
+            route, _, weight = part.partition("=")
+            try:
+                mix.append((route.strip(), float(weight or 1)))
+            except ValueError:
+                raise CommandError("Bad mix {}".format(part))
+        return mix
+
+    def _findUrls(self, site):
+        urls = {'home': ["/"]}
+        today = dt.date.today()
+        urls['calendar'] = []
+        for calendar in CalendarPage.objects.live()[:20]:
+            base = page_url(calendar, site)
+            urls['calendar'].append(base)
+            for offset in range(-12, 13):
+                year, month = divmod(today.year * 12 + today.month - 1 + offset,
+                                     12)
+                urls['calendar'].append("{}{}/{}/".format(base, year, month+1))
+        events = []
+        for model in (SimpleEventPage, MultidayEventPage, RecurringEventPage):
+            events += list(model.objects.live().order_by('?')[:200])
+        urls['event'] = [page_url(event, site) for event in events]
+        # the static .ics files, if write_ical_files has made them
+        urls['ical'] = []
+        for page in list(CalendarPage.objects.live()[:20]) +                 \
+                    list(EventIndexPage.objects.live()[:20]):
+            for year, month in [(None, None)] + getMonths(today):
+                path = getIcalPath(page, year, month)
+                if os.path.exists(os.path.join(settings.MEDIA_ROOT, path)):
+                    urls['ical'].append(getIcalUrl(page, year, month))
+        urls['search'] = ["/search/?query={}".format(word)
+                          for word in SearchWords]
+        return urls
+
+    def _run(self, address, host, mix, urls, concurrency, duration, limit):
+        routes  = [route for route, weight in mix]
+        weights = [weight for route, weight in mix]
+        results = defaultdict(list)
+        lock = threading.Lock()
+        counter = [0]
+        deadline = perf_counter() + duration if duration else None
+        seeds = [self.random.random() for _ in range(concurrency)]
+
+        def client(seed):
+            rand = random.Random(seed)
+            while True:
+                with lock:
+                    if limit is not None and counter[0] >= limit:
+                        return
+                    counter[0] += 1
+                if deadline is not None and perf_counter() > deadline:
+                    return
+                route = self._choose(rand, routes, weights)
+                url = rand.choice(urls[route])
+                status, taken = self._request(address, host, url)
+                with lock:
+                    results[route].append((status, taken))
+
+        threads = [threading.Thread(target=client, args=(seed,))
+                   for seed in seeds]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _choose(self, rand, routes, weights):
+        point = rand.random() * sum(weights)
+        for route, weight in zip(routes, weights):
+            point -= weight
+            if point < 0:
+                return route
+        return routes[-1]
+
+    def _request(self, address, host, url):
+        start = perf_counter()
+        try:
+            conn = http.client.HTTPConnection(*address, timeout=60)
+            conn.request("GET", url, headers={'Host': host})
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status = None
+        return status, perf_counter() - start
+
+    def _report(self, results, elapsed):
+        total = sum(len(samples) for samples in results.values())
+        errors = 0
+        self.stdout.write("{:<10} {:>7} {:>7} {:>8} {:>8} {:>8} {:>8}"
+                          .format("route", "count", "errors", "p50 ms",
+                                  "p90 ms", "p99 ms", "max ms"))
+        for route in sorted(results):
+            samples = results[route]
+            # only the pages actually served count towards the timings
+            times = sorted(taken * 1000 for status, taken in samples
+                           if status == 200)
+            numErrors = len(samples) - len(times)
+            errors += numErrors
+            self.stdout.write("{:<10} {:>7} {:>6.1%} {:>8.1f} {:>8.1f} "
+                              "{:>8.1f} {:>8.1f}".format(
+                                  route, len(samples),
+                                  numErrors / len(samples),
+                                  percentile(times, 0.50),
+                                  percentile(times, 0.90),
+                                  percentile(times, 0.99),
+                                  percentile(times, 1.0)))
+        if total:
+            self.stdout.write("{} requests in {:.1f}s, {:.1f} per second, "
+                              "{:.1%} errors".format(total, elapsed,
+                                                     total / elapsed,
+                                                     errors / total))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from wagtail.wagtailimages.models import Image
+from website.renditions import getImageSpecs, findMissing, generate
+
+
+class Command(BaseCommand):
+    help = "Generate any missing image renditions that our templates use"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=None,
+                            help="Only the images used on this page")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of worker processes "
+                                 "(default is the number of CPUs)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Just list the missing renditions")
+
+    def handle(self, *args, **options):
+        missing = findMissing(getImageSpecs(options['page']))
+        titles = dict(Image.objects.filter(id__in=[imageId for imageId, specs
+                                                   in missing])
+                                   .values_list('id', 'title'))
+        numRenditions = sum(len(specs) for imageId, specs in missing)
+        self.stdout.write("{} missing renditions of {} images"
+                          .format(numRenditions, len(missing)))
+        if options['dry_run']:
+            for imageId, specs in missing:
+                self.stdout.write("  {}: {}".format(titles.get(imageId, imageId),
+                                                    " ".join(specs)))
+            return
+
+        total = 0.0
+        for imageId, specs, taken, error in generate(missing, options['workers']):
+            total += taken
+            title = titles.get(imageId, imageId)
+            if error:
+                self.stderr.write("  {}: FAILED {}".format(title, error))
+            else:
+                self.stdout.write("  {}: {} in {:.2f}s".format(title,
+                                                            " ".join(specs),
+                                                            taken))
+        if missing:
+            self.stdout.write("Done, {:.2f}s of work".format(total))
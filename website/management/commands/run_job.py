@@ -0,0 +1,17 @@
+import argparse
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from website.background import startJob
+
+class Command(BaseCommand):
+    help = "Run a command as a background job (see website/background.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('command')
+        parser.add_argument('args', nargs=argparse.REMAINDER)
+
+    def handle(self, *args, **options):
+        command = options['command']
+        with startJob(command, *args):
+            call_command(command, *args, stdout=self.stdout,
+                         stderr=self.stderr)
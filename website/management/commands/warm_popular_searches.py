@@ -0,0 +1,25 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from search.popular import warmPopularSearches, PopularCount, PopularDays
+
+class Command(BaseCommand):
+    help = "Run the most popular searches and keep their first page of " \
+           "results in the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--num', type=int, default=PopularCount,
+                            help="How many of the queries to run")
+        parser.add_argument('--days', type=int, default=PopularDays,
+                            help="Popular over how many days")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        queries = warmPopularSearches(options['num'], options['days'])
+        if queries is None:
+            self.stdout.write("Already warming the popular searches")
+            return
+        if int(options['verbosity']) > 1:
+            for queryString in queries:
+                self.stdout.write(queryString)
+        self.stdout.write("Ran {} searches in {:.1f}s".format(
+                          len(queries), perf_counter() - start))
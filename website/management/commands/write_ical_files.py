@@ -0,0 +1,28 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from events.icalfiles import writeIcalFiles, removeStaleFiles
+
+class Command(BaseCommand):
+    help = "Write the static .ics files of the calendars and event indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-stale', action='store_true', default=False,
+                            help="Don't remove the files of old months and "
+                                 "pages that are no longer live")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        written, unchanged = writeIcalFiles()
+        removed = []
+        if not options['keep_stale']:
+            removed = removeStaleFiles(written + unchanged)
+        verbosity = int(options['verbosity'])
+        if verbosity > 1:
+            for path in written:
+                self.stdout.write("Wrote {}".format(path))
+            for path in removed:
+                self.stdout.write("Removed {}".format(path))
+        self.stdout.write("Wrote {} files, {} were unchanged, removed {} in "
+                          "{:.1f}s".format(len(written), len(unchanged),
+                                           len(removed),
+                                           perf_counter() - start))
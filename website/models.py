@@ -3,8 +3,12 @@
 # These are pages and things used across the site
 # ------------------------------------------------------------------------------
 
+from django.conf import settings
 from django.db import models
-from wagtail.wagtailcore.models import Page
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from wagtail.wagtailcore.models import Page, Site, PageViewRestriction
+from wagtail.wagtailcore.signals import page_published, page_unpublished
 from wagtail.wagtailcore.fields import RichTextField, StreamField
 from modelcluster.fields import ParentalKey
 from wagtail.wagtailadmin.edit_handlers import (FieldPanel, MultiFieldPanel,
@@ -14,7 +18,14 @@ from wagtail.wagtaildocs.edit_handlers import DocumentChooserPanel
 from wagtail.wagtailcore.blocks import CharBlock, RichTextBlock
 from wagtail.wagtailimages.blocks import ImageChooserBlock
 from wagtail.wagtailembeds.blocks import EmbedBlock
+from wagtail.wagtailimages.models import AbstractImage, AbstractRendition
+from wagtail.wagtaildocs.models import Document
 from website.coreutils import validate_only_one_instance
+from website.utils import clear_page_urls, page_url_is_current
+from website.streamcache import render_stream, purgeMediaBlocks
+from website.renditions import pageModels, pregenerateInBackground
+from website.pagecache import purgePage, purgeCacheTags, AllTag
+from website.sitemap import purgeSitemap
 
 # ------------------------------------------------------------------------------
 # A couple of abstract classes that contain commonly used fields
@@ -37,6 +48,9 @@ class LinkFields(models.Model):
 
     @property
     def link(self):
+        # see website.utils.resolve_links
+        if hasattr(self, '_resolved_link'):
+            return self._resolved_link
         if self.link_page:
             return self.link_page.url
         elif self.link_document:
@@ -86,6 +100,11 @@ class StreamPage(Page):
         StreamFieldPanel('content')
         ]
 
+    @property
+    def rendered_content(self):
+        # see website.streamcache
+        return render_stream(self.content)
+
     promote_panels = [
         MultiFieldPanel(Page.promote_panels, "Common page configuration")
         ]
@@ -106,6 +125,92 @@ class PlainPage(Page):
         MultiFieldPanel(Page.promote_panels, "Common page configuration")
         ]
 
+# ------------------------------------------------------------------------------
+# Database replication
+# ------------------------------------------------------------------------------
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row, written to the primary database every so often, that shows
+    how far behind the read replica is (see website/dbrouting.py)
+    """
+    beat = models.DateTimeField()
+
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
 
+# ------------------------------------------------------------------------------
+# Recieve Signals
+# ------------------------------------------------------------------------------
+_urlFields = {'slug', 'url_path', 'path'}
+
+@receiver(post_save)
+def clearPageUrlsOnSave(sender, **kwargs):
+    # Creating, moving, or changing the slug of a page all do a full save, but
+    # so does publishing, so check the url really has changed.  Saving a draft
+    # revision only updates a few other fields.
+    if issubclass(sender, Page):
+        updateFields = kwargs.get('update_fields')
+        if ((updateFields is None or _urlFields & set(updateFields)) and
+            not page_url_is_current(kwargs['instance'])):
+            clear_page_urls()
+    elif issubclass(sender, Site):
+        clear_page_urls()
+
+@receiver(post_delete)
+def clearPageUrlsOnDelete(sender, **kwargs):
+    if issubclass(sender, (Page, Site)):
+        clear_page_urls()
+
+@receiver(post_save)
+@receiver(post_delete)
+def purgeSitemapChunks(sender, **kwargs):
+    # Publishing, unpublishing and moving pages all do a full save
+    if issubclass(sender, Page) and kwargs.get('update_fields') is None:
+        purgeSitemap(kwargs['instance'])
+
+@receiver(post_save)
+@receiver(post_delete)
+def purgeMediaBlocksOnChange(sender, signal, **kwargs):
+    # A replaced image has its renditions deleted and is saved again, and a
+    # document's url has its filename in.  (New renditions are made all the
+    # time, and don't change anything.)
+    if (issubclass(sender, (AbstractImage, Document)) or
+        (signal is post_delete and issubclass(sender, AbstractRendition))):
+        purgeMediaBlocks()
+
+@receiver(page_published)
+def pregenerateRenditions(sender, **kwargs):
+    if (getattr(settings, 'PREGENERATE_RENDITIONS_ON_PUBLISH', False) and
+        issubclass(sender, pageModels())):
+        pregenerateInBackground(kwargs['instance'])
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def purgePageCache(sender, **kwargs):
+    purgePage(kwargs['instance'])
+
+@receiver(post_delete)
+def purgePageCacheOnDelete(sender, **kwargs):
+    if sender is Page:
+        purgePage(kwargs['instance'])
+
+@receiver(pre_save, sender=Page)
+def stashUrlPath(sender, instance, update_fields=None, **kwargs):
+    # the url_path from before Page.move, which saves the page it moved as a
+    # plain Page (after treebeard has already changed its path)
+    if update_fields is None and instance.pk is not None:
+        stored = Page.objects.filter(pk=instance.pk)
+        instance._urlPathWas = stored.values_list('url_path', flat=True).first()
+
+@receiver(post_save, sender=Page)
+def purgePageCacheOnMove(sender, instance, **kwargs):
+    # moving it among its siblings reorders its parent's list too
+    if kwargs.get('update_fields') is None and not kwargs.get('created'):
+        purgePage(instance, getattr(instance, '_urlPathWas', None))
+
+@receiver(post_save, sender=PageViewRestriction)
+@receiver(post_delete, sender=PageViewRestriction)
+def purgePageCacheOnRestriction(sender, **kwargs):
+    # Restrictions apply to all the descendants too
+    purgeCacheTags(AllTag)
@@ -0,0 +1,202 @@
+# ------------------------------------------------------------------------------
+# Page cache
+# Whole responses for anonymous visitors, tagged with what they depend upon so
+# that publishing a page only purges the entries it affects
+# ------------------------------------------------------------------------------
+
+import datetime as dt
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from wagtail.wagtailcore.models import Page
+from website import stats
+from website.conditional import getValidators, isStillGood, notModified
+
+# Every entry has this tag, purge it to throw everything away
+AllTag = "all"
+
+# Entries for pages that show the menus or site map
+MenuTag = "menu"
+
+# The query string parameters that pages read.  Requests with any others,
+# which would each need an entry of their own, aren't cached.
+CacheableParams = ('page', 'format')
+
+# except for these, which pages never read, so they are left out of the key
+IgnoredParams = ('utm_', 'fbclid', 'gclid')
+
+def _timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60)
+
+def _tagKey(tag):
+    return "pagecache:tag:{}".format(tag)
+
+def pageTag(page):
+    return "page:{}".format(page.id)
+
+# ------------------------------------------------------------------------------
+# Used while rendering a page
+# ------------------------------------------------------------------------------
+def addCacheTags(request, *tags):
+    """Record that the response to request depends upon tags"""
+    if hasattr(request, '_page_cache_tags'):
+        request._page_cache_tags.update(tags)
+
+def expireCacheAt(request, when):
+    """The response to request is only good until the (naive, local) datetime"""
+    if hasattr(request, '_page_cache_tags'):
+        expires = getattr(request, '_page_cache_expires', None)
+        if expires is None or when < expires:
+            request._page_cache_expires = when
+
+def expireCacheAtMidnight(request):
+    tomorrow = dt.date.today() + dt.timedelta(days=1)
+    expireCacheAt(request, dt.datetime.combine(tomorrow, dt.time.min))
+
+# ------------------------------------------------------------------------------
+# Invalidation
+# ------------------------------------------------------------------------------
+def purgeCacheTags(*tags):
+    """Invalidate every entry tagged with any of tags"""
+    cache.set_many({_tagKey(tag): uuid.uuid4().hex for tag in tags}, None)
+
+def tagVersion(tag):
+    """
+    The current version of tag, handy for keying other cache entries which
+    should be thrown away along with the pages
+    """
+    return _tagVersions([tag])[tag]
+
+def tagVersions(*tags):
+    """The current versions of tags, as a dict, with one trip to the cache"""
+    return _tagVersions(tags)
+
+def purgePage(page, movedFrom=None):
+    """
+    Invalidate the entries which depend upon page, and if it has been moved
+    from the url_path movedFrom, those which showed it there
+    """
+    tags = [pageTag(page)]
+    # index pages list their children
+    tags += ["page:{}".format(id) for id in
+             page.get_ancestors().values_list('id', flat=True)]
+    # the menus and site map show the top couple of levels, and we don't know
+    # if show_in_menus has just been turned off
+    if page.show_in_menus or page.depth <= 4:
+        tags.append(MenuTag)
+    if movedFrom is not None and movedFrom != page.url_path:
+        # its old parent listed it, and the links to it and to everything
+        # under it have changed
+        parts = movedFrom.strip('/').split('/')
+        oldPaths = ["/" + "".join(part + "/" for part in parts[:num])
+                    for num in range(len(parts))]
+        tags += ["page:{}".format(id) for id in
+                 Page.objects.filter(url_path__in=oldPaths)
+                             .values_list('id', flat=True)]
+        tags += ["page:{}".format(id) for id in
+                 page.get_descendants().values_list('id', flat=True)]
+        tags.append(MenuTag)
+    purgeCacheTags(*tags)
+
+# ------------------------------------------------------------------------------
+# Serving
+# ------------------------------------------------------------------------------
+def _isCacheable(request):
+    return (request.method in ('GET', 'HEAD') and
+            not request.user.is_authenticated() and
+            getattr(settings, 'PAGE_CACHE_ENABLED', True) and
+            all(name in CacheableParams or name.startswith(IgnoredParams)
+                for name in request.GET))
+
+def _cacheKey(request, page, serve_args, serve_kwargs):
+    # The route kwargs rather than the path, so e.g. /calendar/2016/jan/ and
+    # /calendar/2016/1/ share an entry.  Likewise the parameters, in order.
+    params = sorted((name, value) for name in CacheableParams
+                                  for value in request.GET.getlist(name))
+    parts = [str(request.site.id),
+             str(page.id),
+             repr(list(serve_args)),
+             repr(sorted(serve_kwargs.items())),
+             repr(params)]
+    digest = hashlib.sha1("\n".join(parts).encode('utf-8')).hexdigest()
+    return "pagecache:page:{}".format(digest)
+
+def serveFromCache(page, request, serve_args, serve_kwargs):
+    """
+    Return the cached response for serving page, or None.  In which case the
+    page cache middleware will store the response on the way out.
+    """
+    if not _isCacheable(request):
+        return None
+    key = _cacheKey(request, page, serve_args, serve_kwargs)
+    entry = cache.get(key)
+    # (entries from before validators were kept have only 3 parts)
+    if entry is not None and len(entry) == 4:
+        content, contentType, tagVersions, headers = entry
+        currentVersions = cache.get_many([_tagKey(tag) for tag in tagVersions])
+        if all(currentVersions.get(_tagKey(tag)) == version
+               for tag, version in tagVersions.items()):
+            stats.hit("page_cache")
+            if isStillGood(request, headers):
+                response = notModified(headers)
+            else:
+                response = HttpResponse(content, content_type=contentType)
+                for name, value in headers.items():
+                    response[name] = value
+            response['X-Page-Cache'] = "hit"
+            return response
+    stats.miss("page_cache")
+    request._page_cache_key = key
+    request._page_cache_page = page
+    request._page_cache_tags = {AllTag, pageTag(page)}
+    return None
+
+def _tagVersions(tags):
+    keys = [_tagKey(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    for key, version in missing.items():
+        if not cache.add(key, version, None):
+            version = cache.get(key)
+        versions[key] = version
+    return {tag: versions[_tagKey(tag)] for tag in tags}
+
+class PageCacheMiddleware(object):
+    """
+    Stores the responses for pages that were looked for but not found by
+    serveFromCache (see website/wagtail_hooks.py).  Should go near the top of
+    MIDDLEWARE_CLASSES, above the session, CSRF and messages middleware, so
+    that it sees any cookies they set.
+    """
+    def process_response(self, request, response):
+        key = getattr(request, '_page_cache_key', None)
+        if (key is None or
+            request.method != 'GET' or
+            response.status_code != 200 or
+            response.streaming or
+            response.cookies or
+            request.META.get('CSRF_COOKIE_USED') or
+            'private' in response.get('Cache-Control', '') or
+            'no-store' in response.get('Cache-Control', '')):
+            return response
+
+        timeout = _timeout()
+        expires = getattr(request, '_page_cache_expires', None)
+        if expires is not None:
+            timeout = min(timeout,
+                          int((expires - dt.datetime.now()).total_seconds()))
+        if timeout <= 0:
+            return response
+        # Never store pages which are password protected (restrictions being
+        # added or removed later purges everything)
+        if request._page_cache_page.get_view_restrictions().exists():
+            return response
+
+        tagVersions = _tagVersions(request._page_cache_tags)
+        entry = (response.content, response['Content-Type'], tagVersions,
+                 getValidators(response))
+        cache.set(key, entry, timeout)
+        response['X-Page-Cache'] = "miss"
+        return response
@@ -0,0 +1,137 @@
+# ------------------------------------------------------------------------------
+# Renditions
+# Generate the image renditions our templates use ahead of time, rather than
+# in whichever request happens to ask for them first
+# ------------------------------------------------------------------------------
+
+import time
+from collections import defaultdict
+from multiprocessing import Pool
+from django.apps import apps
+from django.db import connections
+from website import stats
+from website.background import runInBackground
+
+# The filter specs used by the templates for each image field
+# (keep this up to date with the {% image %} tags)
+#            model                             image field     page field  filter specs
+RenditionSpecs = [
+            ('home.HomePage',                  'banner_image', 'id',       ['fill-1400x650']),
+            ('home.HomePageHighlight',         'image',        'homepage', ['fill-260x140']),
+            ('events.SimpleEventPage',         'image',        'id',       ['width-180', 'width-100']),
+            ('events.MultidayEventPage',       'image',        'id',       ['width-180', 'width-100']),
+            ('events.RecurringEventPage',      'image',        'id',       ['width-180', 'width-100']),
+            ('events.RecurringEventExceptionPage', 'image',    'id',       ['width-180', 'width-100']),
+           ]
+
+def pageModels():
+    """The page models whose publishing may need new renditions"""
+    models = set()
+    for label, imageField, pageField, specs in RenditionSpecs:
+        model = apps.get_model(label)
+        if pageField == 'id':
+            models.add(model)
+        else:
+            models.add(model._meta.get_field(pageField).related_model)
+    return tuple(models)
+
+def getImageSpecs(pageId=None):
+    """
+    Return {image id: set of filter specs} for the images used on live pages,
+    or, if pageId is given, just those used on that page
+    """
+    imageSpecs = defaultdict(set)
+    for label, imageField, pageField, specs in RenditionSpecs:
+        model = apps.get_model(label)
+        if pageId is not None:
+            objects = model.objects.filter(**{pageField: pageId})
+        elif pageField == 'id':
+            objects = model.objects.live()
+        else:
+            objects = model.objects.filter(**{pageField+"__live": True})
+        imageIds = objects.exclude(**{imageField: None})                     \
+                          .values_list(imageField, flat=True).distinct()
+        for imageId in imageIds:
+            imageSpecs[imageId].update(specs)
+    return imageSpecs
+
+def findMissing(imageSpecs):
+    """Return a list of (image id, [filter specs]) for renditions not yet made"""
+    from wagtail.wagtailimages.models import Rendition
+    allSpecs = set().union(*imageSpecs.values()) if imageSpecs else set()
+    existing = set(Rendition.objects.filter(image_id__in=imageSpecs.keys(),
+                                            filter__spec__in=allSpecs)        \
+                                    .values_list('image_id', 'filter__spec'))
+    missing = []
+    for imageId, specs in sorted(imageSpecs.items()):
+        todo = sorted(spec for spec in specs if (imageId, spec) not in existing)
+        if todo:
+            missing.append((imageId, todo))
+    return missing
+
+def _initWorker():
+    # Each worker makes its own database connections
+    for conn in connections.all():
+        conn.connection = None
+
+def _generate(work):
+    from wagtail.wagtailimages.models import Image
+    imageId, specs = work
+    start = time.perf_counter()
+    try:
+        image = Image.objects.get(id=imageId)
+        for spec in specs:
+            image.get_rendition(spec)
+    except Exception as err:
+        return (imageId, specs, time.perf_counter() - start, str(err))
+    return (imageId, specs, time.perf_counter() - start, None)
+
+def _record(results):
+    for result in results:
+        imageId, specs, taken, error = result
+        stats.incr("renditions", "failed" if error else "made", len(specs))
+        stats.incr("renditions", "ms", int(taken * 1000))
+        stats.mark("renditions", "last")
+        yield result
+
+def generate(missing, workers=None):
+    """
+    Make the missing renditions using a pool of worker processes, or in this
+    process if workers is 1, yielding (image id, specs, seconds taken,
+    error) as each image is done
+    """
+    if not missing:
+        return
+    # the backlog is queued - made - failed, see backlog()
+    stats.incr("renditions", "queued", sum(len(specs) for imageId, specs
+                                           in missing))
+    if workers == 1:
+        yield from _record(map(_generate, missing))
+        return
+    # Don't share our database connections with the workers
+    connections.close_all()
+    pool = Pool(workers, initializer=_initWorker)
+    try:
+        yield from _record(pool.imap_unordered(_generate, missing))
+    finally:
+        pool.close()
+        pool.join()
+
+def backlog():
+    """
+    The counts of renditions queued, made and failed by generate, and how
+    many are still to do, as a dict
+    """
+    counts = stats.get_counts("renditions", ("queued", "made", "failed",
+                                             "last"))
+    counts['todo'] = max(0, counts['queued'] - counts['made'] -
+                            counts['failed'])
+    return counts
+
+def pregenerateInBackground(page):
+    """
+    Kick off making the renditions for a newly published page in a separate
+    process, so as not to hold up the publisher
+    """
+    runInBackground("pregenerate_renditions", "--page", page.id,
+                    "--workers", 1)
@@ -0,0 +1,157 @@
+# ------------------------------------------------------------------------------
+# Sitemap
+# sitemap.xml is an index of chunks, each of the pages whose ids fall in a
+# range of ChunkSize.  A chunk is streamed out from one query over the tree as
+# it is made, and kept in the cache until a page inside it changes.
+# ------------------------------------------------------------------------------
+
+import datetime as dt
+from xml.sax.saxutils import escape
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from wagtail.wagtailcore.models import Page
+from website.utils import get_page_url_map
+from website.pagecache import purgeCacheTags, tagVersions, AllTag
+from website.conditional import makeETag, isNotModified, notModified, \
+        setValidators
+
+# How many page ids each chunk covers
+ChunkSize = 1000
+
+# Purged whenever any page changes, as its lastmod might be the chunk's
+IndexTag = "sitemap:index"
+
+SitemapTimeout = 60 * 60 * 24
+
+XmlHeader = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XmlNamespace = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+def chunkTag(chunk):
+    return "sitemap:chunk:{}".format(chunk)
+
+def _lastmod(when):
+    return when.replace(microsecond=0).isoformat()
+
+def _pages(site):
+    return Page.objects.live().public()                                \
+                       .filter(path__startswith=site.root_page.path)
+
+def _cacheKey(site, name, *tags):
+    # the calendar months listed move along with today
+    today = dt.date.today()
+    versions = tagVersions(AllTag, *tags)
+    return "sitemap:{}:{}".format(name,
+                                  makeETag(site.id, site.root_url,
+                                           today.year, today.month,
+                                           *sorted(versions.items())))
+
+# ------------------------------------------------------------------------------
+# Invalidation
+# ------------------------------------------------------------------------------
+def purgeSitemap(page):
+    """
+    Throw away the chunks of page and of its descendants, as their urls
+    depend upon it
+    """
+    ids = [page.id]
+    if page.numchild:
+        ids += page.get_descendants().values_list('id', flat=True)
+    purgeCacheTags(IndexTag, *{chunkTag(id // ChunkSize) for id in ids})
+
+# ------------------------------------------------------------------------------
+# The index
+# ------------------------------------------------------------------------------
+def getChunks(site):
+    """A list of (chunk, lastmod) of the chunks that have pages of site"""
+    key = _cacheKey(site, "index", IndexTag)
+    chunks = cache.get(key)
+    if chunks is None:
+        lastmods = {}
+        for id, lastmod in _pages(site)                                   \
+                            .values_list('id', 'latest_revision_created_at') \
+                            .iterator():
+            chunk = id // ChunkSize
+            latest = lastmods.setdefault(chunk, lastmod)
+            if lastmod is not None and (latest is None or lastmod > latest):
+                lastmods[chunk] = lastmod
+        chunks = sorted(lastmods.items())
+        cache.set(key, chunks, SitemapTimeout)
+    return chunks
+
+def sitemapIndex(request):
+    site = request.site
+    if site is None:
+        raise Http404
+    chunks = getChunks(site)
+    lastmods = [lastmod for chunk, lastmod in chunks if lastmod is not None]
+    lastModified = max(lastmods) if lastmods else None
+    etag = makeETag(site.root_url, *chunks)
+    if isNotModified(request, etag, lastModified):
+        return setValidators(notModified(), etag, lastModified)
+    parts = [XmlHeader, "<sitemapindex {}>\n".format(XmlNamespace)]
+    for chunk, lastmod in chunks:
+        parts.append("<sitemap><loc>{}/sitemap-{}.xml</loc>".format(
+                     escape(site.root_url), chunk))
+        if lastmod is not None:
+            parts.append("<lastmod>{}</lastmod>".format(_lastmod(lastmod)))
+        parts.append("</sitemap>\n")
+    parts.append("</sitemapindex>\n")
+    response = HttpResponse("".join(parts), content_type="application/xml")
+    return setValidators(response, etag, lastModified)
+
+# ------------------------------------------------------------------------------
+# The chunks
+# ------------------------------------------------------------------------------
+def _streamChunk(site, chunk, key):
+    """Yield the xml of chunk, and cache it once it has all been made"""
+    urlMap = get_page_url_map(site)
+    today = dt.date.today()
+    made = [XmlHeader, "<urlset {}>\n".format(XmlNamespace)]
+    yield from made
+    pages = _pages(site).filter(id__gte=chunk * ChunkSize,
+                                id__lt=(chunk + 1) * ChunkSize)       \
+                        .order_by('path')                             \
+                        .values_list('path', 'content_type_id',
+                                     'latest_revision_created_at')
+    for path, contentTypeId, lastmod in pages.iterator():
+        url = urlMap.get(path)
+        if url is None:
+            continue
+        part = "<url><loc>{}</loc>".format(escape(site.root_url + url))
+        if lastmod is not None:
+            part += "<lastmod>{}</lastmod>".format(_lastmod(lastmod))
+        part += "</url>\n"
+        # e.g. the calendar has pages of its own that aren't in the tree
+        model = ContentType.objects.get_for_id(contentTypeId).model_class()
+        getExtras = getattr(model, 'getSitemapExtras', None)
+        if getExtras is not None:
+            for extra in getExtras(url, today):
+                part += "<url><loc>{}</loc></url>\n".format(
+                        escape(site.root_url + extra))
+        made.append(part)
+        yield part
+    made.append("</urlset>\n")
+    yield made[-1]
+    cache.set(key, "".join(made), SitemapTimeout)
+
+def sitemapChunk(request, chunk):
+    site = request.site
+    if site is None:
+        raise Http404
+    chunk = int(chunk)
+    lastmods = dict(getChunks(site))
+    if chunk not in lastmods:
+        raise Http404
+    lastModified = lastmods[chunk]
+    key = _cacheKey(site, "chunk:{}".format(chunk), chunkTag(chunk))
+    etag = key.rpartition(":")[2]
+    if isNotModified(request, etag, lastModified):
+        return setValidators(notModified(), etag, lastModified)
+    content = cache.get(key)
+    if content is not None:
+        response = HttpResponse(content, content_type="application/xml")
+    else:
+        response = StreamingHttpResponse(_streamChunk(site, chunk, key),
+                                         content_type="application/xml")
+    return setValidators(response, etag, lastModified)
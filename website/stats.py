@@ -0,0 +1,90 @@
+# ------------------------------------------------------------------------------
+# Stats
+# Cheap aggregated counters, e.g. cache hits and misses, kept in the cache so
+# that they are shared by all the worker processes
+# ------------------------------------------------------------------------------
+
+import time
+from django.core.cache import cache
+from website import instrumentation
+
+_AreasKey = "stats:areas"
+_knownAreas = set()
+
+def _key(area, name):
+    return "stats:{}:{}".format(area, name)
+
+def _register(area, created=False):
+    # a counter that has just been created means the cache might have been
+    # cleared, taking the list of areas with it
+    if created or area not in _knownAreas:
+        areas = set(cache.get(_AreasKey) or [])
+        if area not in areas:
+            areas.add(area)
+            cache.set(_AreasKey, sorted(areas), None)
+        _knownAreas.add(area)
+
+def incr(area, name, delta=1):
+    """Add delta to the counter name of area"""
+    if not delta:
+        return
+    key = _key(area, name)
+    created = cache.add(key, delta, None)
+    _register(area, created)
+    if not created:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # it expired between the add and the incr
+            cache.set(key, delta, None)
+
+def maximum(area, name, value):
+    """Raise the counter name of area to value, if it is higher"""
+    key = _key(area, name)
+    created = cache.add(key, value, None)
+    _register(area, created)
+    if not created:
+        # not atomic, but near enough for a high-water mark
+        if value > (cache.get(key) or 0):
+            cache.set(key, value, None)
+
+def mark(area, name, when=None):
+    """Record when (default now, as a unix time) something last happened"""
+    if when is None:
+        when = time.time()
+    key = _key(area, name)
+    created = cache.add(key, int(when), None)
+    _register(area, created)
+    if not created:
+        cache.set(key, int(when), None)
+
+def hit(area, delta=1):
+    incr(area, "hits", delta)
+    instrumentation.count("cache_hits", delta)
+
+def miss(area, delta=1):
+    incr(area, "misses", delta)
+    instrumentation.count("cache_misses", delta)
+
+def areas():
+    """All the areas that have had counters"""
+    return cache.get(_AreasKey) or []
+
+def get_counts(area, names):
+    """The counters of area as a dict"""
+    values = cache.get_many([_key(area, name) for name in names])
+    return {name: values.get(_key(area, name), 0) for name in names}
+
+def hit_rates():
+    """A list of (area, hits, misses, rate) for all the areas we know about"""
+    retval = []
+    for area in areas():
+        counts = get_counts(area, ("hits", "misses"))
+        total = counts["hits"] + counts["misses"]
+        if total:
+            rate = counts["hits"] / total
+            retval.append((area, counts["hits"], counts["misses"], rate))
+    return retval
+
+def reset(area, names=("hits", "misses")):
+    cache.delete_many([_key(area, name) for name in names])
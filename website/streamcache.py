@@ -0,0 +1,79 @@
+# ------------------------------------------------------------------------------
+# Stream block cache
+# Keeps the rendered HTML of each StreamField block, so that after an edit only
+# the blocks that actually changed need to be rendered again
+# ------------------------------------------------------------------------------
+
+import hashlib
+import json
+import uuid
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import force_text
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+from wagtail.wagtailimages.blocks import ImageChooserBlock
+from wagtail.wagtaildocs.blocks import DocumentChooserBlock
+from website import stats
+from website.utils import PageUrlsGenKey
+
+BlockCacheTimeout = 60 * 60 * 24
+
+# How a link to a page looks in rich text, once it has been through json.dumps
+PageLink = 'linktype=\\"page\\"'
+
+# Likewise images and links to documents
+MediaLinks = ('embedtype=\\"image\\"', 'linktype=\\"document\\"')
+
+# Changed whenever an image or document is saved or deleted
+MediaGenKey = "streamblock:media_gen"
+
+def purgeMediaBlocks():
+    """
+    Forget the blocks that show images or link to documents, as their
+    rendition and file urls may have changed
+    """
+    cache.set(MediaGenKey, uuid.uuid4().hex, None)
+
+def _blockKey(child, generation, mediaGeneration):
+    # Key on what is stored for the block, so an unchanged block keeps its
+    # entry from one revision to the next.  Rich text can have links to pages
+    # in it, so for those blocks the page urls generation is part of the key
+    # too, and the same goes for blocks with images or documents in them.
+    prep = child.block.get_prep_value(child.value)
+    data = json.dumps(prep, cls=DjangoJSONEncoder, sort_keys=True)
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    if PageLink not in data:
+        generation = ""
+    if (not isinstance(child.block, (ImageChooserBlock, DocumentChooserBlock))
+        and not any(link in data for link in MediaLinks)):
+        mediaGeneration = ""
+    return "streamblock:{}:{}:{}:{}".format(generation, mediaGeneration,
+                                            child.block_type, digest)
+
+def render_stream(value):
+    """
+    Render a StreamValue the same as StreamBlock.render_basic does, but using
+    cached HTML for the blocks where we can
+    """
+    if not value:
+        return ""
+    generations = cache.get_many([PageUrlsGenKey, MediaGenKey])
+    generation = generations.get(PageUrlsGenKey) or ""
+    mediaGeneration = generations.get(MediaGenKey) or ""
+    children = list(value)
+    keys = [_blockKey(child, generation, mediaGeneration)
+            for child in children]
+    cached = cache.get_many(keys)
+    rendered = {}
+    parts = []
+    for key, child in zip(keys, children):
+        html = cached.get(key, rendered.get(key))
+        if html is None:
+            html = rendered[key] = force_text(child)
+        parts.append((mark_safe(html), child.block_type))
+    if rendered:
+        cache.set_many(rendered, BlockCacheTimeout)
+    stats.hit("stream_blocks", len(children) - len(rendered))
+    stats.miss("stream_blocks", len(rendered))
+    return format_html_join('\n', '<div class="block-{1}">{0}</div>', parts)
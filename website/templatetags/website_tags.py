@@ -3,9 +3,22 @@ from collections import namedtuple
 from django import template
 from django.conf import settings
 from django.template.loader import render_to_string
+from wagtail.wagtailcore.models import Page
+from website.utils import specific_pages, resolve_links, page_url
+from website.utils import PageUrlsGenKey
+from django.core.cache import cache
+from website.pagecache import addCacheTags, tagVersion, MenuTag
+from website.tieredcache import get_or_set
 
 register = template.Library()
 
+SiteItem = namedtuple("SiteItem", "title url level")
+
+# Keep the menus for this long (and use them for up to StaleMenuTimeout longer
+# while someone else rebuilds them), publishing a menu page replaces them
+MenuTimeout = 60 * 60
+StaleMenuTimeout = 60
+
 
 # settings value
 @register.assignment_tag(takes_context=True)
@@ -15,6 +28,13 @@ def get_site_root(context):
     return context['request'].site.root_page
 
 
+# A drop-in replacement for wagtailcore's pageurl which reads from the site's
+# page url map.  Load website_tags after wagtailcore_tags to use it.
+@register.simple_tag(takes_context=True)
+def pageurl(context, page):
+    return page_url(page, context['request'].site)
+
+
 def has_menu_children(page):
     if page.get_children().live().in_menu():
         return True
@@ -24,10 +44,17 @@ def has_menu_children(page):
 
 @register.inclusion_tag('tags/website_menu.html', takes_context=True)
 def website_menu(context):
-    root = context['request'].site.root_page
-    menuitems = root.get_children().live().in_menu()
+    addCacheTags(context['request'], MenuTag)
+    site = context['request'].site
+    def getMenuItems():
+        return list(site.root_page.get_children().live().in_menu())
+    key = "website_menu:{}:{}".format(site.id, tagVersion(MenuTag))
+    menuitems = get_or_set(cache, key, getMenuItems,
+                           MenuTimeout, stale=StaleMenuTimeout)
     return {
         'menuitems': menuitems,
+        # required by the pageurl tag that we want to use within this template
+        'request': context['request'],
     }
 
 # Retrieves the secondary links for the 'also in this section' links
@@ -54,7 +81,7 @@ def secondary_menu(context, calling_page=None):
     takes_context=True
 )
 def standard_index_listing(context, calling_page):
-    pages = calling_page.get_children().live()
+    pages = specific_pages(calling_page.get_children().live())
     return {
         'pages': pages,
         # required by the pageurl tag that we want to use within this template
@@ -62,6 +89,14 @@ def standard_index_listing(context, calling_page):
     }
 
 
+# Looks up the urls of a list of related links all at once
+@register.filter
+def resolved_links(links):
+    if not links:
+        return []
+    return resolve_links(links)
+
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -70,26 +105,39 @@ def standard_index_listing(context, calling_page):
 @register.inclusion_tag('tags/site_map.html',
                         takes_context=True)
 def site_map(context):
-    SiteItem = namedtuple("SiteItem", "title url level")
+    addCacheTags(context['request'], MenuTag)
     site = context['request'].site
+    key = "site_map:{}:{}:{}".format(site.id, tagVersion(MenuTag),
+                                     cache.get(PageUrlsGenKey))
+    columns = get_or_set(cache, key, lambda: _getSiteMapColumns(site),
+                         MenuTimeout, stale=StaleMenuTimeout)
+    return {'columns': columns}
+
+def _getSiteMapColumns(site):
     root = site.root_page
+    # the children of all the parents in one query
+    childrenOf = {}
+    for child in Page.objects.descendant_of(root).live().in_menu()            \
+                             .filter(depth=root.depth + 2):
+        childrenOf.setdefault(child.path[:-Page.steplen], []).append(child)
     columns = []
     items = []
     height = 0
     for parent in root.get_children().live().in_menu():
-        children = parent.get_children().live().in_menu()
+        children = childrenOf.get(parent.path, [])
         if height > 25 and height + 25 + len(children) * 14 > 110:
             columns.append(items)
             items = []
             height = 0
-        items.append(SiteItem(parent.title, parent.relative_url(site), 1))
+        parentUrl = page_url(parent, site)
+        items.append(SiteItem(parent.title, parentUrl, 1))
         height += 25
         if children:
             for child in children:
                 if height == 0:
                     height = 25
-                    items = [SiteItem("...", parent.relative_url(site), 1)]
-                items.append(SiteItem(child.title, child.relative_url(site), 2))
+                    items = [SiteItem("...", parentUrl, 1)]
+                items.append(SiteItem(child.title, page_url(child, site), 2))
                 height += 14
                 if height > 110:
                     columns.append(items)
@@ -97,5 +145,5 @@ def site_map(context):
                     height = 0
     if items:
         columns.append(items)
-    return {'columns': columns}
+    return columns
 
@@ -0,0 +1,39 @@
+from django.test import override_settings
+from django.contrib.auth.models import User, Permission
+from events.models import CalendarPage
+from website import stats
+from website.tests.utils import SiteTestCase
+
+class TestPerformancePanel(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.home.add_child(instance=CalendarPage(title="Calendar",
+                                                  slug="calendar"))
+        User.objects.create_superuser("admin", "admin@example.com", "pass")
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=1)
+    def test_panel(self):
+        self.client.get("/calendar/")
+        self.client.get("/calendar/")
+        stats.incr("renditions", "queued", 3)
+        stats.incr("renditions", "made")
+        self.client.login(username="admin", password="pass")
+        response = self.client.get("/admin/")
+        self.assertContains(response, "<h2>Performance</h2>")
+        self.assertContains(response, "<td>CalendarPage</td>")
+        # the first request missed the events cache, the second hit it
+        self.assertContains(response, "<td>calendar_events</td>")
+        self.assertContains(response, "50%")
+        self.assertContains(response, "2 still to make")
+        self.assertNotContains(response, "<td>Calendar events by day</td>\n"
+                                         "          <td>0</td>")
+
+    def test_not_for_editors(self):
+        editor = User.objects.create_user("editor", "editor@example.com",
+                                          "pass")
+        editor.user_permissions.add(
+                Permission.objects.get(codename="access_admin"))
+        self.client.login(username="editor", password="pass")
+        response = self.client.get("/admin/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "<h2>Performance</h2>")
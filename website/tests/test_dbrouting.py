@@ -0,0 +1,136 @@
+import datetime as dt
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.test import TestCase, RequestFactory
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.http import HttpResponse
+from django.utils import timezone
+from wagtail.wagtailcore.models import Page
+from website import dbrouting
+from website.dbrouting import ReplicaRouter, ReplicaMiddleware, checkReplica
+from website.models import ReplicaHeartbeat
+
+class TestReplicaRouting(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+        for name, value in [('getReplicaAlias', "replica"),
+                            ('isReplicaHealthy', True)]:
+            patcher = mock.patch.object(dbrouting, name, return_value=value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.middleware = ReplicaMiddleware()
+
+    def routeFor(self, request):
+        self.middleware.process_request(request)
+        try:
+            return self.router.db_for_read(Page)
+        finally:
+            self.response = self.middleware.process_response(request,
+                                                              HttpResponse())
+
+    def test_anonymous_get(self):
+        self.assertEqual(self.routeFor(self.factory.get("/")), "replica")
+        self.assertIsNone(self.router.db_for_read(Page))
+        self.assertEqual(self.router.db_for_write(Page), DEFAULT_DB_ALIAS)
+
+    def test_logged_in(self):
+        request = self.factory.get("/")
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = "abc"
+        self.assertIsNone(self.routeFor(request))
+
+    def test_pinned_after_write(self):
+        self.assertIsNone(self.routeFor(self.factory.post("/form/")))
+        self.assertIn(dbrouting.PinCookie, self.response.cookies)
+        request = self.factory.get("/form/thanks/")
+        request.COOKIES[dbrouting.PinCookie] = "1"
+        self.assertIsNone(self.routeFor(request))
+
+    def test_unhealthy(self):
+        self.isReplicaHealthy.return_value = False
+        self.assertIsNone(self.routeFor(self.factory.get("/")))
+
+    def test_down(self):
+        with mock.patch("django.db.models.query.QuerySet.first",
+                        side_effect=OperationalError("unable to open")):
+            with self.assertLogs("website.dbrouting", "WARNING"):
+                self.assertFalse(checkReplica(DEFAULT_DB_ALIAS))
+
+class TestReplicaStale(TestCase):
+    """The heartbeat is written as usual, but the replica stops taking it"""
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.stopped = self.now
+        for name, value in [('_replicaBeat', lambda alias: self.stopped),
+                            ('timezone.now', lambda: self.now)]:
+            patcher = mock.patch("website.dbrouting." + name,
+                                 side_effect=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tick(self, seconds):
+        self.now += dt.timedelta(seconds=seconds)
+        cache.delete(dbrouting.BeatLockKey)
+        return checkReplica("replica")
+
+    def test_stale(self):
+        self.assertTrue(self.tick(0))
+        self.stopped = ReplicaHeartbeat.objects.get().beat
+        for num in range(3):
+            self.assertTrue(self.tick(dbrouting.BeatInterval))
+        # more than REPLICA_MAX_LAG since the first beat it missed
+        with self.assertLogs("website.dbrouting", "WARNING"):
+            self.assertFalse(self.tick(dbrouting.BeatInterval))
+        with self.assertLogs("website.dbrouting", "WARNING"):
+            self.assertFalse(self.tick(60))
+        # it catches up
+        self.stopped = ReplicaHeartbeat.objects.get().beat
+        self.assertTrue(self.tick(dbrouting.BeatInterval))
+
+@skipUnless("replica" in settings.DATABASES,
+            "Needs a second database called replica")
+class TestReplicaLag(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # nothing is migrated on the replica
+        with connections["replica"].schema_editor() as editor:
+            editor.create_model(ReplicaHeartbeat)
+
+    @classmethod
+    def tearDownClass(cls):
+        with connections["replica"].schema_editor() as editor:
+            editor.delete_model(ReplicaHeartbeat)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_no_heartbeat(self):
+        self.assertFalse(checkReplica("replica"))
+        # but now the primary has one
+        self.assertEqual(ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS)
+                                         .count(), 1)
+
+    def test_caught_up(self):
+        checkReplica("replica")
+        beat = ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS).get().beat
+        ReplicaHeartbeat.objects.using("replica").create(id=1, beat=beat)
+        self.assertTrue(checkReplica("replica"))
+
+    def test_lagging(self):
+        now = timezone.now()
+        ReplicaHeartbeat.objects.using("replica")                            \
+                        .create(id=1, beat=now - dt.timedelta(seconds=60))
+        cache.set(dbrouting.BeatKey, [now - dt.timedelta(seconds=30),
+                                      now - dt.timedelta(seconds=1)])
+        cache.set(dbrouting.BeatLockKey, True)
+        with self.assertLogs("website.dbrouting", "WARNING"):
+            self.assertFalse(checkReplica("replica"))
+        ReplicaHeartbeat.objects.using("replica")                            \
+                        .update(beat=now - dt.timedelta(seconds=2))
+        self.assertTrue(checkReplica("replica"))
@@ -0,0 +1,40 @@
+import json
+from django.test import override_settings
+from events.models import CalendarPage
+from website import instrumentation
+from website.tests.utils import SiteTestCase
+
+class TestInstrumentation(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.home.add_child(instance=CalendarPage(title="Calendar",
+                                                  slug="calendar"))
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=1)
+    def test_server_timing(self):
+        with self.assertLogs("website.performance", "INFO") as logs:
+            response = self.client.get("/calendar/")
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        for name in ("sql;", "tpl;", "events;", "total;", "cache;"):
+            self.assertIn(name, timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], "CalendarPage")
+        self.assertGreater(record['queries'], 0)
+        # the page cache and the calendar's events
+        self.assertEqual(record['cache_misses'], 2)
+        routes = {stats['route']: stats
+                  for stats in instrumentation.routeStats()}
+        self.assertEqual(routes["CalendarPage"]['requests'], 1)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_off(self):
+        response = self.client.get("/calendar/")
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(instrumentation.routeStats(), [])
+
+    def test_timed_outside_request(self):
+        @instrumentation.timed("thing")
+        def thing(x):
+            return x * 2
+        self.assertEqual(thing(21), 42)
@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_delete
+from django.test import override_settings
+from wagtail.wagtailcore.models import Page, unpublish_page_before_delete
+from website.models import PlainPage
+from website.pagecache import tagVersions, pageTag, MenuTag
+from website.tests.utils import SiteTestCase
+
+class SetCookieMiddleware(object):
+    """Sets a cookie on the way out, as the session middleware might"""
+    def process_response(self, request, response):
+        response.set_cookie("seen", "1")
+        return response
+
+def _withCookieMiddleware():
+    classes = list(settings.MIDDLEWARE_CLASSES)
+    at = classes.index('django.contrib.sessions.middleware.SessionMiddleware')
+    classes.insert(at + 1, __name__ + '.SetCookieMiddleware')
+    return classes
+
+class TestPageCache(SiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.about = self.home.add_child(instance=PlainPage(title="About",
+                                                            slug="about",
+                                                            show_in_menus=True))
+        self.other = self.home.add_child(instance=PlainPage(title="Other",
+                                                            slug="other"))
+        section = self.other.add_child(instance=PlainPage(title="Section",
+                                                          slug="section"))
+        self.item = section.add_child(instance=PlainPage(title="Item",
+                                                         slug="item"))
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit(self):
+        self.assertEqual(self.get("/about/")['X-Page-Cache'], "miss")
+        self.assertEqual(self.get("/about/")['X-Page-Cache'], "hit")
+
+    def test_query_string(self):
+        self.assertEqual(self.get("/about/?page=2&format=x")['X-Page-Cache'],
+                         "miss")
+        self.assertEqual(self.get("/about/?format=x&page=2")['X-Page-Cache'],
+                         "hit")
+        self.assertEqual(self.get("/about/?page=3")['X-Page-Cache'], "miss")
+        self.assertEqual(self.get("/about/?utm_source=news")['X-Page-Cache'],
+                         "miss")
+        self.assertEqual(self.get("/about/")['X-Page-Cache'], "hit")
+        # anything else isn't cached at all
+        for num in range(2):
+            response = self.get("/about/?junk={}".format(num))
+            self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_purge_on_publish(self):
+        self.get("/about/")
+        self.get("/other/section/")
+        self.get("/other/section/item/")
+        self.item.title = "Item Two"
+        self.item.save_revision().publish()
+        self.assertEqual(self.get("/about/")['X-Page-Cache'], "hit")
+        self.assertEqual(self.get("/other/section/")['X-Page-Cache'], "miss")
+        response = self.get("/other/section/item/")
+        self.assertEqual(response['X-Page-Cache'], "miss")
+        self.assertContains(response, "Item Two")
+
+    def test_purge_menu(self):
+        self.get("/other/")
+        page = self.home.add_child(instance=PlainPage(title="Latest",
+                                                      slug="latest",
+                                                      show_in_menus=True,
+                                                      live=False))
+        page.save_revision().publish()
+        response = self.get("/other/")
+        self.assertEqual(response['X-Page-Cache'], "miss")
+        self.assertContains(response, "Latest")
+
+    def test_not_for_users(self):
+        User.objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.login(username="admin", password="pass")
+        self.assertFalse(self.get("/about/").has_header('X-Page-Cache'))
+        self.assertFalse(self.get("/about/").has_header('X-Page-Cache'))
+
+    def test_not_with_cookies(self):
+        with override_settings(MIDDLEWARE_CLASSES=_withCookieMiddleware()):
+            for num in range(2):
+                response = self.get("/about/")
+                self.assertIn("seen", response.cookies)
+                self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_purge_on_move(self):
+        self.get("/other/section/")
+        self.get("/about/")
+        self.get("/other/section/item/")
+        before = tagVersions(MenuTag, pageTag(self.item))
+        Page.objects.get(id=self.item.id).move(self.about, 'last-child')
+        self.assertEqual(self.get("/other/section/")['X-Page-Cache'], "miss")
+        self.assertEqual(self.get("/about/")['X-Page-Cache'], "miss")
+        self.assertEqual(self.get("/about/item/")['X-Page-Cache'], "miss")
+        self.assertTrue(all(old != new for old, new in
+                            zip(before.values(),
+                                tagVersions(*before).values())))
+
+    def test_purge_on_move_subtree(self):
+        self.get("/other/section/item/")
+        section = Page.objects.get(url_path="/home2/other/section/")
+        section.move(self.about, 'last-child')
+        response = self.get("/about/section/item/")
+        self.assertEqual(response['X-Page-Cache'], "miss")
+
+    def test_purge_on_delete(self):
+        # purged by the deletion itself, not just by the unpublish before it
+        pre_delete.disconnect(unpublish_page_before_delete, sender=Page)
+        self.addCleanup(pre_delete.connect, unpublish_page_before_delete,
+                        sender=Page)
+        self.get("/other/section/")
+        self.item.delete()
+        self.assertEqual(self.get("/other/section/")['X-Page-Cache'], "miss")
@@ -0,0 +1,232 @@
+import io
+import os
+import re
+import json
+import shutil
+import tempfile
+import datetime as dt
+from collections import Counter
+from PIL import Image as PILImage
+from django.core.cache import cache
+from django.core.files.images import ImageFile
+from django.db import connection
+from django.template import Template, Context
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from wagtail.wagtailcore.models import Site
+from wagtail.wagtailimages.models import Image
+from home.models import HomePageHighlight
+from website.models import PlainPage, StreamPage
+from website.renditions import getImageSpecs, findMissing, generate
+from website.tests.utils import SiteTestCase
+from events.models import EventIndexPage, CalendarPage, SimpleEventPage, \
+        MultidayEventPage, RecurringEventPage, RecurringEventExceptionPage
+from events.recurrence import Recurrence
+from dateutil.rrule import WEEKLY
+
+# ------------------------------------------------------------------------------
+# The most queries each page or tag may make, with empty caches.  If a change
+# really does need more then raise the budget, but look at the queries it
+# added first (they are listed against the baseline).
+# ------------------------------------------------------------------------------
+Budgets = {
+    'home':            20,
+    'calendar_month':  17,
+    'event_index':     11,
+    'simple_event':    16,
+    'multiday_event':  13,
+    'recurring_event': 13,
+    'exception_event': 15,
+    'search':          19,
+    'website_menu':     4,
+    'site_map':         5,
+}
+
+# The shapes of the queries each page or tag made when its budget was set.
+# Run the tests with RECORD_QUERY_BASELINES=1 to record them again.
+BaselinesPath = os.path.join(os.path.dirname(__file__), "query_baselines.json")
+
+def _normalize(sql):
+    """The shape of a query, without the values"""
+    # sqlite's last_executed_query
+    match = re.match(r"QUERY = '(.*)' - PARAMS = ", sql, re.DOTALL)
+    if match:
+        sql = match.group(1)
+    sql = re.sub(r"\bSELECT .*? FROM\b", "SELECT ... FROM", sql)
+    sql = re.sub(r'SAVEPOINT "\w+"', 'SAVEPOINT ?', sql)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+\b", "?", sql)
+    sql = re.sub(r"\((?:\?|%s)(?:, (?:\?|%s))*\)", "(...)", sql)
+    return sql
+
+def _loadBaselines():
+    try:
+        with open(BaselinesPath) as baselinesFile:
+            return json.load(baselinesFile)
+    except FileNotFoundError:
+        return {}
+
+def _recordBaseline(name, shapes):
+    baselines = _loadBaselines()
+    baselines[name] = shapes
+    with open(BaselinesPath, 'w') as baselinesFile:
+        json.dump(baselines, baselinesFile, indent=1, sort_keys=True)
+        baselinesFile.write("\n")
+
+def _makeImage(name):
+    f = io.BytesIO()
+    PILImage.new('RGB', (1600, 800), 'blue').save(f, 'PNG')
+    return Image.objects.create(title=name, file=ImageFile(f, name=name+".png"))
+
+class QueryBudgetTestCase(SiteTestCase):
+    """
+    Builds a small but representative site, and checks how many queries it
+    takes to show it
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.mediaRoot = tempfile.mkdtemp()
+        cls.mediaSettings = override_settings(MEDIA_ROOT=cls.mediaRoot,
+                                              PAGE_CACHE_ENABLED=False)
+        cls.mediaSettings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.mediaSettings.disable()
+        shutil.rmtree(cls.mediaRoot, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        today = dt.date.today()
+        image = _makeImage("picture")
+        self.home.banner_image = image
+        self.home.highlights.add(HomePageHighlight(title="Highlight",
+                                                   image=image))
+        self.home.save()
+        for num in range(3):
+            about = self.home.add_child(instance=PlainPage(
+                                            title="About {}".format(num),
+                                            slug="about-{}".format(num),
+                                            show_in_menus=True))
+            about.add_child(instance=StreamPage(title="Welcome", slug="welcome",
+                                                show_in_menus=True))
+        self.events = self.home.add_child(instance=EventIndexPage(
+                                                    title="Events",
+                                                    slug="events",
+                                                    show_in_menus=True))
+        self.events.add_child(instance=CalendarPage(title="Calendar",
+                                                    slug="calendar",
+                                                    show_in_menus=True))
+        for num in range(5):
+            self.events.add_child(instance=SimpleEventPage(
+                                        title="Meeting {}".format(num),
+                                        slug="meeting-{}".format(num),
+                                        date=today + dt.timedelta(days=num),
+                                        image=image,
+                                        location="Hall"))
+        self.events.add_child(instance=MultidayEventPage(
+                                        title="Camp", slug="camp",
+                                        date_from=today,
+                                        date_to=today + dt.timedelta(days=3)))
+        weekly = self.events.add_child(instance=RecurringEventPage(
+                                        title="Weekly", slug="weekly",
+                                        repeat=Recurrence(
+                                            dtstart=dt.datetime(2015, 1, 1),
+                                            freq=WEEKLY,
+                                            byweekday=[0, 3])))
+        weekly.add_child(instance=RecurringEventExceptionPage(
+                                        title="Weekly special",
+                                        slug="weekly-special",
+                                        overrides=weekly,
+                                        date=dt.date(2015, 1, 5)))
+        # as they are on publish in production
+        list(generate(findMissing(getImageSpecs()), workers=1))
+        cache.clear()
+
+    def assertQueryBudget(self, name, func):
+        """
+        Call func and fail if it makes more queries than Budgets[name],
+        listing those it made that the baseline didn't
+        """
+        budget = Budgets[name]
+        with CaptureQueriesContext(connection) as context:
+            retval = func()
+        queries = [query['sql'] for query in context.captured_queries]
+        shapes = [_normalize(sql) for sql in queries]
+        if os.environ.get('RECORD_QUERY_BASELINES'):
+            _recordBaseline(name, shapes)
+        if len(queries) > budget:
+            baseline = _loadBaselines().get(name, [])
+            lines = ["{} made {} queries, its budget is {}".format(name,
+                                                                 len(queries),
+                                                                 budget)]
+            added = Counter(shapes) - Counter(baseline)
+            gone  = Counter(baseline) - Counter(shapes)
+            lines.append("Added since the baseline ({} queries):"
+                         .format(len(baseline)))
+            for shape, count in added.most_common():
+                lines.append("  + {:3}x {}".format(count, shape))
+            lines.append("Gone since the baseline:")
+            for shape, count in gone.most_common():
+                lines.append("  - {:3}x {}".format(count, shape))
+            lines.append("In order:")
+            for num, sql in enumerate(queries, 1):
+                lines.append("  {:3}. {}".format(num, sql))
+            self.fail("\n".join(lines))
+        return retval
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+# ------------------------------------------------------------------------------
+class TestPageBudgets(QueryBudgetTestCase):
+    def test_home(self):
+        self.assertQueryBudget('home', lambda: self.get("/"))
+
+    def test_calendar_month(self):
+        self.assertQueryBudget('calendar_month',
+                               lambda: self.get("/events/calendar/"))
+
+    def test_event_index(self):
+        self.assertQueryBudget('event_index', lambda: self.get("/events/"))
+
+    def test_simple_event(self):
+        self.assertQueryBudget('simple_event',
+                               lambda: self.get("/events/meeting-0/"))
+
+    def test_multiday_event(self):
+        self.assertQueryBudget('multiday_event',
+                               lambda: self.get("/events/camp/"))
+
+    def test_recurring_event(self):
+        self.assertQueryBudget('recurring_event',
+                               lambda: self.get("/events/weekly/"))
+
+    def test_exception_event(self):
+        self.assertQueryBudget('exception_event',
+                               lambda: self.get("/events/weekly/weekly-special/"))
+
+    def test_search(self):
+        self.assertQueryBudget('search',
+                               lambda: self.get("/search/", query="meeting"))
+
+class TestTagBudgets(QueryBudgetTestCase):
+    def render(self, name, source):
+        # the site is looked up by the middleware for a real request
+        request = RequestFactory().get("/")
+        request.site = Site.objects.get(is_default_site=True)
+        template = Template("{% load website_tags %}" + source)
+        context = Context({'request': request})
+        return self.assertQueryBudget(name, lambda: template.render(context))
+
+    def test_website_menu(self):
+        html = self.render('website_menu', "{% website_menu %}")
+        self.assertIn("About 0", html)
+
+    def test_site_map(self):
+        html = self.render('site_map', "{% site_map %}")
+        self.assertIn("Welcome", html)
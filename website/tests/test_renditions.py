@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import datetime as dt
+from io import StringIO
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailimages.models import Image, Rendition
+from wagtail.wagtailimages.tests.utils import get_test_image_file
+from events.models import SimpleEventPage
+from website import background
+from website.renditions import getImageSpecs, findMissing, generate, backlog
+
+class RenditionsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpDir)
+        tmpSettings = override_settings(
+                        MEDIA_ROOT=os.path.join(self.tmpDir, "media"),
+                        BACKGROUND_JOBS_DIR=os.path.join(self.tmpDir, "jobs"))
+        tmpSettings.enable()
+        self.addCleanup(tmpSettings.disable)
+        self.home = Page.objects.get(depth=2)
+        self.image = Image.objects.create(title="Hall",
+                                          file=get_test_image_file())
+        self.event = self.home.add_child(instance=SimpleEventPage(
+                                            title="Meeting", slug="meeting",
+                                            date=dt.date(2016, 2, 3),
+                                            image=self.image))
+
+    def made(self):
+        return set(Rendition.objects.filter(image=self.image)
+                                    .values_list('filter__spec', flat=True))
+
+class TestRenditions(RenditionsTestCase):
+    def test_find_missing(self):
+        imageSpecs = getImageSpecs(self.event.id)
+        self.assertEqual(imageSpecs, {self.image.id: {'width-180',
+                                                      'width-100'}})
+        self.assertEqual(findMissing(imageSpecs),
+                         [(self.image.id, ['width-100', 'width-180'])])
+        self.image.get_rendition('width-100')
+        self.assertEqual(findMissing(imageSpecs),
+                         [(self.image.id, ['width-180'])])
+        self.image.get_rendition('width-180')
+        self.assertEqual(findMissing(imageSpecs), [])
+
+    def test_generate(self):
+        missing = findMissing(getImageSpecs())
+        results = list(generate(missing, workers=1))
+        self.assertEqual(len(results), 1)
+        imageId, specs, taken, error = results[0]
+        self.assertEqual((imageId, specs, error),
+                         (self.image.id, ['width-100', 'width-180'], None))
+        self.assertEqual(self.made(), {'width-100', 'width-180'})
+        counts = backlog()
+        self.assertEqual((counts['queued'], counts['made'], counts['todo']),
+                         (2, 2, 0))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('pregenerate_renditions', '--page', str(self.event.id),
+                     '--dry-run', stdout=out)
+        self.assertIn("2 missing renditions of 1 images", out.getvalue())
+        self.assertEqual(self.made(), set())
+        call_command('pregenerate_renditions', '--page', str(self.event.id),
+                     '--workers', '1', stdout=StringIO())
+        self.assertEqual(self.made(), {'width-100', 'width-180'})
+
+class TestPregenerateOnPublish(RenditionsTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('website.background.subprocess.Popen')
+        self.popen = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(PREGENERATE_RENDITIONS_ON_PUBLISH=True,
+                       BACKGROUND_PYTHON="/usr/bin/python3")
+    def test_once_until_started(self):
+        self.event.save_revision().publish()
+        self.event.save_revision().publish()
+        self.assertEqual(self.popen.call_count, 1)
+        argv = self.popen.call_args[0][0]
+        self.assertEqual(argv[0], "/usr/bin/python3")
+        self.assertEqual(argv[2:], ["run_job", "pregenerate_renditions",
+                                    "--page", str(self.event.id),
+                                    "--workers", "1"])
+        # the job starts, so another publish needs another run
+        call_command(*argv[2:], stdout=StringIO())
+        self.assertEqual(self.made(), {'width-100', 'width-180'})
+        self.event.save_revision().publish()
+        self.assertEqual(self.popen.call_count, 2)
+
+    def test_off(self):
+        self.event.save_revision().publish()
+        self.assertEqual(self.popen.call_count, 0)
+
+    def test_python(self):
+        with mock.patch('website.background.sys.executable',
+                        "/usr/bin/uwsgi"):
+            self.assertTrue(background.getPython().endswith("/python3"))
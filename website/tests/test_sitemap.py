@@ -0,0 +1,74 @@
+import datetime as dt
+from unittest import mock
+from wagtail.wagtailcore.models import Site
+from events.models import CalendarPage
+from website.models import PlainPage
+from website import sitemap
+from website.tests.utils import SiteTestCase
+
+class TestSitemap(SiteTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(sitemap, 'ChunkSize', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+        self.pages = [self.home.add_child(instance=PlainPage(title=slug,
+                                                             slug=slug))
+                      for slug in ("one", "two", "three", "four", "five")]
+        self.calendar = self.home.add_child(instance=CalendarPage(
+                                            title="Calendar", slug="calendar"))
+        self.pages[4].unpublish()
+        self.chunks = [chunk for chunk, lastmod in
+                       sitemap.getChunks(Site.objects.get())]
+
+    def getChunk(self, page):
+        response = self.client.get("/sitemap-{}.xml".format(page.id // 2))
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return "streamed", b"".join(response.streaming_content).decode()
+        return "cached", response.content.decode()
+
+    def test_index(self):
+        response = self.client.get("/sitemap.xml")
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        for chunk in self.chunks:
+            self.assertIn("<loc>http://localhost/sitemap-{}.xml</loc>"
+                          .format(chunk), content)
+        response = self.client.get("/sitemap.xml",
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_chunks(self):
+        content = "".join(self.getChunk(page)[1]
+                          for page in [self.home] + self.pages[:4])
+        for slug in ("one", "two", "three", "four"):
+            self.assertIn("<loc>http://localhost/{}/</loc>".format(slug),
+                          content)
+        self.assertNotIn("/five/", content)
+        self.assertEqual(self.client.get("/sitemap-9999.xml").status_code,
+                         404)
+
+    def test_calendar_months(self):
+        how, content = self.getChunk(self.calendar)
+        today = dt.date.today()
+        self.assertIn("/calendar/{}/{}/".format(today.year, today.month),
+                      content)
+        self.assertIn("/calendar/{}/{}/".format(today.year + 1, today.month),
+                      content)
+        self.assertNotIn("/calendar/{}/".format(today.year + 2), content)
+        # the calendar itself and 25 months
+        self.assertEqual(content.count("/calendar/"), 1 + 2 * 12 + 1)
+
+    def test_cached_until_changed(self):
+        one, three = self.pages[0], self.pages[2]
+        self.assertNotEqual(one.id // 2, three.id // 2)
+        self.assertEqual(self.getChunk(one)[0], "streamed")
+        self.assertEqual(self.getChunk(three)[0], "streamed")
+        self.assertEqual(self.getChunk(one)[0], "cached")
+        three.title = "Three"
+        three.save_revision().publish()
+        self.assertEqual(self.getChunk(one)[0], "cached")
+        how, content = self.getChunk(three)
+        self.assertEqual(how, "streamed")
+        self.assertIn("/three/", content)
@@ -0,0 +1,121 @@
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailimages.models import Image
+from wagtail.wagtailimages.tests.utils import get_test_image_file
+from wagtail.wagtaildocs.models import Document
+from website.models import StreamPage, PlainPage
+from website import stats
+
+def makeStream(*blocks):
+    streamBlock = StreamPage._meta.get_field('content').stream_block
+    return streamBlock.to_python([{'type': blockType, 'value': value}
+                                  for blockType, value in blocks])
+
+class TestStreamCache(TestCase):
+    def setUp(self):
+        self.home = Page.objects.get(depth=2)
+        self.page = StreamPage(title="Stream", slug="stream")
+        self.page.content = makeStream(('heading',   "Block cache test"),
+                                       ('paragraph', "<p>First paragraph</p>"),
+                                       ('paragraph', "<p>Second paragraph</p>"))
+        self.home.add_child(instance=self.page)
+        cache.clear()
+
+    def counts(self):
+        return stats.get_counts("stream_blocks", ("hits", "misses"))
+
+    def test_same_html(self):
+        stream = self.page.content
+        self.assertEqual(self.page.rendered_content, str(stream))
+        self.assertEqual(self.page.rendered_content, str(stream))
+        self.assertEqual(self.counts(), {"hits": 3, "misses": 3})
+
+    def test_edit_one_block(self):
+        self.page.rendered_content
+        page = StreamPage.objects.get(id=self.page.id)
+        page.content = makeStream(('heading',   "Block cache test"),
+                                  ('paragraph', "<p>First paragraph, edited</p>"),
+                                  ('paragraph', "<p>Second paragraph</p>"))
+        self.assertIn("edited", page.rendered_content)
+        self.assertEqual(self.counts(), {"hits": 2, "misses": 4})
+
+    def test_publish_other_page(self):
+        other = self.home.add_child(instance=PlainPage(title="Other",
+                                                       slug="other"))
+        self.page.rendered_content
+        other.slug = "another"
+        other.save_revision().publish()
+        page = StreamPage.objects.get(id=self.page.id)
+        page.rendered_content
+        self.assertEqual(self.counts(), {"hits": 3, "misses": 3})
+
+    def test_page_link(self):
+        other = self.home.add_child(instance=PlainPage(title="Other",
+                                                       slug="other"))
+        link = '<p><a linktype="page" id="{}">Other</a></p>'.format(other.id)
+        self.page.content = makeStream(('heading',   "Block cache test"),
+                                       ('paragraph', link))
+        self.assertIn('href="/other/"', self.page.rendered_content)
+        other.slug = "another"
+        other.save_revision().publish()
+        page = StreamPage.objects.get(id=self.page.id)
+        page.content = self.page.content
+        self.assertIn('href="/another/"', page.rendered_content)
+        # only the paragraph with the link had to be made again
+        self.assertEqual(self.counts(), {"hits": 1, "misses": 3})
+
+class TestStreamCacheMedia(TestCase):
+    def setUp(self):
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        tmpSettings = override_settings(MEDIA_ROOT=tmpDir)
+        tmpSettings.enable()
+        self.addCleanup(tmpSettings.disable)
+        self.home = Page.objects.get(depth=2)
+        cache.clear()
+
+    def counts(self):
+        return stats.get_counts("stream_blocks", ("hits", "misses"))
+
+    def render(self, *blocks):
+        page = StreamPage(title="Stream", slug="stream")
+        page.content = makeStream(('heading', "Media test"), *blocks)
+        return page.rendered_content
+
+    def test_image_replaced(self):
+        image = Image.objects.create(title="Hall",
+                                     file=get_test_image_file("hall.png"))
+        self.assertIn("hall", self.render(('image', image.id)))
+        image.renditions.all().delete()
+        image.file = get_test_image_file("stage.png")
+        image.save()
+        html = self.render(('image', image.id))
+        self.assertIn("stage", html)
+        self.assertNotIn("hall", html)
+        # the heading didn't have to be made again
+        self.assertEqual(self.counts(), {"hits": 1, "misses": 3})
+
+    def test_embedded_image(self):
+        image = Image.objects.create(title="Hall",
+                                     file=get_test_image_file("hall.png"))
+        embed = '<p><embed embedtype="image" id="{}" format="left" ' \
+                'alt="Hall"/></p>'.format(image.id)
+        self.render(('paragraph', embed))
+        image.save()
+        self.render(('paragraph', embed))
+        self.assertEqual(self.counts(), {"hits": 1, "misses": 3})
+
+    def test_document_link(self):
+        document = Document.objects.create(title="Minutes",
+                                           file=ContentFile(b"x", "jan.txt"))
+        link = '<p><a linktype="document" id="{}">Minutes</a></p>' \
+                    .format(document.id)
+        self.assertIn("jan.txt", self.render(('paragraph', link)))
+        document.file = ContentFile(b"x", "feb.txt")
+        document.save()
+        self.assertIn("feb.txt", self.render(('paragraph', link)))
+        self.assertEqual(self.counts(), {"hits": 1, "misses": 3})
@@ -0,0 +1,108 @@
+import time
+import threading
+from django.test import TestCase
+from django.core.cache import cache
+from website.tieredcache import TieredCache, get_or_set, peek
+
+class TestTieredCache(TestCase):
+    def setUp(self):
+        self.cache = TieredCache("test", {'OPTIONS': {'L2':         'shared',
+                                                      'L1_TIMEOUT': 5}})
+        self.cache.clear()
+
+    def test_set_get(self):
+        self.cache.set("k", "v")
+        self.assertEqual(self.cache.get("k"), "v")
+        self.assertEqual(self.cache.l2.get("k"), "v")
+        self.cache.delete("k")
+        self.assertIsNone(self.cache.get("k"))
+
+    def test_l1(self):
+        self.cache.set("k", "v")
+        # another process changes it
+        self.cache.l2.set("k", "w")
+        self.assertEqual(self.cache.get("k"), "v")
+        self.cache._l1.clear()
+        self.assertEqual(self.cache.get("k"), "w")
+
+    def test_incr(self):
+        self.cache.set("n", 1)
+        self.assertEqual(self.cache.get("n"), 1)
+        self.cache.incr("n")
+        self.assertEqual(self.cache.get("n"), 2)
+
+    def test_get_many(self):
+        self.cache.set_many({"a": 1, "b": 2})
+        self.cache._l1.delete("b")
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+
+    def test_single_flight(self):
+        calls = []
+        def make():
+            calls.append(1)
+            time.sleep(0.2)
+            return "made"
+        results = []
+        def worker():
+            results.append(self.cache.get_or_set("sf", make, 60))
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["made"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_single_flight_between_processes(self):
+        # each has its own L1 and in-process locks, so only the lock in the
+        # shared cache keeps them apart
+        caches = [self.cache] + [TieredCache("other{}".format(num),
+                                             {'OPTIONS': {'L2': 'shared'}})
+                                 for num in range(4)]
+        calls = []
+        def make():
+            calls.append(1)
+            time.sleep(0.2)
+            return "made"
+        results = []
+        def worker(cache):
+            results.append(cache.get_or_set("sfp", make, 60))
+        threads = [threading.Thread(target=worker, args=(cache,))
+                   for cache in caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["made"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_single_flight_through_default_cache(self):
+        # as the callers use it, through django.core.cache.cache
+        calls = []
+        def make():
+            calls.append(1)
+            time.sleep(0.2)
+            return "made"
+        results = []
+        def worker():
+            results.append(get_or_set(cache, "sfd", make, 60))
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["made"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(peek(cache, "sfd"), "made")
+
+    def test_stale_while_revalidate(self):
+        self.cache.get_or_set("swr", lambda: "old", -1, stale=60)
+        # someone else is already making a new one
+        self.assertTrue(self.cache._acquire("swr", None))
+        self.assertEqual(self.cache.get_or_set("swr", lambda: "new", 60,
+                                               stale=60), "old")
+        self.cache._release("swr", None)
+        self.assertEqual(self.cache.get_or_set("swr", lambda: "new", 60,
+                                               stale=60), "new")
+        self.assertEqual(self.cache.get_or_set("swr", lambda: "newer", 60,
+                                               stale=60), "new")
@@ -0,0 +1,141 @@
+from django.test import TestCase
+from wagtail.wagtailcore.models import Page, Site
+from website.models import StreamPage, PlainPage
+from website.utils import specific_pages, resolve_links, page_url
+from website.utils import bulk_add_children
+from website import utils
+from events.models import EventIndexPage, EventIndexPageRelatedLink
+from events.models import SimpleEventPage
+
+class TestSpecificPages(TestCase):
+    def setUp(self):
+        self.root = Page.objects.get(depth=1)
+        self.root.add_child(instance=PlainPage(title="Plain 1", slug="plain-1"))
+        self.root.add_child(instance=StreamPage(title="Stream", slug="stream"))
+        self.root.add_child(instance=PlainPage(title="Plain 2", slug="plain-2"))
+
+    def test_order_and_types(self):
+        pages = list(self.root.get_children().filter(slug__in=["plain-1",
+                                                                "stream",
+                                                                "plain-2"]))
+        with self.assertNumQueries(2):
+            specifics = specific_pages(pages)
+        self.assertEqual([page.slug for page in specifics],
+                         ["plain-1", "stream", "plain-2"])
+        self.assertEqual([type(page) for page in specifics],
+                         [PlainPage, StreamPage, PlainPage])
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(specific_pages([]), [])
+
+class TestResolveLinks(TestCase):
+    def setUp(self):
+        self.root = Page.objects.get(depth=1)
+        self.home = Page.objects.get(depth=2)
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.plain = self.home.add_child(instance=PlainPage(title="Plain",
+                                                            slug="plain"))
+        EventIndexPageRelatedLink.objects.create(page=self.events,
+                                                 title="Plain",
+                                                 link_page=self.plain)
+        EventIndexPageRelatedLink.objects.create(page=self.events,
+                                                 title="Elsewhere",
+                                                 link_external="http://example.com/")
+
+    def test_links(self):
+        links = list(EventIndexPageRelatedLink.objects.filter(page=self.events)
+                                                      .order_by('id'))
+        # NB: also warms up the site root paths cache
+        expected = [self.plain.url, "http://example.com/"]
+        with self.assertNumQueries(1):
+            resolve_links(links)
+            self.assertEqual([link.link for link in links], expected)
+
+class TestPageUrls(TestCase):
+    def setUp(self):
+        self.site = Site.objects.get(is_default_site=True)
+        self.home = self.site.root_page
+        self.plain = self.home.add_child(instance=PlainPage(title="Plain",
+                                                            slug="plain"))
+        self.child = self.plain.add_child(instance=PlainPage(title="Child",
+                                                             slug="child"))
+
+    def test_relative_url(self):
+        self.assertEqual(page_url(self.child, self.site),
+                         self.child.relative_url(self.site))
+        with self.assertNumQueries(0):
+            page_url(self.plain, self.site)
+
+    def test_slug_change(self):
+        self.assertEqual(page_url(self.child, self.site), "/plain/child/")
+        self.plain.slug = "renamed"
+        self.plain.save()
+        self.assertEqual(page_url(self.child, self.site), "/renamed/child/")
+
+    def test_draft_keeps_map(self):
+        page_url(self.child, self.site)
+        self.plain.save_revision()
+        with self.assertNumQueries(0):
+            self.assertEqual(page_url(self.child, self.site), "/plain/child/")
+
+    def test_publish_keeps_map(self):
+        page_url(self.child, self.site)
+        self.plain.title = "Plain Two"
+        self.plain.save_revision().publish()
+        with self.assertNumQueries(0):
+            self.assertEqual(page_url(self.child, self.site), "/plain/child/")
+
+    def test_publish_elsewhere_keeps_map(self):
+        # the map was built by some other process
+        page_url(self.child, self.site)
+        utils._pageUrlMaps.clear()
+        self.plain.save_revision().publish()
+        with self.assertNumQueries(0):
+            self.assertEqual(page_url(self.child, self.site), "/plain/child/")
+
+    def test_move(self):
+        other = self.home.add_child(instance=PlainPage(title="Other",
+                                                       slug="other"))
+        self.assertEqual(page_url(self.child, self.site), "/plain/child/")
+        self.child.move(other, pos='last-child')
+        child = Page.objects.get(id=self.child.id)
+        self.assertEqual(page_url(child, self.site), "/other/child/")
+
+    def test_reorder(self):
+        # moving a page along its siblings changes their treebeard paths
+        other = self.home.add_child(instance=PlainPage(title="Other",
+                                                       slug="other"))
+        self.assertEqual(page_url(other, self.site), "/other/")
+        other.move(self.plain, pos='left')
+        plain = Page.objects.get(id=self.plain.id)
+        other = Page.objects.get(id=other.id)
+        self.assertEqual(page_url(other, self.site), "/other/")
+        self.assertEqual(page_url(plain, self.site), "/plain/")
+
+class TestBulkAddChildren(TestCase):
+    def setUp(self):
+        self.home = Page.objects.get(depth=2)
+        self.events = self.home.add_child(instance=EventIndexPage(title="Events",
+                                                                  slug="events"))
+        self.events.add_child(instance=SimpleEventPage(title="First",
+                                                       slug="first"))
+
+    def test_add(self):
+        children = [SimpleEventPage(title="Event {}".format(num),
+                                    slug="event-{}".format(num))
+                    for num in range(20)]
+        children.append(StreamPage(title="Stream", slug="stream"))
+        with self.assertNumQueries(7):
+            bulk_add_children(self.events, children)
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+        events = Page.objects.get(id=self.events.id)
+        self.assertEqual(events.numchild, 22)
+        self.assertEqual([page.slug for page in events.get_children()][:3],
+                         ["first", "event-0", "event-1"])
+        event = SimpleEventPage.objects.get(slug="event-5")
+        self.assertEqual(event.url, "/events/event-5/")
+        self.assertEqual(event.get_parent().id, self.events.id)
+        self.assertEqual(StreamPage.objects.get(slug="stream").id,
+                         children[-1].id)
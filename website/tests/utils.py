@@ -0,0 +1,19 @@
+from django.test import TestCase
+from django.core.cache import cache
+from wagtail.wagtailcore.models import Page, Site
+from home.models import HomePage
+
+class SiteTestCase(TestCase):
+    """
+    Starts each test with an empty cache and a new home page, self.home, as
+    the root of the default site.  Settings the pages depend on should be
+    in place before calling setUp.
+    """
+    def setUp(self):
+        cache.clear()
+        root = Page.objects.get(depth=1)
+        self.home = root.add_child(instance=HomePage(title="Home", slug="home2"))
+        # saved, not updated, so the page urls are worked out afresh
+        site = Site.objects.get(is_default_site=True)
+        site.root_page = self.home
+        site.save()
@@ -0,0 +1,242 @@
+# ------------------------------------------------------------------------------
+# Tiered cache
+# A small per-process in-memory cache (L1) in front of a shared cache (L2) such
+# as files, the database or Redis.  Also get_or_set with single-flight locking
+# and stale-while-revalidate, so that when a popular entry expires only one
+# process recomputes it while everyone else carries on.
+# ------------------------------------------------------------------------------
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'website.tieredcache.TieredCache',
+#         'OPTIONS': {'L2': 'shared',       # alias of the shared cache
+#                     'L1_TIMEOUT': 5,      # seconds an L1 copy is trusted
+#                     'L1_MAX_ENTRIES': 1000,
+#                     'LOCK_TIMEOUT': 10},  # longest we'd wait for a recompute
+#     },
+#     'shared': {...},
+# }
+#
+# NB: a value deleted or changed by another process may still be seen here for
+# up to L1_TIMEOUT seconds.
+#
+# The single-flight lock between processes is taken with the L2 cache's add,
+# so it is only as good as that.  It holds with Redis, memcached and the
+# database cache, whose add is atomic.  With FileBasedCache add is a check
+# then a set, so two processes can both get the lock now and then.  It is
+# best-effort there; the worst that happens is a value made twice.
+
+import time
+import threading
+from collections import namedtuple
+from django.core.cache import caches, DefaultCacheProxy, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+# What get_or_set stores: the value and when it goes stale
+_Fresh = namedtuple("_Fresh", "value fresh_until")
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2Alias   = options.get('L2', 'shared')
+        self.l1Timeout  = int(options.get('L1_TIMEOUT', 5))
+        self.lockTimeout = int(options.get('LOCK_TIMEOUT', 10))
+        self._l1 = LocMemCache("tiered:{}".format(location or self._l2Alias),
+                               {'TIMEOUT': self.l1Timeout,
+                                'OPTIONS': {'MAX_ENTRIES':
+                                            options.get('L1_MAX_ENTRIES', 1000)}})
+        self._localLocks = {}
+        self._localLocksLock = threading.Lock()
+
+    @property
+    def l2(self):
+        return caches[self._l2Alias]
+
+    def _l1TimeoutFor(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.l1Timeout
+        return min(timeout, self.l1Timeout)
+
+    # --------------------------------------------------------------------------
+    # The normal cache API
+    # --------------------------------------------------------------------------
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, self._timeout(timeout), version=version)
+        if added:
+            self._l1.set(key, value, self._l1TimeoutFor(timeout), version=version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        value = self._l1.get(key, version=version)
+        if value is None:
+            value = self.l2.get(key, version=version)
+            if value is None:
+                return default
+            self._l1.set(key, value, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, self._timeout(timeout), version=version)
+        self._l1.set(key, value, self._l1TimeoutFor(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._l1.delete(key, version=version)
+        self.l2.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._l1.get(key, version=version)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            fromL2 = self.l2.get_many(missing, version=version)
+            for key, value in fromL2.items():
+                self._l1.set(key, value, version=version)
+            found.update(fromL2)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set_many(data, self._timeout(timeout), version=version)
+        for key, value in data.items():
+            self._l1.set(key, value, self._l1TimeoutFor(timeout), version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1.delete(key, version=version)
+        self.l2.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return (self._l1.has_key(key, version=version) or
+                self.l2.has_key(key, version=version))
+
+    def incr(self, key, delta=1, version=None):
+        self._l1.delete(key, version=version)
+        return self.l2.incr(key, delta, version=version)
+
+    def clear(self):
+        self._l1.clear()
+        self.l2.clear()
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def _timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            return self.default_timeout
+        return timeout
+
+    # --------------------------------------------------------------------------
+    # Stampede protection
+    # --------------------------------------------------------------------------
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None,
+                   stale=0):
+        """
+        Return the value for key, calling default() to make it if need be.
+
+        Only one caller at a time, over all processes, calls default() for a
+        key; the others wait for it to finish.  If stale is given, then for
+        that many seconds after timeout the old value is still returned
+        while one caller makes a new one.
+
+        Keys used with get_or_set should not be read with plain get.
+        """
+        timeout = self._timeout(timeout)
+        entry = self.get(key, version=version)
+        now = time.time()
+        if isinstance(entry, _Fresh):
+            if entry.fresh_until is None or now < entry.fresh_until:
+                return entry.value
+            # stale, refresh it unless someone else already is
+            if self._acquire(key, version):
+                try:
+                    return self._make(key, default, timeout, version, stale)
+                finally:
+                    self._release(key, version)
+            return entry.value
+
+        with self._localLock(key):
+            # someone in this process may have just made it
+            entry = self.get(key, version=version)
+            if isinstance(entry, _Fresh):
+                return entry.value
+            deadline = now + self.lockTimeout
+            while not self._acquire(key, version):
+                if time.time() > deadline:
+                    # give up waiting, they may have died
+                    return self._make(key, default, timeout, version, stale)
+                time.sleep(0.05)
+                entry = self.l2.get(key, version=version)
+                if isinstance(entry, _Fresh):
+                    return entry.value
+            try:
+                return self._make(key, default, timeout, version, stale)
+            finally:
+                self._release(key, version)
+
+    def _make(self, key, default, timeout, version, stale):
+        value = default() if callable(default) else default
+        if timeout is None:
+            self.set(key, _Fresh(value, None), None, version=version)
+        else:
+            self.set(key, _Fresh(value, time.time() + timeout),
+                     timeout + stale, version=version)
+        return value
+
+    def _lockKey(self, key):
+        return "{}:lock".format(key)
+
+    def _acquire(self, key, version):
+        # best-effort, unless the L2 cache's add is atomic (see above)
+        return self.l2.add(self._lockKey(key), 1, self.lockTimeout,
+                           version=version)
+
+    def _release(self, key, version):
+        self.l2.delete(self._lockKey(key), version=version)
+
+    def _localLock(self, key):
+        with self._localLocksLock:
+            lock = self._localLocks.get(key)
+            if lock is None:
+                if len(self._localLocks) > 1000:
+                    self._localLocks.clear()
+                lock = self._localLocks[key] = threading.Lock()
+            return lock
+
+# ------------------------------------------------------------------------------
+def _backend(cache):
+    # django.core.cache.cache only stands in for the default backend
+    if isinstance(cache, DefaultCacheProxy):
+        return caches[DEFAULT_CACHE_ALIAS]
+    return cache
+
+def get_or_set(cache, key, default, timeout=DEFAULT_TIMEOUT, stale=0):
+    """
+    Use the get_or_set of a TieredCache, or do the simple thing if cache is
+    some other backend
+    """
+    cache = _backend(cache)
+    if isinstance(cache, TieredCache):
+        return cache.get_or_set(key, default, timeout, stale=stale)
+    value = cache.get(key)
+    if value is None:
+        value = default() if callable(default) else default
+        cache.set(key, value, timeout)
+    return value
+
+def peek(cache, key):
+    """
+    The value that get_or_set would return for key, if there is one, without
+    making it; otherwise None
+    """
+    value = cache.get(key)
+    if isinstance(value, _Fresh):
+        value = value.value
+    return value
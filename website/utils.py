@@ -0,0 +1,256 @@
+# ------------------------------------------------------------------------------
+# Website utilities
+# Helpers for working with lots of pages at once
+# ------------------------------------------------------------------------------
+
+import uuid
+from collections import defaultdict
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from wagtail.wagtailcore.models import Page, Site
+from wagtail.wagtaildocs.models import Document
+from website.tieredcache import get_or_set, peek
+
+# ------------------------------------------------------------------------------
+def specific_pages(pages):
+    """
+    Return the specific instances of pages, keeping their original order.
+
+    Page.specific costs a query per page; here the pages are grouped by
+    content type so there is only one query per type.
+    """
+    pages = list(pages)
+    idsByType = defaultdict(list)
+    for page in pages:
+        idsByType[page.content_type_id].append(page.id)
+
+    specifics = {}
+    for contentTypeId, ids in idsByType.items():
+        # ContentTypes are cached by id, so this does not query
+        model = ContentType.objects.get_for_id(contentTypeId).model_class()
+        if model is None:
+            continue
+        for specific in model._default_manager.filter(id__in=ids):
+            specifics[specific.id] = specific
+
+    return [specifics.get(page.id, page) for page in pages]
+
+# ------------------------------------------------------------------------------
+def url_from_path(url_path, root_paths):
+    """
+    The equivalent of Page.url for a url_path, given the (cached) site root
+    paths from Site.get_site_root_paths()
+    """
+    for (id, root_path, root_url) in root_paths:
+        if url_path.startswith(root_path):
+            prefix = '' if len(root_paths) == 1 else root_url
+            return prefix + reverse('wagtail_serve',
+                                    args=(url_path[len(root_path):],))
+    return None
+
+def resolve_links(links):
+    """
+    Work out the urls of a list of LinkFields, e.g. RelatedLinks, all at once.
+
+    The linked pages and documents are fetched in a query each rather than
+    one per link, and the page urls are computed from the site root paths.
+    LinkFields.link then returns the resolved value.
+    """
+    links = list(links)
+    pageIds = {link.link_page_id for link in links if link.link_page_id}
+    docIds  = {link.link_document_id for link in links if link.link_document_id}
+
+    pageUrls = {}
+    if pageIds:
+        rootPaths = Site.get_site_root_paths()
+        for id, urlPath in Page.objects.filter(id__in=pageIds)             \
+                                       .values_list('id', 'url_path'):
+            pageUrls[id] = url_from_path(urlPath, rootPaths)
+    docUrls = {}
+    if docIds:
+        for doc in Document.objects.filter(id__in=docIds):
+            docUrls[doc.id] = doc.url
+
+    for link in links:
+        if link.link_page_id in pageUrls:
+            link._resolved_link = pageUrls[link.link_page_id]
+        elif link.link_document_id in docUrls:
+            link._resolved_link = docUrls[link.link_document_id]
+        elif not link.link_page_id and not link.link_document_id:
+            link._resolved_link = link.link_external
+    return links
+
+# ------------------------------------------------------------------------------
+# Page urls
+# The url of every page as seen from each site, worked out in one pass over
+# the tree and kept in the cache.  Each process also keeps its own copy, which
+# is good for as long as the generation stored in the cache doesn't change.
+# ------------------------------------------------------------------------------
+_pageUrlMaps = {}
+PageUrlsGenKey = "website_page_urls_gen"
+
+def _url_from_path(url_path, site_id, root_paths, serve_root):
+    for (id, root_path, root_url) in root_paths:
+        if url_path.startswith(root_path):
+            prefix = '' if site_id == id else root_url
+            return prefix + serve_root + url_path[len(root_path):]
+    return None
+
+def _build_page_url_map(site_id, by='path'):
+    urlMap = {}
+    rootPaths = Site.get_site_root_paths()
+    serveRoot = reverse('wagtail_serve', args=('',))
+    for key, urlPath in Page.objects.values_list(by, 'url_path'):
+        url = _url_from_path(urlPath, site_id, rootPaths, serveRoot)
+        if url is not None:
+            urlMap[key] = url
+    return urlMap
+
+def _page_url_map_key(site_id, generation, by='path'):
+    name = "website_page_urls" if by == 'path' else "website_page_id_urls"
+    return "{}:{}:{}".format(name, site_id, generation)
+
+def _get_page_url_map(site_id, by='path'):
+    generation = cache.get(PageUrlsGenKey)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(PageUrlsGenKey, generation, None):
+            generation = cache.get(PageUrlsGenKey, generation)
+    local = _pageUrlMaps.get((site_id, by))
+    if local and local[0] == generation:
+        return local[1]
+
+    # only one process builds the map for a new generation
+    mapKey = _page_url_map_key(site_id, generation, by)
+    urlMap = get_or_set(cache, mapKey,
+                        lambda: _build_page_url_map(site_id, by),
+                        60 * 60 * 24)
+    _pageUrlMaps[(site_id, by)] = (generation, urlMap)
+    return urlMap
+
+def get_page_url_map(site):
+    """
+    Return a dict of treebeard path to url for all the pages in the tree, as
+    they would be linked to from site.  Same as Page.relative_url(site).
+    """
+    return _get_page_url_map(site.id)
+
+def get_page_id_url_map(site):
+    """
+    The same as get_page_url_map, but by page id, for things that must
+    still find a page after it has moved
+    """
+    return _get_page_url_map(site.id, 'id')
+
+def page_url(page, site):
+    """
+    The url of page relative to site, from the site's page url map
+    """
+    url = get_page_url_map(site).get(page.path)
+    if url is None:
+        # not in the tree (yet?)
+        url = page.relative_url(site)
+    return url
+
+def page_url_is_current(page):
+    """
+    True if the page url maps already have the url of page, as saved, under
+    its path.  Not so if it is new, or it or a sibling has been moved, or its
+    slug has changed.  Only looks at a map that has already been built.
+    """
+    generation = cache.get(PageUrlsGenKey)
+    if generation is None:
+        return False
+    rootPaths = Site.get_site_root_paths()
+    serveRoot = reverse('wagtail_serve', args=('',))
+    for site_id, root_path, root_url in rootPaths:
+        local = _pageUrlMaps.get((site_id, 'path'))
+        if local and local[0] == generation:
+            urlMap = local[1]
+        else:
+            urlMap = peek(cache, _page_url_map_key(site_id, generation))
+        if urlMap is not None:
+            url = _url_from_path(page.url_path, site_id, rootPaths, serveRoot)
+            return urlMap.get(page.path) == url
+    return False
+
+def clear_page_urls():
+    """
+    Forget all the page url maps; called whenever a url might have changed
+    """
+    cache.set(PageUrlsGenKey, uuid.uuid4().hex, None)
+    _pageUrlMaps.clear()
+
+# ------------------------------------------------------------------------------
+# Bulk page creation
+# ------------------------------------------------------------------------------
+def bulk_add_children(parent, children, batch_size=500):
+    """
+    Add a lot of new (unsaved, specific) pages under parent at once.
+
+    The tree paths are worked out here rather than by add_child, the Page
+    rows are bulk created, and the rows of each page type's own table are
+    then inserted directly.  So a few queries per call, rather than several
+    per page.  No signals are sent and no revisions are made; the caller
+    should clear_page_urls() and update the search index afterwards.
+    """
+    children = list(children)
+    if not children:
+        return children
+    parent = Page.objects.get(id=parent.id)
+    depth = parent.depth + 1
+    last = parent.get_last_child()
+    step = 1
+    if last is not None:
+        step = Page._str2int(last.path[-Page.steplen:]) + 1
+    now = timezone.now()
+    for num, child in enumerate(children):
+        child.path  = Page._get_path(parent.path, depth, step + num)
+        child.depth = depth
+        child.numchild = 0
+        child.url_path = "{}{}/".format(parent.url_path, child.slug)
+        child.has_unpublished_changes = False
+        if child.live:
+            child.first_published_at = child.first_published_at or now
+            child.latest_revision_created_at = now
+    Page.objects.bulk_create(children, batch_size)
+
+    # bulk_create doesn't give us the ids back, so look them up by path
+    ids = dict(Page.objects.filter(path__startswith=parent.path, depth=depth,
+                                   path__gte=children[0].path)
+                           .values_list('path', 'id'))
+    byModel = defaultdict(list)
+    for child in children:
+        child.id = ids[child.path]
+        byModel[type(child)].append(child)
+    for model, pages in byModel.items():
+        for table in reversed([model] + model._meta.get_parent_list()):
+            if table is not Page and issubclass(table, Page):
+                for start in range(0, len(pages), batch_size):
+                    _insert_rows(table, pages[start:start+batch_size])
+
+    Page.objects.filter(id=parent.id)                                   \
+                .update(numchild=F('numchild') + len(children))
+    return children
+
+def _insert_rows(model, objs):
+    """Insert the rows of model's own table for objs"""
+    fields = model._meta.local_concrete_fields
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+                quote(model._meta.db_table),
+                ", ".join(quote(field.column) for field in fields),
+                ", ".join(["%s"] * len(fields)))
+    rows = []
+    for obj in objs:
+        for parentModel, link in model._meta.parents.items():
+            setattr(obj, link.attname, obj.id)
+        rows.append([field.get_db_prep_save(field.pre_save(obj, True),
+                                            connection)
+                     for field in fields])
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
@@ -0,0 +1,9 @@
+from wagtail.wagtailcore import hooks
+from website.pagecache import serveFromCache
+
+
+@hooks.register('before_serve_page')
+def serve_from_page_cache(page, request, serve_args, serve_kwargs):
+    # for website.instrumentation, group the timings by page type
+    request.perf_route = type(page).__name__
+    return serveFromCache(page, request, serve_args, serve_kwargs)